@@ -0,0 +1,193 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009-2014, Eucalyptus Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use of this software in source and binary forms, with or
+# without modification, are permitted provided that the following conditions
+# are met:
+#
+#   Redistributions of source code must retain the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other
+#   materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Sampled chunk integrity manifests for large volumes.
+Rather than hashing a prefix of a device, a ChunkManifest describes a sample of fixed size
+chunks spread across the whole device. Each sampled chunk is filled with deterministic data
+derived from the manifest's seed and the chunk's index, so the expected md5 of any chunk can be
+recomputed from the seed alone. The manifest is compact enough to store in a single volume
+tag, ie 'v1:<seed>:<chunk_size>:<total_chunks>:<samples>:<start_chunk>:<digest>', and can be
+carried to snapshots and the volumes created from them.
+
+Chunks are sampled one per stratum (the device is split into 'samples' equal ranges) so the
+sample always covers the full length of the device. The chunks before 'start_chunk' are never
+written, 'start_chunk' is the first chunk past the volume's md5len so the head of the volume used
+for md5 tracking is left untouched.
+
+Sample usage:
+    manifest = instance.write_volume_chunk_manifest(euvolume, coverage=0.01)
+    # raises an error listing any chunks which no longer match
+    instance.verify_volume_chunks(euvolume)
+'''
+
+import hashlib
+import random
+from math import ceil
+
+
+MB = 1048576
+
+
+class ChunkManifestException(Exception):
+    pass
+
+
+class ChunkManifest(object):
+    VERSION = 'v1'
+
+    def __init__(self, seed, chunk_size, total_chunks, samples, start_chunk=1):
+        """
+        :param seed: int seed used to choose the sampled chunks and generate their contents
+        :param chunk_size: size of each chunk in bytes
+        :param total_chunks: number of chunk_size chunks on the device
+        :param samples: number of chunks sampled
+        :param start_chunk: index of the first chunk which may be sampled
+        """
+        self.seed = int(seed)
+        self.chunk_size = int(chunk_size)
+        self.total_chunks = int(total_chunks)
+        self.start_chunk = int(start_chunk)
+        self.samples = max(1, min(int(samples), self.total_chunks - self.start_chunk))
+        if self.total_chunks <= self.start_chunk:
+            raise ChunkManifestException('Device with {0} chunks of {1} bytes is too small for '
+                                         'a chunk manifest'.format(total_chunks, chunk_size))
+        self._indices = None
+        self._md5s = {}
+
+    def __repr__(self):
+        return '{0}:{1}'.format(self.__class__.__name__, self.to_tag())
+
+    @classmethod
+    def for_device(cls, device_size, coverage=0.01, chunk_size=MB, seed=None, start_chunk=1,
+                   min_samples=16):
+        """
+        Creates a manifest sampling 'coverage' (0-1) of a device of 'device_size' bytes.
+        """
+        if seed is None:
+            seed = random.randint(1, 2 ** 31)
+        total_chunks = int(device_size) / int(chunk_size)
+        samples = max(min_samples, int(ceil((total_chunks - start_chunk) * float(coverage))))
+        return cls(seed, chunk_size, total_chunks, samples, start_chunk=start_chunk)
+
+    @property
+    def indices(self):
+        """
+        Sorted list of the sampled chunk indices, derived from the seed.
+        """
+        if self._indices is None:
+            rand = random.Random(self.seed)
+            usable = self.total_chunks - self.start_chunk
+            indices = set()
+            for stratum in xrange(0, self.samples):
+                low = self.start_chunk + (stratum * usable) / self.samples
+                high = self.start_chunk + ((stratum + 1) * usable) / self.samples
+                indices.add(low + int(rand.random() * max(1, high - low)))
+            self._indices = sorted(indices)
+        return self._indices
+
+    def chunk_pattern(self, index):
+        """
+        The line repeated to fill a chunk, the guest writes it with 'yes'
+        """
+        return 'nephoria:{0}:{1}'.format(self.seed, index)
+
+    def expected_md5(self, index):
+        md5 = self._md5s.get(index)
+        if md5 is None:
+            line = self.chunk_pattern(index) + '\n'
+            data = (line * (self.chunk_size / len(line) + 1))[:self.chunk_size]
+            md5 = hashlib.md5(data).hexdigest()
+            self._md5s[index] = md5
+        return md5
+
+    @property
+    def digest(self):
+        """
+        Short digest of the manifest's expected chunk hashes, used to check a manifest parsed
+        from a tag matches the one written.
+        """
+        md5 = hashlib.md5()
+        for index in self.indices:
+            md5.update('{0}:{1}\n'.format(index, self.expected_md5(index)))
+        return md5.hexdigest()[:12]
+
+    def to_tag(self):
+        return ":".join([self.VERSION, str(self.seed), str(self.chunk_size),
+                         str(self.total_chunks), str(self.samples), str(self.start_chunk),
+                         self.digest])
+
+    @classmethod
+    def from_tag(cls, value):
+        fields = str(value).strip().split(':')
+        if len(fields) != 7 or fields[0] != cls.VERSION:
+            raise ChunkManifestException('Invalid chunk manifest tag value:"{0}"'.format(value))
+        manifest = cls(seed=fields[1], chunk_size=fields[2], total_chunks=fields[3],
+                       samples=fields[4], start_chunk=fields[5])
+        if manifest.digest != fields[6]:
+            raise ChunkManifestException('Chunk manifest digest mismatch, tag:"{0}", '
+                                         'calculated:"{1}"'.format(fields[6], manifest.digest))
+        return manifest
+
+    def _batched(self, body, parallel):
+        # Runs 'body' for each sampled index in background subshells, 'parallel' at a time.
+        return ('n=0; for i in {0}; do ( {1} ) & n=$((n+1)); '
+                'if [ $((n % {2})) -eq 0 ]; then wait; fi; done; wait'
+                .format(" ".join([str(i) for i in self.indices]), body, int(parallel)))
+
+    def build_write_cmd(self, dev, parallel=8):
+        """
+        Shell command which fills each sampled chunk of 'dev' with its deterministic pattern.
+        """
+        body = ('yes "nephoria:{0}:$i" 2>/dev/null | head -c {1} | '
+                'dd of={2} bs={1} seek=$i conv=notrunc 2>/dev/null || echo "error $i"'
+                .format(self.seed, self.chunk_size, dev))
+        return self._batched(body, parallel) + '; sync'
+
+    def build_verify_cmd(self, dev, parallel=16):
+        """
+        Shell command which prints '<index> <md5>' for each sampled chunk of 'dev'.
+        """
+        body = ('m=$(dd if={0} bs={1} skip=$i count=1 2>/dev/null | md5sum); '
+                'echo "$i ${{m%% *}}"'.format(dev, self.chunk_size))
+        return self._batched(body, parallel)
+
+    def check_verify_output(self, lines):
+        """
+        Compares the output of the verify command against the expected chunk hashes.
+        :returns list of bad chunk indices, chunks missing from the output are included
+        """
+        found = {}
+        for line in lines:
+            fields = line.split()
+            if len(fields) == 2 and fields[0].isdigit():
+                found[int(fields[0])] = fields[1]
+        return [index for index in self.indices
+                if found.get(index) != self.expected_md5(index)]
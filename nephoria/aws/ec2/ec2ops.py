@@ -71,6 +71,7 @@ from botocore.exceptions import ClientError
 from nephoria import CleanTestResourcesException
 from nephoria.baseops.botobaseops import BotoBaseOps
 from nephoria.testcase_utils import wait_for_result
+from nephoria.testcase_utils.port_prober import PortProber
 from cloud_utils.net_utils import sshconnection, ping, is_address_in_network
 from cloud_utils.log_utils import printinfo, get_traceback
 from cloud_utils.log_utils import markup, red, TextStyle, ForegroundColor, BackGroundColor
@@ -79,6 +80,7 @@ from nephoria.aws.ec2.windows_instance import WinInstance
 from nephoria.aws.ec2.euvolume import EuVolume
 from nephoria.aws.ec2.eusnapshot import EuSnapshot
 from nephoria.aws.ec2.conversiontask import ConversionTask
+from nephoria.euca.taggedresource import TagBatch, write_tags
 
 class NephoriaNetworkInterfaceCollection(NetworkInterfaceCollection):
 
@@ -335,6 +337,51 @@ disable_root: false"""
         self.log.debug("To Resources: " + str(resource_ids))
         self.connection.create_tags(resource_ids=resource_ids, tags=tags, *args, **kwargs)
 
+    def create_tags_bulk(self, resource_tags, verify=True, timeout=120, poll_interval=2,
+                         max_resources_per_call=200):
+        """
+        Add tags to many resources using batched requests. Unchanged tags are skipped,
+        resources sharing the same tags to write are tagged with a single CreateTags request and
+        the results are verified with one DescribeTags request per poll cycle.
+        See nephoria.euca.taggedresource.write_tags()
+
+        :param resource_tags:     Dict of {resource or resource id: {tag key: tag value}}
+        :param verify:            Wait for the tags to be applied
+        :param timeout:           Seconds to wait for the tags to be applied
+        :param max_resources_per_call: Max resource ids sent per request
+        :returns dict of stats
+        """
+        id_tags = {}
+        resources = {}
+        for resource, tags in resource_tags.iteritems():
+            res_id = getattr(resource, 'id', resource)
+            id_tags.setdefault(res_id, {}).update(tags)
+            if not isinstance(resource, basestring):
+                resources[res_id] = resource
+        stats = write_tags(self.connection, id_tags, verify=verify, timeout=timeout,
+                           poll_interval=poll_interval,
+                           max_resources_per_call=max_resources_per_call, log=self.log)
+        for res_id, resource in resources.iteritems():
+            if getattr(resource, 'tags', None) is not None:
+                for key, value in id_tags[res_id].iteritems():
+                    resource.tags[key] = '' if value is None else str(value)
+        self.log.debug('create_tags_bulk stats:{0}'.format(stats))
+        return stats
+
+    def tag_batch(self, verify=True, timeout=120, poll_interval=2, max_resources_per_call=200):
+        """
+        Returns a TagBatch context manager. Tags written with TaggedResource.create_tags()
+        (ie EuVolume, EuInstance, EuSnapshot) inside the 'with' block are coalesced and sent
+        in batched requests when the block exits. Worker threads join the batch with
+        TagBatch.joined().
+
+        with ec2ops.tag_batch():
+            for vol in volumes:
+                instance.md5_attached_euvolume(vol)
+        """
+        return TagBatch(verify=verify, timeout=timeout, poll_interval=poll_interval,
+                        max_resources_per_call=max_resources_per_call, log=self.log)
+
     def delete_tags(self, resource_ids, tags):
         """
         Add tags to the given resource
@@ -2040,6 +2087,8 @@ disable_root: false"""
                 cmdtime = time.time() - cmdstart
                 if vol:
                     vol = EuVolume.make_euvol_from_vol(volume=vol, ec2ops=self, cmdstart=cmdstart)
+                    vol.record_phase('create_requested', timestamp=cmdstart)
+                    vol.record_phase('create_accepted', timestamp=cmdstart + cmdtime)
                     vol.eutest_cmdstart = cmdstart
                     vol.eutest_createorder = x
                     vol.eutest_cmdtime = "{0:.2f}".format(cmdtime)
@@ -2882,6 +2931,8 @@ disable_root: false"""
                 if snapshot:
                     self.log.debug("Attempting to create snapshot #"+str(x)+ ", id:"+str(snapshot.id))
                     snapshot = EuSnapshot().make_eusnap_from_snap(snapshot, tester=self ,cmdstart=start)
+                    snapshot.record_phase('create_requested', timestamp=start)
+                    snapshot.record_phase('create_accepted', timestamp=start + cmdtime)
                     #Append some attributes for tracking snapshot through creation and test lifecycle.
                     snapshot.eutest_polls = 0
                     snapshot.eutest_poll_count = poll_count
@@ -2893,6 +2944,8 @@ disable_root: false"""
                     snapshot.eutest_cmdtime = "{0:.2f}".format(cmdtime)
                     snapshot.eutest_volume_md5 = volume.md5
                     snapshot.eutest_volume_md5len = volume.md5len
+                    snapshot.eutest_volume_chunk_manifest = getattr(volume, 'chunk_manifest',
+                                                                    None)
                     snapshot.eutest_volume_zone = volume.zone
                     
                     snapshot.update()
@@ -5232,9 +5285,33 @@ disable_root: false"""
         while waiting and (elapsed < timeout):
             self.log.debug("Checking "+str(len(waiting))+" instance ssh connections...")
             elapsed = int(time.time()-start)
+            # Probe the management ports of all instances at once, only instances with a
+            # reachable port are worth a connection attempt this round
+            probe_start = time.time()
+            probe_targets = []
+            for instance in waiting:
+                if instance.auto_connect and instance.ip_address:
+                    if isinstance(instance, WinInstance):
+                        probe_targets.append((instance.ip_address, instance.rdp_port))
+                        probe_targets.append((instance.ip_address, instance.winrm_port))
+                    else:
+                        probe_targets.append((instance.ip_address, 22))
+            reachable = []
+            if probe_targets:
+                prober = PortProber(probe_targets, log=self.log)
+                probe_results = prober.probe(timeout=max(1, min(poll_interval,
+                                                                timeout - elapsed)),
+                                             require='host')
+                reachable = [r['host'] for r in probe_results if r['status'] == prober.OPEN]
             for instance in waiting:
                 self.log.debug('Checking instance:'+str(instance.id)+" ...")
                 if instance.auto_connect and instance.ip_address:
+                    if instance.ip_address not in reachable:
+                        self.log.debug('{0}: No management port reachable at {1} yet. Time '
+                                       'remaining before timeout:{2}'
+                                       .format(instance.id, instance.ip_address,
+                                               int(timeout) - int(elapsed)))
+                        continue
                     try:
                         if isinstance(instance, WinInstance):
                             #First try checking the RDP and WINRM ports for access...
@@ -5248,7 +5325,6 @@ disable_root: false"""
                                 str(self.does_instance_sec_group_allow(instance,
                                                                        protocol='tcp',
                                                                        port=instance.rdp_port)))
-                            instance.poll_for_ports_status(timeout=1)
                             instance.connect_to_instance(timeout=15)
                             self.log.debug("Connected to instance:"+str(instance.id))
                             good.append(instance)
@@ -5290,7 +5366,8 @@ disable_root: false"""
                     waiting.remove(instance)
             elapsed = int(time.time()-start)
             if waiting and (elapsed < timeout):
-                time.sleep(poll_interval)
+                # The port probe may have already used up some or all of this interval
+                time.sleep(max(0, poll_interval - (time.time() - probe_start)))
             else:
                 break
                 
@@ -45,6 +45,7 @@ Sample usage:
     testinstance.sys('yum install ntpd')
 '''
 
+from concurrent.futures import ThreadPoolExecutor
 from boto.ec2.instance import Instance, InstanceState
 from boto.ec2.networkinterface import NetworkInterface
 from boto.exception import EC2ResponseError
@@ -57,8 +58,14 @@ from cloud_utils.system_utils.machine import Machine
 from cloud_utils.log_utils import get_traceback, markup, TextStyle, ForegroundColor, red, \
     BackGroundColor
 from nephoria.aws.ec2.euvolume import EuVolume
+from nephoria.aws.ec2.chunk_manifest import ChunkManifest
+from nephoria.aws.ec2.ssh_session import SshSessionManager
+from nephoria.aws.ec2.volume_benchmark import VolumeBenchmark, \
+    show_volume_benchmark_results, MB, GB
 from nephoria.euca.taggedresource import TaggedResource
-from nephoria.testcase_utils import wait_for_result
+from nephoria.testcase_utils import wait_for_result, sudo_sh_cmd
+from nephoria.testcase_utils.port_prober import PortProber
+from math import ceil
 from random import randint
 from prettytable import PrettyTable, ALL
 from datetime import datetime
@@ -66,6 +73,9 @@ import os
 import re
 import time
 import copy
+import threading
+import socket
+import struct
 import types
 import operator
 
@@ -111,9 +121,16 @@ class EuInstance(Instance, TaggedResource, Machine):
         newins.bdm_root_vol = None
         newins.attached_vols = []
         newins.scsidevs = []
+        newins._reserved_devs = set()
+        newins._dev_lock = threading.Lock()
+        newins._block_inventory = None
+        newins._block_dev_generation = 0
+        newins._net_inventory = None
+        newins._net_dev_generation = 0
         newins.ops = None
         newins.log = None
         newins.ssh = None
+        newins._ssh_manager = None
         newins.laststate = None
         newins.laststatetime = None
         newins.age_at_state = None
@@ -540,28 +557,61 @@ class EuInstance(Instance, TaggedResource, Machine):
         else:
             return buf
 
-    def reset_ssh_connection(self, timeout=None):
+    @property
+    def ssh_manager(self):
+        '''
+        SshSessionManager running this instance's guest commands over a single kept alive
+        ssh transport, reconnecting it when it drops. See show_ssh_stats() for per command
+        latency.
+        '''
+        manager = getattr(self, '_ssh_manager', None)
+        if manager is None:
+            manager = SshSessionManager(connect=self._reconnect_ssh, log=self.log, name=self.id)
+            self._ssh_manager = manager
+        if self.ssh is not manager.ssh:
+            manager.attach(self.ssh)
+        return manager
+
+    def _new_ssh_connection(self, timeout=None):
         timeout = int(timeout or self.timeout or 0)
+        self.log.debug('Connecting ssh ' + str(self.id))
+        return SshConnection(self.ip_address,
+                             keypair=self.keypair,
+                             keypath=self.keypath,
+                             password=self.password,
+                             username=self.username,
+                             timeout=timeout,
+                             banner_timeout=timeout,
+                             retry=self.retry,
+                             logger=self.log,
+                             verbose=self.verbose)
+
+    def _reconnect_ssh(self):
+        # Used by the ssh_manager to replace a dropped connection
+        if self.ssh is not None:
+            try:
+                self.ssh.close()
+            except Exception as CE:
+                self.log.debug('Error closing dropped ssh connection:{0}'.format(CE))
+        self.ssh = self._new_ssh_connection(timeout=15)
+        return self.ssh
+
+    def reset_ssh_connection(self, timeout=None):
         self.log.debug('reset_ssh_connection for:' + str(self.id))
         if ((self.keypath is not None) or
                 ((self.username is not None) and (self.password is not None))):
             if self.ssh is not None:
                 self.ssh.close()
-            self.log.debug('Connecting ssh ' + str(self.id))
-            self.ssh = SshConnection(self.ip_address,
-                                     keypair=self.keypair,
-                                     keypath=self.keypath,
-                                     password=self.password,
-                                     username=self.username,
-                                     timeout=timeout,
-                                     banner_timeout=timeout,
-                                     retry=self.retry,
-                                     logger=self.log,
-                                     verbose=self.verbose)
+            self.ssh = self._new_ssh_connection(timeout=timeout)
+            self.ssh_manager.attach(self.ssh)
         else:
             self.log.debug("keypath or username/password need to be populated "
                        "for ssh connection")
 
+    def show_ssh_stats(self, printmethod=None, printme=True):
+        return self.ssh_manager.show_stats(printmethod=printmethod or self.log.info,
+                                           printme=printme)
+
     def get_reservation(self):
         res = None
         try:
@@ -751,7 +801,7 @@ class EuInstance(Instance, TaggedResource, Machine):
                                         enable_debug=enable_debug,
                                         timeout=timeout)
 
-        return self.ssh.sys(cmd, verbose=verbose, code=code, timeout=timeout)
+        return self.ssh_manager.run('sys', cmd, verbose=verbose, code=code, timeout=timeout)
 
     def sys_with_su(self, cmd, verbose=True, enable_debug=False, code=None,
                     prompt='^Password:', username='root', password=None, retry=0,
@@ -836,12 +886,7 @@ class EuInstance(Instance, TaggedResource, Machine):
                       timeout=120,
                       retry=0):
         password = password or self.exec_password
-        if re.search("'", cmd):
-            delim = '"'
-        else:
-            delim = "'"
-
-        cmd = "sudo sh -c " + delim + str(cmd) + delim
+        cmd = sudo_sh_cmd(cmd)
         return self.cmd_expect_password(cmd,
                                         password=password,
                                         prompt=prompt,
@@ -870,19 +915,19 @@ class EuInstance(Instance, TaggedResource, Machine):
         if (self.ssh is None):
             raise Exception("Euinstance ssh connection is None")
         password = password or self.exec_password
-        return self.ssh.cmd(cmd,
-                            verbose=verbose,
-                            timeout=timeout,
-                            listformat=listformat,
-                            cb=self.ssh.expect_password_cb,
-                            cbargs=[password,
-                                    prompt,
-                                    cb,
-                                    cbargs,
-                                    retry,
-                                    0,
-                                    enable_debug],
-                            get_pty=get_pty)
+        return self.ssh_manager.run('cmd', cmd,
+                                    verbose=verbose,
+                                    timeout=timeout,
+                                    listformat=listformat,
+                                    cb=self.ssh.expect_password_cb,
+                                    cbargs=[password,
+                                            prompt,
+                                            cb,
+                                            cbargs,
+                                            retry,
+                                            0,
+                                            enable_debug],
+                                    get_pty=get_pty)
 
     '''
     def start_interactive_ssh(self, timeout=180):
@@ -942,75 +987,205 @@ class EuInstance(Instance, TaggedResource, Machine):
                 return self.cmd_with_su(cmd, verbose=verbose, timeout=timeout,
                                         enable_debug=enable_debug, listformat=listformat,
                                         cb=cb, cbargs=cbargs, get_pty=get_pty)
-        return self.ssh.cmd(cmd, verbose=verbose, timeout=timeout, listformat=listformat,
-                            cb=cb, cbargs=cbargs, get_pty=get_pty)
+        return self.ssh_manager.run('cmd', cmd, verbose=verbose, timeout=timeout,
+                                    listformat=listformat, cb=cb, cbargs=cbargs, get_pty=get_pty)
+
+    def stream(self, cmd, timeout=120, try_non_root_exec=None, get_pty=False,
+               include_stderr=True, **kwargs):
+        """
+        Runs a command 'cmd' within an ssh connection, returning an OutputStream which yields
+        the output lines as they are received rather than a list of all of them once the
+        command has finished. Only the last lines of output are kept (see OutputStream), so
+        long running or verbose commands use constant memory.
+        Sample usage:
+            stream = instance.stream('dmesg', match='I/O error', code=0)
+            for line in stream:
+                self.log.debug(line)
+            if stream.match:
+                ...
+        :param cmd: - mandatory - string representing the command to be run
+        :param timeout: - optional - seconds to wait for the command to finish
+        :param try_non_root_exec: - optional - boolean, if set and the instance's user is not
+                                  root the command is run with sudo
+        :param get_pty: - optional - boolean, request a pty for the command
+        :param include_stderr: - optional - boolean, include stderr in the output
+        :param kwargs: - optional - passed to OutputStream, ie code, match, stop_on_match,
+                       max_line_length, tail_lines
+        :returns OutputStream
+        """
+        if (self.ssh is None):
+            raise Exception("{0}: Euinstance ssh connection is None".format(self.id))
+        stdin = None
+        if self.username != 'root' and try_non_root_exec:
+            if not self.use_sudo:
+                raise ValueError('{0}: Streaming commands as a non root user requires sudo'
+                                 .format(self.id))
+            # Password is read from stdin with no prompt so it is not mixed into the output
+            cmd = sudo_sh_cmd(cmd, sudo="sudo -S -p ''")
+            stdin = str(self.exec_password) + "\n"
+        kwargs.setdefault('log', self.log)
+        return self.ssh_manager.stream(cmd, timeout=timeout, get_pty=get_pty,
+                                       include_stderr=include_stderr, stdin=stdin, **kwargs)
 
     def found(self, command, regex, verbose=True):
         """ Returns a Boolean of whether the result of the command contains the regex"""
-        result = self.sys(command, verbose=verbose  )
-        for line in result:
-            found = re.search(regex, line)
-            if found:
-                return True
-        return False
+        # Stops reading and closes the command as soon as a line matches
+        stream = self.stream(command, match=regex)
+        for line in stream:
+            if verbose:
+                self.log.debug(line)
+        return stream.match is not None
+
+    def invalidate_block_inventory(self):
+        '''
+        Marks the cached guest block device inventory as stale. Called after volume attach and
+        detach operations and reboots, the next inventory lookup will re-read the guest.
+        '''
+        self._block_dev_generation = getattr(self, '_block_dev_generation', 0) + 1
 
-    def get_dev_dir(self, match=None):
+    def get_block_inventory(self, refresh=False, check_udev=False, retries=3):
+        '''
+        Returns a dict of the guest's sd, vd, xd, and xvd block devices (including partitions)
+        keyed by device name, ie 'vdb'. Each value is a dict with the keys:
+        'name', 'dev', 'serial', 'size' (bytes), 'wwn', 'pttype', 'mountpoint', 'partition'.
+        All devices are gathered with a single remote command and the results are cached until
+        invalidate_block_inventory() is called (on attach, detach, reboot, etc).
+
+        :param refresh: boolean, if True re-read the inventory from the guest
+        :param check_udev: boolean, if True compare the guest's udev event sequence number with
+                           the one read with the cached inventory and refresh if it has changed.
+                           Catches devices added or removed outside of this instance's methods.
+        :param retries: number of attempts to read the inventory from the guest
+        :returns dict of {'<dev name>': {device info dict}}
+        '''
+        generation = getattr(self, '_block_dev_generation', 0)
+        inventory = getattr(self, '_block_inventory', None)
+        if inventory is None or getattr(self, '_block_inventory_gen', None) != generation:
+            refresh = True
+        if not refresh and check_udev:
+            seqnum = self.sys('cat /sys/kernel/uevent_seqnum', verbose=False)
+            if not seqnum or seqnum[0].strip() != getattr(self, '_block_inventory_seqnum', None):
+                refresh = True
+        if not refresh:
+            return inventory
+        # One line per device; 'dev|name|serial|size in 512b sectors|wwn|pttype|mount|partition'
+        cmd = ('echo "seqnum|$(cat /sys/kernel/uevent_seqnum 2>/dev/null)"; '
+               'for p in /sys/class/block/sd* /sys/class/block/vd* /sys/class/block/xd* '
+               '/sys/class/block/xvd*; do [ -e "$p" ] || continue; d=${p##*/}; '
+               's=$(cat $p/serial $p/device/serial 2>/dev/null | head -n1); '
+               'w=$(cat $p/wwid $p/device/wwid 2>/dev/null | head -n1); '
+               'z=$(cat $p/size 2>/dev/null); '
+               't=$(blkid -o value -s PTTYPE /dev/$d 2>/dev/null); '
+               'm=$(grep "^/dev/$d " /proc/mounts | cut -d" " -f2 | head -n1); '
+               'if [ -e $p/partition ]; then r=1; else r=0; fi; '
+               'echo "dev|$d|$s|$z|$w|$t|$m|$r"; done')
+        out = None
+        err = None
+        for attempt in xrange(0, retries):
+            try:
+                out = self.sys(cmd, code=0, verbose=False)
+                break
+            except Exception as E:
+                err = E
+                self.log.warning('{0}\nError reading guest block inventory, attempt:{1}/{2}, '
+                                 'err:"{3}"'.format(get_traceback(), attempt + 1, retries, E))
+                time.sleep(1)
+        if out is None:
+            raise RuntimeError('{0}: Failed to read guest block inventory, err:{1}'
+                               .format(self.id, err))
+        inventory = {}
+        seqnum = None
+        for line in out:
+            fields = line.strip().split('|')
+            if fields[0] == 'seqnum' and len(fields) == 2:
+                seqnum = fields[1].strip()
+            elif fields[0] == 'dev' and len(fields) == 8:
+                name = fields[1].strip()
+                size = fields[3].strip()
+                inventory[name] = {'name': name,
+                                   'dev': '/dev/' + name,
+                                   'serial': fields[2].strip() or None,
+                                   'size': int(size) * 512 if size.isdigit() else None,
+                                   'wwn': fields[4].strip() or None,
+                                   'pttype': fields[5].strip() or None,
+                                   'mountpoint': fields[6].strip() or None,
+                                   'partition': fields[7].strip() == '1'}
+        self._block_inventory = inventory
+        self._block_inventory_gen = generation
+        self._block_inventory_seqnum = seqnum
+        self.log.debug('Read guest block inventory, {0} devices:"{1}"'
+                       .format(len(inventory), ", ".join(sorted(inventory.keys()))))
+        return inventory
+
+    def get_block_dev_info(self, block_dev, refresh=False):
+        '''
+        Returns the inventory dict for a guest block device (see get_block_inventory()) or
+        None if the device is not found. The cached inventory is only used if the guest's udev
+        sequence number has not changed since it was read, and a device missing from it
+        triggers a single refresh before giving up.
+        :param block_dev: device name or path, ie 'vdb' or '/dev/vdb'
+        '''
+        block_dev = os.path.basename(str(block_dev))
+        info = self.get_block_inventory(refresh=refresh, check_udev=True).get(block_dev)
+        if info is None and not refresh:
+            info = self.get_block_inventory(refresh=True).get(block_dev)
+        return info
+
+    def show_block_inventory(self, refresh=False, printmethod=None, printme=True):
+        pt = PrettyTable(['DEV', 'SERIAL', 'SIZE', 'WWN', 'PTTYPE', 'MOUNT'])
+        pt.align = 'l'
+        inventory = self.get_block_inventory(refresh=refresh)
+        for name in sorted(inventory.keys()):
+            info = inventory[name]
+            pt.add_row([info['dev'], info['serial'], info['size'], info['wwn'],
+                        info['pttype'], info['mountpoint']])
+        if not printme:
+            return pt
+        printmethod = printmethod or self.log.info
+        printmethod("\n" + str(pt) + "\n")
+
+    def get_dev_dir(self, match=None, refresh=True):
         '''
         Attempts to return a list of devices in /dev which match the given grep criteria
-        By default will attempt to match self.block_device_prefix if populated, otherwise will
-        try to match sd,vd, and xd device prefixes.
+        By default will return the sd, vd, xd, and xvd devices from the guest block
+        inventory (see get_block_inventory()).
         returns a list of matching dev names.
         match - optional - string used in grep search of /dev dir on instance
+        refresh - optional - boolean, re-read the block inventory from the guest. If False the
+                  cached inventory is used unless the guest's udev sequence number changed.
         '''
-        retlist = []
         if match is None:
-            match = '^sd\|^vd\|^xd\|^xvd'
+            return sorted(self.get_block_inventory(refresh=refresh, check_udev=True).keys())
+        retlist = []
         out = self.sys("ls -1 /dev/ | grep '" + str(match) + "'")
         for line in out:
             retlist.append(line.strip())
         return retlist
 
-    def get_serials_for_block_devices(self, retries=3):
-        devs = []
+    def get_serials_for_block_devices(self, retries=3, refresh=True):
         serials = {}
-        E = None
-        for retry in xrange(0, retries):
-            cmd = 'ls -1 /sys/class/block | grep "^sd\|^vd\|^xd\|^xvd"'
-            try:
-                devs = self.sys(cmd, code=0)
-            except Exception as E:
-                self.log.warning('{0}\nFailed to execute cmd:"{1}", attempt:{2}/{3}, err:"{4}"'
-                                 .format(get_traceback(), cmd, retry, retries, E))
-                self.log.debug('retrying cmd: "{0}"'.format(cmd))
-                time.sleep(1)
-        if not devs and E:
-            raise E
-        for dev in devs:
-            try:
-                out = self.sys('cat /sys/class/block/{0}/device/block/{0}/serial'
-                               .format(dev), code=0)
-                if out:
-                    serials[dev] = out[0]
-            except CommandExitCodeException as CE:
-                self.log.debug(CE)
+        for dev, info in self.get_block_inventory(refresh=refresh, check_udev=True,
+                                                  retries=retries).iteritems():
+            if info['serial']:
+                serials[dev] = info['serial']
         return serials
 
     def get_serial_for_block_device(self, block_dev, retries=3):
         block_dev = os.path.basename(block_dev)
         E = None
         for x in xrange(0, retries):
+            info = None
             try:
-                serials = self.get_serials_for_block_devices()
+                info = self.get_block_dev_info(block_dev, refresh=bool(x))
             except Exception as E:
                 self.log.debug('{0}\nError fetching serial for block dev:{1} , attempt:{2}/{3}. '
                                'ERR:{4}'
                                .format(get_traceback(), block_dev, x, retries, E))
-            if block_dev not in serials:
-                self.log.debug('Block dev:{0} not found in serial dict:{1}, attempt:{2}/{3}'
-                               .format(block_dev, serials, x, retries))
-
+            if not info or not info['serial']:
+                self.log.debug('Block dev:{0} serial not found in block inventory, '
+                               'attempt:{1}/{2}'.format(block_dev, x, retries))
             else:
-                return serials[block_dev]
+                return info['serial']
         if E:
             self.log.error("{0}\nError fetching serial for block dev:{1}"
                            .format(get_traceback(), block_dev))
@@ -1018,15 +1193,18 @@ class EuInstance(Instance, TaggedResource, Machine):
         else:
             raise ValueError('No serial found for block device:{0}'.format(block_dev))
 
-    def find_block_dev_by_serial(self, serial, partial_match=True, retries=2):
+    def find_block_dev_by_serial(self, serial, partial_match=True, retries=2, refresh=False):
         if partial_match:
             search_method = re.search
         else:
             search_method = re.match
-        for dev, value in self.get_serials_for_block_devices(retries=retries).iteritems():
-            if value and search_method(serial, value):
-                self.log.debug('Found device:{0} for serial:{1}'.format(dev, serial))
-                return dev
+        # Search the cached inventory first, re-read the guest once if the serial is not found
+        for refresh in sorted(set([refresh, True])):
+            for dev, value in self.get_serials_for_block_devices(
+                    retries=retries, refresh=refresh).iteritems():
+                if value and search_method(serial, value):
+                    self.log.debug('Found device:{0} for serial:{1}'.format(dev, serial))
+                    return dev
         self.log.debug('No device found for serial string:{0}'.format(serial))
         return None
 
@@ -1056,7 +1234,7 @@ class EuInstance(Instance, TaggedResource, Machine):
 
 
     def attach_euvolume(self, euvolume, dev=None, srcdev='/dev/zero', write_len=32, md5_len=None,
-                        timeout=180, gb_timeout=120, overwrite=False):
+                        timeout=180, gb_timeout=120, overwrite=False, chunk_coverage=None):
         '''
         Method used to attach a volume to an instance and track it's use by that instance
         required - euvolume - the euvolume object being attached
@@ -1068,6 +1246,8 @@ class EuInstance(Instance, TaggedResource, Machine):
         optional - write_len - int length in bytes to write signature into volume upon attach
         optional - md5_len - int length in bytes to read for md5 of volume upon attach
         optional - gb_timeout -int time to allow per gb to be written to volume
+        optional - chunk_coverage - fraction (0-1) of the volume to sample with a chunk manifest
+                  when new head data is written, see vol_write_random_data_get_md5()
         '''
         if not isinstance(euvolume, EuVolume):
             raise Exception("Volume needs to be of type euvolume, try attach_volume() instead?")
@@ -1076,16 +1256,27 @@ class EuInstance(Instance, TaggedResource, Machine):
                    str(self.id) + " to dev:" + str(dev))
         md5_len = md5_len or write_len
         # grab a snapshot of our devices before attach for comparison purposes
-        dev_list_before = self.get_dev_dir()
+        dev_list_before = self.get_dev_dir(refresh=True)
         dev_list_after = []
         attached_dev = None
         start = time.time()
         elapsed = 0
+        reserved_dev = None
         if dev is None:
             # update our block device prefix, detect if virtio is now in use
             self.set_block_device_prefix()
-            dev = self.get_free_scsi_dev()
-        if (self.ec2ops.attach_volume(self, euvolume, dev, pause=10, timeout=timeout)):
+            dev = self.get_free_scsi_dev(reserve=True)
+            reserved_dev = dev
+        euvolume.record_phase('attach_requested', overwrite=True)
+        euvolume.clear_phases('attached', 'guest_visible')
+        try:
+            attached = self.ec2ops.attach_volume(self, euvolume, dev, pause=10, timeout=timeout)
+        finally:
+            self.invalidate_block_inventory()
+            if reserved_dev:
+                self.release_scsi_dev(reserved_dev)
+        if attached:
+            euvolume.record_phase('attached')
             if euvolume.attach_data.device != dev:
                 raise Exception('Attached device:' + str(euvolume.attach_data.device) +
                                 ", does not equal requested dev:" + str(dev))
@@ -1094,13 +1285,16 @@ class EuInstance(Instance, TaggedResource, Machine):
             while (not euvolume.guestdev and elapsed < timeout):
                 self.log.debug("Checking for volume attachment on guest, elapsed time(" +
                            str(elapsed) + ")")
-                dev_list_after = self.get_dev_dir()
+                # Re-read the guest's block inventory once per poll, the serial lookup below
+                # is then served from the same snapshot
+                dev_list_after = self.get_dev_dir(refresh=True)
                 self.log.debug("dev_list_after:" + " ".join(dev_list_after))
                 if self.is_dir('/sys/class/block/'):
                     guest_dev = self.get_volume_guest_dev_by_serial(euvolume)
                     if guest_dev:
                         attached_dev = os.path.join('/dev/', guest_dev)
                         euvolume.guestdev = attached_dev
+                        euvolume.record_phase('guest_visible')
                         self.log.debug("Volume:{0} ,guest device:{1}"
                                        .format(euvolume.id, euvolume.guestdev))
                         self.attached_vols.append(euvolume)
@@ -1117,6 +1311,7 @@ class EuInstance(Instance, TaggedResource, Machine):
                         devlist = str(diff[0]).split('/')
                         attached_dev = '/dev/' + devlist[len(devlist) - 1]
                         euvolume.guestdev = attached_dev.strip()
+                        euvolume.record_phase('guest_visible')
                         self.log.debug(
                             "Volume:" + str(euvolume.id) + " guest device:" + str(euvolume.guestdev))
                         self.attached_vols.append(euvolume)
@@ -1142,7 +1337,8 @@ class EuInstance(Instance, TaggedResource, Machine):
             try:
                 self.vol_write_random_data_get_md5(euvolume, srcdev=srcdev, length=write_len,
                                                    md5_len=md5_len, timepergig=gb_timeout,
-                                                   overwrite=overwrite)
+                                                   overwrite=overwrite,
+                                                   chunk_coverage=chunk_coverage)
                 return True
             except:
                 self.log.debug("\n" + str(get_traceback()) +
@@ -1169,7 +1365,9 @@ class EuInstance(Instance, TaggedResource, Machine):
         for vol in self.attached_vols:
             if vol.id == euvolume.id:
                 dev = vol.guestdev
-                if (self.ec2ops.detach_volume(euvolume, timeout=timeout)):
+                detached = self.ec2ops.detach_volume(euvolume, timeout=timeout)
+                self.invalidate_block_inventory()
+                if detached:
                     if waitfordev:
                         self.log.debug("Wait for device:" + str(dev) + " to be removed on guest...")
                         while (elapsed < timeout):
@@ -1479,63 +1677,83 @@ class EuInstance(Instance, TaggedResource, Machine):
             retlist.append(vol.guestdev)
         return retlist
 
-    def get_free_scsi_dev(self, prefix=None, maxdevs=100):
+    def get_used_dev_names(self):
+        '''
+        Returns a set of the device names in use by this instance from a single snapshot of
+        the cloud's volume attachments (one DescribeVolumes call), the instance's block device
+        mapping, the test's attached volume list, the guest's own block devices, and any
+        names reserved by attaches still in progress.
+        '''
+        used = set()
+        for vol in self.connection.get_all_volumes(
+                filters={'attachment.instance-id': self.id}) or []:
+            if vol.attach_data and vol.attach_data.device:
+                used.add(str(vol.attach_data.device))
+        for vol in self.attached_vols:
+            if vol.attach_data and vol.attach_data.device:
+                used.add(str(vol.attach_data.device))
+        for dev_name in (self.block_device_mapping or {}).iterkeys():
+            used.add(str(dev_name))
+        if self.ssh:
+            try:
+                for dev_name in self.get_dev_dir():
+                    used.add('/dev/' + dev_name)
+            except Exception as E:
+                self.log.debug('Ignoring error fetching guest devices:{0}'.format(E))
+        used.update(getattr(self, '_reserved_devs', None) or [])
+        return used
+
+    def _get_dev_lock(self):
+        if getattr(self, '_dev_lock', None) is None:
+            self._dev_lock = threading.Lock()
+            self._reserved_devs = set()
+        return self._dev_lock
+
+    @staticmethod
+    def _candidate_dev_names(prefix, maxdevs=100):
+        # sde..sdz, then sdaa..sdzz
+        letters = [chr(c) for c in xrange(ord('a'), ord('z') + 1)]
+        suffixes = letters[letters.index('e'):]
+        suffixes += [a + b for a in letters for b in letters]
+        for suffix in suffixes[:maxdevs]:
+            yield "/dev/" + prefix + suffix
+
+    def get_free_scsi_dev(self, prefix=None, maxdevs=100, reserve=False):
         '''
         The volume attach command requires a cloud level device name that is not currently
         associated with a volume
         Note: This is the device name from the clouds perspective, not necessarily the guest's
-        This method attempts to find a free device name to use in the command
+        This method attempts to find a free device name to use in the command. The names in use
+        are gathered once per call (see get_used_dev_names()) rather than per candidate name.
         optional - prefix - string, pre-pended to the the device search string
         optional - maxdevs - number use to specify the max device names to iterate over.
                    Some virt envs have a limit of 16 devs.
+        optional - reserve - boolean, if True the returned name is reserved so concurrent
+                   attaches to this instance are not handed the same name. Release it with
+                   release_scsi_dev() once the attach has completed or failed.
         '''
-        d = 'e'
-        in_use_cloud = ""
-        in_use_guest = ""
-        dev = None
         if prefix is None:
             prefix = self.block_device_prefix
         self.update()
-        cloudlist = self.ec2ops.get_volumes(attached_instance=self.id)
-
-        for x in xrange(0, maxdevs):
-            inuse = False
-            # double up the letter identifier to avoid exceeding z
-            if d == 'z':
-                prefix = prefix + 'e'
-            dev = "/dev/" + prefix + str(d)
-            for avol in self.attached_vols:
-                try:
-                    avol.update()
-                except EC2ResponseError as E:
-                    self.log.debug('{0}\nIgnoring error on volume update:{1}'
-                                   .format(get_traceback(), E))
-                if avol.attach_data and avol.attach_data.device == dev:
-                    inuse = True
-                    in_use_guest += str(avol.id) + ", "
-                    continue
-            # Check to see if the cloud has a conflict with this device name...
-            for vol in cloudlist:
-                try:
-                    vol.update()
-                except EC2ResponseError as ER:
-                    if ER.status == 400:
-                        continue
-                if (vol.attach_data is not None) and (vol.attach_data.device == dev):
-                    inuse = True
-                    in_use_cloud += str(vol.id) + ", "
-                    continue
-            if inuse is False:
-                self.log.debug("Instance:" + str(self.id) + " returning available cloud scsi dev:" +
-                           str(dev))
-                return str(dev)
-            else:
-                d = chr(ord('e') + x)  # increment the letter we append to the device string prefix
-                dev = None
-        if dev is None:
-            raise Exception("Could not find a free scsi dev on instance:" + self.id +
-                            ", maxdevs:" + str(maxdevs) + "\nCloud_devs:" + str(in_use_cloud) +
-                            "\nGuest_devs:" + str(in_use_guest))
+        with self._get_dev_lock():
+            used = self.get_used_dev_names()
+            for dev in self._candidate_dev_names(prefix, maxdevs=maxdevs):
+                if dev not in used:
+                    if reserve:
+                        self._reserved_devs.add(dev)
+                    self.log.debug("Instance:" + str(self.id) +
+                                   " returning available cloud scsi dev:" + str(dev))
+                    return str(dev)
+        raise Exception("Could not find a free scsi dev on instance:" + self.id +
+                        ", maxdevs:" + str(maxdevs) + "\nDevs in use:" +
+                        ", ".join(sorted(used)))
+
+    def release_scsi_dev(self, dev):
+        '''
+        Release a device name reserved by get_free_scsi_dev(reserve=True)
+        '''
+        with self._get_dev_lock():
+            self._reserved_devs.discard(dev)
 
     def zero_fill_volume(self, euvolume):
         '''
@@ -1623,8 +1841,40 @@ class EuInstance(Instance, TaggedResource, Machine):
         '''
         return self.dd_monitor(ddcmd=ddcmd, poll_interval=poll_interval, tmpfile=tmpfile)
 
+    def benchmark_volume(self, euvolume, patterns=None, block_sizes=None, iodepths=1,
+                         runtime=30, offset=None, size=None, engine=None):
+        '''
+        Runs a guest side block benchmark against an attached euvolume, see
+        nephoria.aws.ec2.volume_benchmark.VolumeBenchmark for argument details.
+        Write patterns overwrite data in the benchmark region, by default the head of the
+        volume used for md5 checks is left untouched. A chunk manifest with sampled chunks in
+        the region is cleared, see clear_volume_chunk_manifest().
+        :returns list of result dicts with MB/s, IOPS and latency percentiles (ms) per
+                 pattern, block size and queue depth
+        '''
+        if euvolume not in self.attached_vols:
+            raise Exception(self.id + " Did not find this in instance's attached list. "
+                                      "Can not benchmark this euvolume")
+        return VolumeBenchmark(self, euvolume, patterns=patterns, block_sizes=block_sizes,
+                               iodepths=iodepths, runtime=runtime, offset=offset,
+                               size=size or GB, engine=engine, log=self.log).run()
+
+    def benchmark_attached_volumes(self, printme=True, **kwargs):
+        '''
+        Benchmarks each of this instance's attached volumes in turn.
+        :param printme: boolean, show a table of the results
+        :param kwargs: benchmark_volume() keyword args
+        :returns list of result dicts
+        '''
+        results = []
+        for euvolume in self.attached_vols:
+            results.extend(self.benchmark_volume(euvolume, **kwargs))
+        if printme:
+            show_volume_benchmark_results(results, printmethod=self.log.info)
+        return results
+
     def vol_write_random_data_get_md5(self, euvolume, srcdev=None, length=32, md5_len=None,
-                                      timepergig=120, overwrite=False):
+                                      timepergig=120, overwrite=False, chunk_coverage=None):
         '''
         Attempts to copy some amount of data into an attached volume, and return the md5sum of
         that volume.
@@ -1639,6 +1889,10 @@ class EuInstance(Instance, TaggedResource, Machine):
                     timeout period
         overwrite - optional - boolean. write to volume regardless of whether existing data
                     is found
+        chunk_coverage - optional - fraction (0-1) of the volume's chunks to sample. When new
+                    data is written a chunk manifest is written past the md5 head as well,
+                    see write_volume_chunk_manifest(). A previous manifest overlapped by the new
+                    head data is cleared.
         '''
         md5_len = md5_len or length
         voldev = euvolume.guestdev.strip()
@@ -1661,15 +1915,24 @@ class EuInstance(Instance, TaggedResource, Machine):
                                             timepergig=timepergig)
             # length = dd_dict['dd_bytes']
         else:
+            wrote = None
             self.log.debug("Volume has existing data, skipping random data fill")
+        if wrote is not None and getattr(euvolume, 'chunk_manifest', None):
+            manifest = ChunkManifest.from_tag(euvolume.chunk_manifest)
+            if not length or length > manifest.start_chunk * manifest.chunk_size:
+                self.clear_volume_chunk_manifest(euvolume)
         # Calculate checksum of euvolume attached device for given length
         md5 = self.md5_attached_euvolume(euvolume, timepergig=timepergig, length=md5_len)
         self.log.debug("Filled Volume:" + euvolume.id + " dev:" + voldev + " md5:" + md5)
+        if wrote is not None and chunk_coverage:
+            # Written while euvolume.md5len still spans the md5'd head
+            self.write_volume_chunk_manifest(euvolume, coverage=chunk_coverage)
         euvolume.md5 = md5
         euvolume.md5len = length
         return md5
 
-    def md5_attached_euvolume(self, euvolume, timepergig=120, length=None, updatevol=True):
+    def md5_attached_euvolume(self, euvolume, timepergig=120, length=None, updatevol=True,
+                              chunk_manifest=None):
         '''
         Calculates an md5sum of the first 'length' bytes of the dev representing the attached
         euvolume.
@@ -1681,13 +1944,19 @@ class EuInstance(Instance, TaggedResource, Machine):
                      calcuating timeout
         length - optional - number bytes to read from the head of the device file used in md5 calc
         updatevol - optional - boolean used to update the euvolume data or not
+        chunk_manifest - optional - also verify the volume's sampled chunks against this
+                    ChunkManifest or manifest tag, ie snapshot.eutest_volume_chunk_manifest.
+                    If True the euvolume's own manifest is used. See verify_volume_chunks().
         '''
         if length is None:
             length = euvolume.md5len
+        euvolume.record_phase('md5_start', overwrite=True)
+        euvolume.clear_phases('md5_complete')
         try:
             voldev = euvolume.guestdev
             timeout = euvolume.size * timepergig
             md5 = self.get_dev_md5(voldev, length, timeout)
+            euvolume.record_phase('md5_complete')
             self.log.debug("Got MD5 for Volume:" + euvolume.id + " dev:" + voldev + " md5:" + md5)
             if updatevol:
                 euvolume.md5 = md5
@@ -1698,9 +1967,112 @@ class EuInstance(Instance, TaggedResource, Machine):
             raise Exception(str(self.id) + ": Failed to md5 attached volume: " + str(e))
         euvolume.md5 = md5
         euvolume.md5len = length
-        euvolume.create_tags({euvolume.tag_md5_key:md5, euvolume.tag_md5len_key: length})
+        tags = {euvolume.tag_md5_key:md5, euvolume.tag_md5len_key: length}
+        if chunk_manifest:
+            if chunk_manifest is True:
+                chunk_manifest = None
+            manifest = self.verify_volume_chunks(euvolume, manifest=chunk_manifest)
+            if updatevol:
+                # A volume verified against its source's manifest carries it on, ie to its
+                # own snapshots
+                euvolume.chunk_manifest = manifest.to_tag()
+                tags[euvolume.tag_chunk_manifest_key] = euvolume.chunk_manifest
+        euvolume.create_tags(tags)
         return md5
 
+    def write_volume_chunk_manifest(self, euvolume, coverage=0.01, chunk_size=MB, seed=None,
+                                    parallel=8, timeout=None, verify=True):
+        '''
+        Writes deterministic data into a sample of chunks spread across the entire attached
+        euvolume and stores the resulting compact manifest on the euvolume (and its
+        'chunk_manifest' tag). See nephoria.aws.ec2.chunk_manifest.
+        Sampling starts at the first chunk past the euvolume's md5len so the head of the volume
+        used for md5 checks is left untouched. Volumes whose md5 covers the entire device
+        (md5len of 0 or None) are refused.
+        :param euvolume: attached euvolume
+        :param coverage: fraction (0-1) of the volume's chunks to sample
+        :param chunk_size: size in bytes of each sampled chunk
+        :param seed: optional int seed, random by default
+        :param parallel: number of chunks written at once on the guest
+        :param timeout: timeout for the remote write, defaults to 120 seconds per sampled GB
+        :param verify: boolean, read the chunks back after writing them
+        :returns ChunkManifest
+        '''
+        md5len = int(getattr(euvolume, 'md5len', None) or 0)
+        if getattr(euvolume, 'md5', None) and not md5len:
+            raise ValueError('Vol:{0} md5 covers the entire device, a chunk manifest would '
+                             'overwrite it'.format(euvolume.id))
+        voldev = euvolume.guestdev.strip()
+        self.assertFilePresent(voldev)
+        start_chunk = max(1, int(ceil(md5len / float(chunk_size))))
+        manifest = ChunkManifest.for_device(self.get_blockdev_size_in_bytes(voldev),
+                                            coverage=coverage, chunk_size=chunk_size, seed=seed,
+                                            start_chunk=start_chunk)
+        sampled = len(manifest.indices) * manifest.chunk_size
+        timeout = timeout or max(120, 120 * sampled / GB)
+        self.log.debug('Writing {0} chunks ({1} bytes) across vol:{2} dev:{3}, manifest:{4}'
+                       .format(len(manifest.indices), sampled, euvolume.id, voldev,
+                               manifest.to_tag()))
+        out = self.sys(manifest.build_write_cmd(voldev, parallel=parallel), code=0,
+                       timeout=timeout, verbose=False)
+        errors = [line for line in out if line.startswith('error')]
+        if errors:
+            raise RuntimeError('{0}: Failed to write {1} chunks to vol:{2} dev:{3}, errors:{4}'
+                               .format(self.id, len(errors), euvolume.id, voldev, errors[:10]))
+        euvolume.chunk_manifest = manifest.to_tag()
+        if verify:
+            self.verify_volume_chunks(euvolume, manifest=manifest, timeout=timeout)
+        euvolume.create_tags({euvolume.tag_chunk_manifest_key: euvolume.chunk_manifest})
+        return manifest
+
+    def clear_volume_chunk_manifest(self, euvolume):
+        '''
+        Drops the chunk manifest of a euvolume whose sampled chunks are about to be, or have
+        been, overwritten, ie by new head data or a write benchmark.
+        '''
+        if not getattr(euvolume, 'chunk_manifest', None):
+            return
+        self.log.debug('Clearing chunk manifest:{0} of vol:{1}'
+                       .format(euvolume.chunk_manifest, euvolume.id))
+        euvolume.chunk_manifest = None
+        euvolume.delete_tags({euvolume.tag_chunk_manifest_key: None})
+
+    def verify_volume_chunks(self, euvolume, manifest=None, parallel=16, timeout=None):
+        '''
+        Re-reads the sampled chunks of an attached euvolume in parallel on the guest and
+        compares them against a chunk manifest. Volumes created from a snapshot can be checked
+        against the source volume's manifest, ie snapshot.eutest_volume_chunk_manifest.
+        :param euvolume: attached euvolume
+        :param manifest: ChunkManifest or manifest tag string, defaults to the euvolume's
+        :param parallel: number of chunks read at once on the guest
+        :param timeout: timeout for the remote read, defaults to 120 seconds per sampled GB
+        :returns ChunkManifest, raises an exception listing the bad chunks on failure
+        '''
+        manifest = manifest or getattr(euvolume, 'chunk_manifest', None)
+        if not manifest:
+            raise ValueError('No chunk manifest provided or found for vol:{0}'
+                             .format(euvolume.id))
+        if not isinstance(manifest, ChunkManifest):
+            manifest = ChunkManifest.from_tag(manifest)
+        voldev = euvolume.guestdev.strip()
+        self.assertFilePresent(voldev)
+        sampled = len(manifest.indices) * manifest.chunk_size
+        timeout = timeout or max(120, 120 * sampled / GB)
+        start = time.time()
+        out = self.sys(manifest.build_verify_cmd(voldev, parallel=parallel), code=0,
+                       timeout=timeout, verbose=False)
+        bad_chunks = manifest.check_verify_output(out)
+        elapsed = time.time() - start
+        if bad_chunks:
+            raise RuntimeError('{0}: vol:{1} dev:{2}, {3}/{4} sampled chunks failed '
+                               'verification, bad chunk indices (chunk size:{5}):{6}'
+                               .format(self.id, euvolume.id, voldev, len(bad_chunks),
+                                       len(manifest.indices), manifest.chunk_size,
+                                       bad_chunks[:50]))
+        self.log.debug('Verified {0} chunks ({1} bytes) of vol:{2} dev:{3} in {4:.2f} seconds'
+                       .format(len(manifest.indices), sampled, euvolume.id, voldev, elapsed))
+        return manifest
+
     def get_dev_md5(self, devpath, length, retries=3, timeout=60):
         self.assertFilePresent(devpath)
         err = ""
@@ -1742,6 +2114,102 @@ class EuInstance(Instance, TaggedResource, Machine):
                 time.sleep(2)
         raise RuntimeError('get_dev_md5 error:{0}'.format(err))
 
+    def scan_block_dev_md5s(self, lengths, devices=None, timeout=120, retries=2):
+        '''
+        Calculates the md5sum of the first 'length' bytes of every candidate block device for
+        each of the provided lengths, using a single remote command. The devices are hashed in
+        parallel on the guest rather than with one ssh round trip per device.
+        Devices which could not be read are left out of the results.
+
+        :param lengths: int or list of ints, number of bytes to read from the head of each
+                        device. A length of 0 or None hashes the entire device.
+        :param devices: optional list of device names/paths to hash, defaults to all sd, vd,
+                        xd, and xvd devices in /dev
+        :param timeout: timeout in seconds for the remote command
+        :returns dict of {length: {'/dev/<name>': md5}}
+        '''
+        if not isinstance(lengths, (list, tuple, set)):
+            lengths = [lengths]
+        lengths = sorted(set([int(l or 0) for l in lengths]))
+        if devices is None:
+            dev_glob = '/dev/sd* /dev/vd* /dev/xd* /dev/xvd*'
+        else:
+            dev_glob = " ".join(['/dev/' + os.path.basename(str(d).strip())
+                                 for d in devices if d])
+        results = dict((l, {}) for l in lengths)
+        if not dev_glob:
+            return results
+        # Each (device, length) is hashed in a background subshell, output lines are
+        # '<length> <device> <md5>'. A read of zero bytes for a non-zero length produces the
+        # md5 of an empty string and is treated as a failed read.
+        cmd = ('for d in {0}; do [ -b "$d" ] || continue; for l in {1}; do '
+               '( if [ "$l" -eq 0 ]; then m=$(md5sum "$d" 2>/dev/null); '
+               'else m=$(head -c "$l" "$d" 2>/dev/null | md5sum); fi; '
+               'echo "$l $d ${{m%% *}}" ) & done; done; wait'
+               .format(dev_glob, " ".join([str(l) for l in lengths])))
+        empty_md5 = 'd41d8cd98f00b204e9800998ecf8427e'
+        out = None
+        err = None
+        for attempt in xrange(0, retries):
+            try:
+                out = self.sys(cmd, code=0, timeout=timeout, verbose=False)
+                break
+            except Exception as E:
+                err = E
+                self.log.warning('{0}\nError scanning block device md5s, attempt:{1}/{2}, '
+                                 'err:"{3}"'.format(get_traceback(), attempt + 1, retries, E))
+                time.sleep(2)
+        if out is None:
+            raise RuntimeError('scan_block_dev_md5s error:{0}'.format(err))
+        for line in out:
+            fields = line.split()
+            if len(fields) != 3:
+                continue
+            length, dev, md5 = fields
+            if len(md5) != 32 or (md5 == empty_md5 and int(length)):
+                continue
+            if int(length) in results:
+                results[int(length)][dev] = md5
+        self.log.debug('Scanned md5s for {0} devices, lengths:{1}'
+                       .format(len(set([d for l in results.values() for d in l])), lengths))
+        return results
+
+    def get_md5_scan_candidates(self, devices=None):
+        '''
+        Returns the whole disk device names from 'devices' which could be an attached volume
+        when searching by md5. Partitions and the disk holding the root filesystem are left
+        out, a full length md5 of those only costs time.
+
+        :param devices: list of device names, defaults to every device in the block inventory
+        :returns list of device names, ie ['vdb', 'vdc']
+        '''
+        inventory = self.get_block_inventory()
+        root_devs = set([os.path.basename(str(self.rootfs_device or ''))])
+        for name, info in inventory.iteritems():
+            if info['mountpoint'] == '/':
+                root_devs.add(name)
+                disks = [d for d in inventory if d != name and name.startswith(d) and
+                         not inventory[d]['partition']]
+                if disks:
+                    root_devs.add(max(disks, key=len))
+        if devices is None:
+            devices = inventory.keys()
+        candidates = []
+        for dev in devices:
+            name = os.path.basename(str(dev).strip())
+            info = inventory.get(name)
+            if name in root_devs or (info and info['partition']):
+                continue
+            candidates.append(name)
+        return candidates
+
+    def get_dev_md5_map(self, length, devices=None, timeout=120):
+        '''
+        Returns a dict of {'/dev/<name>': md5} for the first 'length' bytes of each candidate
+        block device, gathered with a single remote command. See scan_block_dev_md5s().
+        '''
+        return self.scan_block_dev_md5s(length, devices=devices, timeout=timeout)[int(length or 0)]
+
     def reboot_instance_and_verify(self,
                                    waitconnect=30,
                                    timeout=360,
@@ -1785,6 +2253,8 @@ class EuInstance(Instance, TaggedResource, Machine):
                                                "unsync'd volumes")
         self.log.debug('Rebooting now...')
         self.reboot()
+        self.invalidate_block_inventory()
+        self.invalidate_network_inventory()
         time.sleep(waitconnect)
         timeout = timeout - int(time.time() - start)
         while elapsed < timeout:
@@ -1884,6 +2354,291 @@ class EuInstance(Instance, TaggedResource, Machine):
                 buf += str(bv.id) + ","
             raise Exception("Volume(s) were not found on guest:" + str(buf))
 
+    def _find_guest_dev_for_volume(self, euvolume, inventory, claimed):
+        serial = euvolume.id[:12]
+        for name, info in inventory.iteritems():
+            if name not in claimed and info['serial'] and re.search(serial, info['serial']):
+                return name
+        return None
+
+    def _match_new_guest_devs(self, euvolumes, inventory, baseline, claimed):
+        '''
+        For guests which do not expose volume serials. Matches cloud attached volumes to whole
+        disk devices which have appeared since 'baseline', only where the match is not
+        ambiguous: a single new device and volume, or a device whose size is unique among the
+        new devices and volumes.
+        :returns dict of {volume id: guest dev name}
+        '''
+        new_devs = [name for name, info in inventory.iteritems()
+                    if name not in baseline and name not in claimed and not info['partition']
+                    and not (info['serial'] and 'vol-' in info['serial'])]
+        if not new_devs or not euvolumes:
+            return {}
+        if len(new_devs) == 1 and len(euvolumes) == 1:
+            return {euvolumes[0].id: new_devs[0]}
+        gig = 1073741824
+        matches = {}
+        for euvolume in euvolumes:
+            size = int(euvolume.size) * gig
+            devs = [name for name in new_devs if inventory[name]['size'] == size]
+            vols = [vol for vol in euvolumes if int(vol.size) * gig == size]
+            if len(devs) == 1 and len(vols) == 1:
+                matches[euvolume.id] = devs[0]
+        return matches
+
+    def attach_euvolumes_pipelined(self, euvolumes, max_in_flight=4, max_workers=4,
+                                   timeout=300, poll_interval=2, write_len=32, md5_len=None,
+                                   overwrite=False, write_data=True, printme=True):
+        '''
+        Attaches a list of volumes keeping up to 'max_in_flight' attach requests outstanding.
+        Each poll cycle uses a single DescribeVolumes request for all outstanding volumes and a
+        single guest block inventory scan to find newly visible devices, matched by serial or,
+        on guests not exposing volume serials, by the devices added since the first scan.
+        As each volume's guest device appears the next attach is issued, while the data write
+        and md5 step for the ready volume runs in a pool of 'max_workers' threads. The pool
+        and the poll loop share the instance's ssh session, so their guest commands are run
+        one at a time, the overlap is with attaches still in progress on the cloud side.
+
+        :param euvolumes: list of volumes to attach, non-euvolumes are converted
+        :param max_in_flight: max attach requests outstanding which are not yet guest visible
+        :param max_workers: max volumes having data written and hashed at once
+        :param timeout: seconds allowed for each volume to become visible on the guest
+        :param poll_interval: seconds between poll cycles
+        :param write_len: bytes written to the head of each volume, see
+                          vol_write_random_data_get_md5()
+        :param md5_len: bytes of the volume head to md5, defaults to write_len
+        :param overwrite: write to volumes with existing data
+        :param write_data: boolean, if False skip the write/md5 step
+        :param printme: boolean, show the per volume timing table
+        :returns list of per volume result dicts with the keys: volume, dev, guestdev,
+                 attach_start, cloud_attached, guest_visible, write_md5, error. attach_start is
+                 the seconds elapsed from the start of the call to the volume's attach request,
+                 cloud_attached and guest_visible are seconds elapsed from the attach request
+                 and write_md5 is the duration of the write/md5 step.
+                 Volumes not visible on the guest within 'timeout' are detached again.
+        '''
+        euvolumes = [vol if isinstance(vol, EuVolume) else
+                     EuVolume.make_euvol_from_vol(vol, self.ec2ops) for vol in euvolumes]
+        results = {}
+        # Epoch time of each volume's attach request
+        attach_times = {}
+        pending = list(euvolumes)
+        in_flight = {}
+        futures = {}
+        # Guards the guest commands of the poll loop and the write/md5 workers
+        guest_lock = threading.Lock()
+        claimed = set([os.path.basename(str(vol.guestdev)) for vol in self.attached_vols
+                       if vol.guestdev])
+        self.set_block_device_prefix()
+        # Devices present before any attach, new ones are matched when there are no serials
+        baseline = set(self.get_block_inventory(refresh=True).keys())
+        pipeline_start = time.time()
+
+        def write_md5(euvolume, result, batch):
+            with guest_lock:
+                start = time.time()
+                with batch.joined():
+                    self.vol_write_random_data_get_md5(euvolume, length=write_len,
+                                                       md5_len=md5_len, overwrite=overwrite)
+                result['write_md5'] = time.time() - start
+
+        # The md5 tags of every volume are written together once all are attached
+        with self.ec2ops.tag_batch() as tag_batch:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                while pending or in_flight:
+                    # Issue attaches up to the in-flight limit
+                    while pending and len(in_flight) < max_in_flight:
+                        euvolume = pending.pop(0)
+                        attach_times[euvolume.id] = time.time()
+                        result = {'volume': euvolume.id, 'dev': None, 'guestdev': None,
+                                  'attach_start': attach_times[euvolume.id] - pipeline_start,
+                                  'cloud_attached': None, 'guest_visible': None,
+                                  'write_md5': None, 'error': None}
+                        results[euvolume.id] = result
+                        try:
+                            result['dev'] = self.get_free_scsi_dev(reserve=True)
+                            self.log.debug('Sending attach for {0} to {1} at dev:{2}'
+                                           .format(euvolume.id, self.id, result['dev']))
+                            euvolume.attach(self.id, result['dev'])
+                            in_flight[euvolume.id] = euvolume
+                        except Exception as E:
+                            result['error'] = 'Attach request failed:{0}'.format(E)
+                            if result['dev']:
+                                self.release_scsi_dev(result['dev'])
+                    if not in_flight:
+                        continue
+                    time.sleep(poll_interval)
+                    now = time.time()
+                    # One DescribeVolumes request for every outstanding volume
+                    for vol in self.connection.get_all_volumes(volume_ids=in_flight.keys()):
+                        euvolume = in_flight[vol.id]
+                        result = results[vol.id]
+                        euvolume.status = vol.status
+                        euvolume.attach_data = vol.attach_data
+                        if (result['cloud_attached'] is None and vol.attach_data and
+                                vol.attach_data.status == 'attached'):
+                            result['cloud_attached'] = now - attach_times[vol.id]
+                    # One guest inventory scan for every outstanding volume
+                    with guest_lock:
+                        inventory = self.get_block_inventory(refresh=True)
+                    found = {}
+                    for vol_id, euvolume in in_flight.iteritems():
+                        guest_dev = self._find_guest_dev_for_volume(euvolume, inventory,
+                                                                    claimed.union(found.values()))
+                        if guest_dev:
+                            found[vol_id] = guest_dev
+                    unmatched = [euvolume for vol_id, euvolume in in_flight.iteritems()
+                                 if vol_id not in found and
+                                 results[vol_id]['cloud_attached'] is not None]
+                    found.update(self._match_new_guest_devs(unmatched, inventory, baseline,
+                                                            claimed.union(found.values())))
+                    for vol_id, euvolume in in_flight.items():
+                        result = results[vol_id]
+                        guest_dev = found.get(vol_id)
+                        if guest_dev:
+                            claimed.add(guest_dev)
+                            result['guest_visible'] = now - attach_times[vol_id]
+                            result['guestdev'] = '/dev/' + guest_dev
+                            euvolume.guestdev = result['guestdev']
+                            euvolume.clouddev = result['dev']
+                            self.attached_vols.append(euvolume)
+                            self.log.debug('{0} visible on guest at:{1}, after:{2:.2f}s'
+                                           .format(vol_id, euvolume.guestdev,
+                                                   result['guest_visible']))
+                            if write_data:
+                                futures[vol_id] = executor.submit(write_md5, euvolume, result,
+                                                                  tag_batch)
+                        elif now - attach_times[vol_id] > timeout:
+                            result['error'] = ('Not visible on guest after {0} seconds, cloud '
+                                               'attached:{1}'.format(timeout,
+                                                                     result['cloud_attached']))
+                            # Do not leave the volume attached but untracked by this instance
+                            try:
+                                euvolume.detach()
+                                result['error'] += ', detach requested'
+                            except Exception as DE:
+                                self.log.error('{0}\nFailed to detach timed out volume:{1}, err:{2}'
+                                               .format(get_traceback(), vol_id, DE))
+                                result['error'] += ', detach failed:{0}'.format(DE)
+                        else:
+                            continue
+                        self.release_scsi_dev(result['dev'])
+                        in_flight.pop(vol_id)
+                for vol_id, future in futures.iteritems():
+                    try:
+                        future.result()
+                    except Exception as E:
+                        self.log.error('{0}\nWrite/md5 failed for {1}:{2}'
+                                       .format(get_traceback(), vol_id, E))
+                        results[vol_id]['error'] = 'Write/md5 failed:{0}'.format(E)
+        results = [results[vol.id] for vol in euvolumes if vol.id in results]
+        if printme:
+            self.show_volume_pipeline_results(results)
+        errors = ["{0}:{1}".format(r['volume'], r['error']) for r in results if r['error']]
+        if errors:
+            raise Exception('{0}: {1}/{2} volumes failed pipelined attach:\n{3}'
+                            .format(self.id, len(errors), len(results), "\n".join(errors)))
+        return results
+
+    def detach_euvolumes_pipelined(self, euvolumes=None, max_in_flight=4, timeout=300,
+                                   poll_interval=2, printme=True):
+        '''
+        Detaches a list of volumes keeping up to 'max_in_flight' detach requests outstanding.
+        Each poll cycle uses a single DescribeVolumes request and a single guest block
+        inventory scan. A volume is done once the cloud no longer shows it in-use and its
+        device is gone from the guest.
+
+        :param euvolumes: list of attached euvolumes, defaults to all of self.attached_vols
+        :param max_in_flight: max detach requests outstanding
+        :param timeout: seconds allowed for each volume to detach
+        :param poll_interval: seconds between poll cycles
+        :param printme: boolean, show the per volume timing table
+        :returns list of per volume result dicts with the keys: volume, guestdev,
+                 detach_start, cloud_detached, guest_removed, error.
+        '''
+        if euvolumes is None:
+            euvolumes = list(self.attached_vols)
+        results = {}
+        pending = list(euvolumes)
+        in_flight = {}
+        while pending or in_flight:
+            while pending and len(in_flight) < max_in_flight:
+                euvolume = pending.pop(0)
+                result = {'volume': euvolume.id, 'guestdev': euvolume.guestdev,
+                          'detach_start': time.time(), 'cloud_detached': None,
+                          'guest_removed': None, 'error': None}
+                results[euvolume.id] = result
+                try:
+                    self.log.debug('Sending detach for {0} from {1}'.format(euvolume.id,
+                                                                            self.id))
+                    euvolume.detach()
+                    in_flight[euvolume.id] = euvolume
+                except Exception as E:
+                    result['error'] = 'Detach request failed:{0}'.format(E)
+            if not in_flight:
+                continue
+            time.sleep(poll_interval)
+            now = time.time()
+            for vol in self.connection.get_all_volumes(volume_ids=in_flight.keys()):
+                euvolume = in_flight[vol.id]
+                result = results[vol.id]
+                euvolume.status = vol.status
+                euvolume.attach_data = vol.attach_data
+                if result['cloud_detached'] is None and vol.status != 'in-use':
+                    result['cloud_detached'] = now - result['detach_start']
+            inventory = self.get_block_inventory(refresh=True)
+            for vol_id, euvolume in in_flight.items():
+                result = results[vol_id]
+                guestdev = os.path.basename(str(euvolume.guestdev or ''))
+                if result['guest_removed'] is None and guestdev not in inventory:
+                    result['guest_removed'] = now - result['detach_start']
+                if result['cloud_detached'] is not None and result['guest_removed'] is not None:
+                    if euvolume in self.attached_vols:
+                        self.attached_vols.remove(euvolume)
+                elif now - result['detach_start'] > timeout:
+                    result['error'] = ('Detach not complete after {0} seconds, cloud '
+                                       'detached:{1}, guest removed:{2}'
+                                       .format(timeout, result['cloud_detached'],
+                                               result['guest_removed']))
+                else:
+                    continue
+                in_flight.pop(vol_id)
+        results = [results[vol.id] for vol in euvolumes if vol.id in results]
+        if printme:
+            self.show_volume_pipeline_results(results)
+        errors = ["{0}:{1}".format(r['volume'], r['error']) for r in results if r['error']]
+        if errors:
+            raise Exception('{0}: {1}/{2} volumes failed pipelined detach:\n{3}'
+                            .format(self.id, len(errors), len(results), "\n".join(errors)))
+        return results
+
+    def show_volume_pipeline_results(self, results, printmethod=None, printme=True):
+        '''
+        Shows the per volume timing results of attach_euvolumes_pipelined() or
+        detach_euvolumes_pipelined()
+        '''
+        def fmt(value):
+            if value is None:
+                return '-'
+            return '{0:.2f}'.format(value)
+
+        if results and 'detach_start' in results[0]:
+            pt = PrettyTable(['VOLUME', 'GUESTDEV', 'CLOUD DETACHED', 'GUEST REMOVED', 'ERROR'])
+            for r in results:
+                pt.add_row([r['volume'], r['guestdev'], fmt(r['cloud_detached']),
+                            fmt(r['guest_removed']), r['error'] or ''])
+        else:
+            pt = PrettyTable(['VOLUME', 'DEV', 'GUESTDEV', 'CLOUD ATTACHED', 'GUEST VISIBLE',
+                              'WRITE/MD5', 'ERROR'])
+            for r in results:
+                pt.add_row([r['volume'], r['dev'], r['guestdev'], fmt(r['cloud_attached']),
+                            fmt(r['guest_visible']), fmt(r['write_md5']), r['error'] or ''])
+        pt.align = 'l'
+        if not printme:
+            return pt
+        printmethod = printmethod or self.log.info
+        printmethod("\n" + str(pt) + "\n")
+
     def get_unsynced_volumes(self, euvol_list=None, md5length=32, timepervol=90, min_polls=2,
                              check_md5=False):
         '''
@@ -1914,12 +2669,13 @@ class EuInstance(Instance, TaggedResource, Machine):
         attached_vol_list = []
         checked_vdevs = []
         poll_count = 0
-        dev_list = self.get_dev_dir()
+        dev_list = self.get_dev_dir(refresh=True)
         found = False
         self.log.debug("Checking for volumes whos state is not in sync with our instance's "
                        "test state...")
         guest_volumes = []
-        serials = self.get_serials_for_block_devices() or {}
+        # The inventory was just re-read by get_dev_dir() above
+        serials = self.get_serials_for_block_devices(refresh=False) or {}
         # parse out the cloud volume ids into a list to check against the cloud's view...
         for dev, serial in serials.iteritems():
             m = re.match("^euca-(vol-\w.*)-", serial)
@@ -1978,6 +2734,12 @@ class EuInstance(Instance, TaggedResource, Machine):
                 raise GUEST_ERR
         self.log.debug('Checking the clouds attached volumes list to see if these are still '
                        'present on the guest...')
+        # Snapshot of {md5len: {dev: md5}} for all candidate guest devices shared by all the
+        # volumes being checked, refreshed only when a volume is not found in it. Full length
+        # md5s (md5len 0/None) are only gathered for each volume's own candidate devices.
+        md5_snapshot = {}
+        md5_lengths = [int(getattr(vol, 'md5len', None) or 0) for vol in attached_vol_list]
+        md5_lengths = [l for l in md5_lengths if l]
         for vol in attached_vol_list:
             self.log.debug("Checking volume:" + str(vol.id))
             try:
@@ -2031,6 +2793,18 @@ class EuInstance(Instance, TaggedResource, Machine):
                                     devlist = [dev]
                                 else:
                                     devlist = self.get_dev_dir()
+                                md5len = int(vol.md5len or 0)
+                                if md5len:
+                                    if md5len not in md5_snapshot:
+                                        md5_snapshot.update(self.scan_block_dev_md5s(
+                                            md5_lengths + [md5len]))
+                                else:
+                                    full_md5s = md5_snapshot.setdefault(0, {})
+                                    scan_devs = [d for d in self.get_md5_scan_candidates(devlist)
+                                                 if '/dev/' + d not in full_md5s]
+                                    if scan_devs:
+                                        full_md5s.update(self.scan_block_dev_md5s(
+                                            0, devices=scan_devs)[0])
                                 for vdev in devlist:
                                     vdev = "/dev/" + str(vdev)
 
@@ -2039,7 +2813,7 @@ class EuInstance(Instance, TaggedResource, Machine):
                                     if vdev not in checked_vdevs:
                                         self.log.debug('Checking ' + str(vdev) +
                                                    " for match against euvolume:" + str(vol.id))
-                                        md5 = self.get_dev_md5(vdev, vol.md5len)
+                                        md5 = md5_snapshot[md5len].get(vdev)
                                         self.log.debug('comparing ' + str(md5) + ' vs ' + str(vol.md5))
                                         if md5 == vol.md5:
                                             self.log.debug('Found match at dev:' + str(vdev))
@@ -2073,6 +2847,9 @@ class EuInstance(Instance, TaggedResource, Machine):
                             break
                         self.log.debug('Local device for volume:' + str(vol.id) +
                                    ' not found. Sleeping and checking again...')
+                        # Re-scan the guest devices on the next attempt
+                        md5_snapshot = {}
+                        checked_vdevs = []
                         time.sleep(10)
                         elapsed = int(time.time() - start)
                     if not found:
@@ -2121,10 +2898,11 @@ class EuInstance(Instance, TaggedResource, Machine):
                 if str(euvolume.guestdev).endswith(vdev):
                     vdevs.remove(vdev)
                     vdevs.insert(0, vdev)
+        # Hash all the candidate devices with a single remote command
+        md5_map = self.get_dev_md5_map(md5len, devices=vdevs)
         for vdev in vdevs:
             vdev = '/dev/' + str(vdev).replace('/dev/', '')
-            self.log.debug('Checking ' + str(vdev) + " for a matching block device")
-            block_md5 = self.get_dev_md5(vdev, md5len)
+            block_md5 = md5_map.get(vdev)
             self.log.debug('comparing dev' + str(vdev) + ': ' + str(block_md5) + ' vs vol:' + str(md5))
             if block_md5 == md5:
                 self.log.debug('Found match at dev:' + str(vdev))
@@ -2404,6 +3182,9 @@ class EuInstance(Instance, TaggedResource, Machine):
         raise Exception('Could not find ephemeral device?')
 
     def get_blockdev_size_in_bytes(self, devpath):
+        info = self.get_block_dev_info(devpath)
+        if info and info['size'] is not None:
+            return info['size']
         bytes = self.sys('blockdev --getsize64 ' + str(devpath), code=0)[0]
         return int(bytes)
 
@@ -2558,69 +3339,152 @@ class EuInstance(Instance, TaggedResource, Machine):
                            str(meta_devices.get(meta_dev)) + "' (Not found in Instance's BDM)"
             raise Exception(err_buf)
 
-    def get_network_device_info(self, name=None, prefix='/sys/class/net/'):
+    def invalidate_network_inventory(self):
+        """
+        Marks the cached guest network device inventory as stale. Called after ENI attach and
+        detach requests, reboots and guest side network changes (ie ifconfig, network service
+        restarts), the next inventory lookup will re-read the guest.
+        """
+        self._net_dev_generation = getattr(self, '_net_dev_generation', 0) + 1
+
+    def _get_eni_attachment_state(self):
+        # Signature of the ENI attachments last reported for this instance, the cached network
+        # inventory is refreshed when it changes.
+        state = []
+        for interface in self.interfaces or []:
+            attachment = getattr(interface, 'attachment', None)
+            state.append((interface.id, getattr(attachment, 'id', None),
+                          getattr(attachment, 'status', None)))
+        return sorted(state)
+
+    @staticmethod
+    def _get_cidr_for_address(addr, prefix_len):
+        # ie '10.1.2.3', 24 -> '10.1.2.0/24'
+        mask = (0xffffffff << (32 - int(prefix_len))) & 0xffffffff
+        addr_int = struct.unpack('!I', socket.inet_aton(addr))[0]
+        return '{0}/{1}'.format(socket.inet_ntoa(struct.pack('!I', addr_int & mask)), prefix_len)
+
+    def get_network_inventory(self, refresh=False, prefix='/sys/class/net/', retries=3):
+        """
+        Returns a dict of the guest's network devices keyed by device name, ie 'eth0'. Each
+        value is a dict with the keys: 'name', 'address' (MAC), 'operstate', 'mtu', 'driver',
+        'ipv4' and 'ipv6' (lists of 'addr/prefix' strings).
+        All devices are gathered with a single remote command and the results are cached until
+        the ENI attachments reported for this instance change, or invalidate_network_inventory()
+        is called (on ENI attach, detach, reboot, etc).
+
+        :param refresh: boolean, if True re-read the inventory from the guest
+        :param prefix: sysfs network class dir on the guest
+        :param retries: number of attempts to read the inventory from the guest
+        :returns dict of {'<dev name>': {device info dict}}
+        """
+        generation = getattr(self, '_net_dev_generation', 0)
+        eni_state = self._get_eni_attachment_state()
+        inventory = getattr(self, '_net_inventory', None)
+        if (inventory is None or getattr(self, '_net_inventory_gen', None) != generation or
+                getattr(self, '_net_inventory_eni_state', None) != eni_state):
+            refresh = True
+        if not refresh:
+            return inventory
+        # One line per device; 'dev|name|mac|operstate|mtu|driver', followed by the
+        # 'ip -o addr' output for the addresses of all devices.
+        cmd = ('for p in {0}/*; do [ -e "$p" ] || continue; d=${{p##*/}}; '
+               'a=$(cat $p/address 2>/dev/null); o=$(cat $p/operstate 2>/dev/null); '
+               'm=$(cat $p/mtu 2>/dev/null); r=$(readlink $p/device/driver 2>/dev/null); '
+               'echo "dev|$d|$a|$o|$m|${{r##*/}}"; done; ip -o addr show 2>/dev/null'
+               .format(prefix.rstrip('/')))
+        out = None
+        err = None
+        for attempt in xrange(0, retries):
+            try:
+                out = self.sys(cmd, code=0, verbose=False)
+                break
+            except Exception as E:
+                err = E
+                self.log.warning('{0}\nError reading guest network inventory, attempt:{1}/{2}, '
+                                 'err:"{3}"'.format(get_traceback(), attempt + 1, retries, E))
+                time.sleep(1.5)
+        if out is None:
+            raise RuntimeError('{0}: Failed to read guest network inventory, err:{1}'
+                               .format(self.id, err))
+        inventory = {}
+        addrs = []
+        for line in out:
+            fields = line.strip().split('|')
+            if fields[0] == 'dev' and len(fields) == 6:
+                name = fields[1].strip()
+                mac = fields[2].strip()
+                if not re.search("^\w\w:\w\w:\w\w:\w\w:\w\w:\w\w$", mac):
+                    mac = None
+                mtu = fields[4].strip()
+                inventory[name] = {'name': name,
+                                   'address': mac,
+                                   'operstate': fields[3].strip() or None,
+                                   'mtu': int(mtu) if mtu.isdigit() else None,
+                                   'driver': fields[5].strip() or None,
+                                   'ipv4': [],
+                                   'ipv6': []}
+            else:
+                # ie: '2: eth0    inet 10.111.1.5/16 brd 10.111.255.255 scope global eth0...'
+                fields = line.split()
+                if len(fields) >= 4 and fields[2] in ['inet', 'inet6']:
+                    addrs.append((fields[1].split('@')[0], fields[2], fields[3]))
+        for name, family, addr in addrs:
+            if name in inventory:
+                inventory[name]['ipv4' if family == 'inet' else 'ipv6'].append(addr)
+        self._net_inventory = inventory
+        self._net_inventory_gen = generation
+        self._net_inventory_eni_state = eni_state
+        self.log.debug('Read guest network inventory, {0} devices:"{1}"'
+                       .format(len(inventory), ", ".join(sorted(inventory.keys()))))
+        return inventory
+
+    def get_network_device_info(self, name=None, prefix='/sys/class/net/', refresh=False):
+        """
+        Returns a dict of guest network device info keyed by device name, combining the
+        guest network inventory (see get_network_inventory()) with the ENI information for
+        each device's MAC address.
+        :param name: optional device name to limit the results to
+        :param refresh: boolean, if True re-read the inventory from the guest
+        """
         ret = {}
-        ipv4_info = self.get_network_ipv4_info()
-        # Pipe to grep here just to disable auto color ascii markups in the output...
-        dev_names = self.sys('ls -1 {0} | grep .'.format(prefix), code=0)
-        for dev_name in dev_names:
-            attempt = 0
-            good = False
-            max_attempts = 3
-            while attempt < max_attempts and not good:
-                self.log.debug('Attempting to fetch info for device {0}'.format(dev_name))
-                attempt += 1
+        inventory = self.get_network_inventory(refresh=refresh, prefix=prefix)
+        for dev_name, info in inventory.iteritems():
+            if name and dev_name != name:
+                continue
+            dev = {}
+            dev['local_ip'] = None
+            dev['local_cidr'] = None
+            if info['ipv4']:
+                local_ip, _, prefix_len = info['ipv4'][0].partition('/')
+                dev['local_ip'] = local_ip
                 try:
-                    dev = {}
-                    dev_name = str(dev_name).strip()
-                    if name and dev_name != name:
-                        continue
-                    dev_ipv4_info = ipv4_info.get(dev_name) or {}
-                    dev['local_ip'] = dev_ipv4_info.get('ip', None)
-                    dev['local_cidr'] = dev_ipv4_info.get('network_cidr', None)
-
-                    dev_path = os.path.join(prefix, dev_name)
-
-                    # Get MAC address...
-                    mac_path = os.path.join(dev_path, 'address')
-                    mac_addr = self.sys('cat {0}'.format(mac_path), code=0) or [""]
-                    mac_addr = mac_addr[0]
-                    search = re.search("^\w\w:\w\w:\w\w:\w\w:\w\w:\w\w$", mac_addr.strip())
-                    if search:
-                        dev['address'] = search.group()
-                    else:
-                        self.log.warning('Failed to parse MAC info for:{0}'.format(dev_name))
-                        dev['address'] = None
-                    dev['eni_index'] = None
-                    dev['eni'] = None
-                    dev['eni_private_ips'] = None
-                    dev['eni_public_ip'] = None
-                    if dev['address']:
-                        for interface in self.interfaces:
-                            if interface.mac_address == dev['address']:
-                                dev['eni'] = interface.id
-                                dev['eni_private_ips'] = [str(x.private_ip_address) for x in
-                                                          interface.private_ip_addresses]
-                                dev['eni_public_ip'] = getattr(interface, 'publicIp', None)
-                                if interface.attachment:
-                                    dev['eni_index'] = interface.attachment.device_index
-                    # Get the operation state...
-                    oper_path = os.path.join(dev_path, 'operstate')
-                    try:
-                        dev['operstate'] = (self.sys('cat {0}'.format(oper_path), code=0,
-                                                     timeout=2) or [None])[0]
-                    except (CommandTimeoutException, CommandExitCodeException) as TE:
-                        self.log.debug(TE)
-                        dev['operstate'] = None
-                    ret[dev_name] = dev
-                    good = True
-                except Exception as E:
-                    self.log.debug('{0}\nError while gathering device info for:{1}, Err:"{2}"'
-                                     .format(get_traceback(), dev_name, E))
-                    if attempt >= max_attempts:
-                        raise
-                    time.sleep(1.5)
-        macs = [x.get('address') for x in ret.values()]
+                    dev['local_cidr'] = self._get_cidr_for_address(local_ip, prefix_len or 32)
+                except (socket.error, ValueError) as E:
+                    self.log.debug('Failed to parse cidr for:{0}, err:{1}'.format(dev_name, E))
+            dev['address'] = info['address']
+            if not dev['address']:
+                self.log.warning('Failed to parse MAC info for:{0}'.format(dev_name))
+            dev['eni_index'] = None
+            dev['eni'] = None
+            dev['eni_private_ips'] = None
+            dev['eni_public_ip'] = None
+            if dev['address']:
+                for interface in self.interfaces:
+                    if interface.mac_address == dev['address']:
+                        dev['eni'] = interface.id
+                        dev['eni_private_ips'] = [str(x.private_ip_address) for x in
+                                                  interface.private_ip_addresses]
+                        dev['eni_public_ip'] = getattr(interface, 'publicIp', None)
+                        if interface.attachment:
+                            dev['eni_index'] = interface.attachment.device_index
+            dev['operstate'] = info['operstate']
+            dev['mtu'] = info['mtu']
+            dev['driver'] = info['driver']
+            dev['ipv4'] = info['ipv4']
+            dev['ipv6'] = info['ipv6']
+            ret[dev_name] = dev
+        macs = [x.get('address') for x in inventory.values()]
         for interface in self.interfaces:
             if interface.mac_address not in macs:
                 self.log.warning(red('ENI:{0} MAC:{1} not found on instance at this time'
@@ -2717,7 +3581,7 @@ class EuInstance(Instance, TaggedResource, Machine):
         self.update()
         eni.update()
         self.ec2ops.show_network_interfaces(eni)
-        pre_attach_net_devs = self.get_network_interfaces().keys()
+        pre_attach_net_devs = self.get_network_inventory(refresh=True).keys()
         indexes = []
         for interface in self.interfaces:
             if interface.attachment:
@@ -2737,6 +3601,7 @@ class EuInstance(Instance, TaggedResource, Machine):
         else:
             self.log.debug('Sending attach request now for ENI:{0}'.format(eni.id))
             eni.attach(self.id, indx)
+            self.invalidate_network_inventory()
             eni.update()
         return self.check_eni_attachment(eni, index=indx, local_dev_timeout=local_dev_timeout)
 
@@ -2833,7 +3698,7 @@ class EuInstance(Instance, TaggedResource, Machine):
         while elapsed < local_dev_timeout and not dev_found:
             elapsed = int(time.time() - start)
             attempts += 1
-            net_devs = self.get_network_device_info()
+            net_devs = self.get_network_device_info(refresh=(attempts > 1))
             for dev, info in net_devs.iteritems():
                 if info.get('address') == eni.mac_address:
                     break
@@ -2904,13 +3769,14 @@ class EuInstance(Instance, TaggedResource, Machine):
                              .format(self.id, eni.attachment.instance_id, self.id))
         if self.ssh and local_dev_timeout is not None and self.state == 'running':
             try:
-                pre_detach_net_devices = self.get_network_interfaces().keys()
+                pre_detach_net_devices = self.get_network_inventory(refresh=True).keys()
                 self.log.debug('Devices on this instance before ENI:{0} detach:"{1}"'
                                .format(eni.id, pre_detach_net_devices))
             except:
                 pass
         self.log.debug('sending {0} detach now...'.format(eni.id))
         eni.detach()
+        self.invalidate_network_inventory()
         eni.update()
         self.update()
         start = time.time()
@@ -2976,7 +3842,7 @@ class EuInstance(Instance, TaggedResource, Machine):
             attempts += 1
             dev = None
             info = None
-            net_devs = self.get_network_device_info()
+            net_devs = self.get_network_device_info(refresh=(attempts > 1))
             for dev, info in net_devs.iteritems():
                 if info.get('address') == eni.mac_address:
                     break
@@ -3053,7 +3919,7 @@ class EuInstance(Instance, TaggedResource, Machine):
         for eni in index_mapping:
             eni.local_dev_index = index_mapping.index(eni)
         # Get network devices on the guest
-        devs = self.get_network_interfaces().keys() or []
+        devs = self.get_network_inventory().keys() or []
         if "{0}0".format(prefix) not in devs:
             raise ValueError('Dev {0} not found in host devs:"{1}"'.format("{0}0".format(prefix),
                                                                            ",".join(devs)))
@@ -3207,14 +4073,10 @@ class EuInstance(Instance, TaggedResource, Machine):
         # Now restart the network service to make use of the config and scripts created...
         self.log.info('Restarting network service for instance:{0}'.format(self.id))
         self.sys('service network restart')
-        for x in range(20):
-            try:
-                test_port_status(self.ip_address, port=22)
-                break
-            except Exception as PE:
-                self.log.debug('{0}, Test Port Status. {1}:{2}. Elapsed:{3}. Result: {4}'
-                               .format(self.id, self.ip_address, 22, x, PE))
-                time.sleep(1)
+        self.invalidate_network_inventory()
+        prober = PortProber([(self.ip_address, 22)], connect_timeout=2, retry_interval=0.5,
+                            log=self.log)
+        prober.show_results(prober.probe(timeout=20), printmethod=self.log.debug)
         # Finally refresh the ssh connection in case it was lost in the network restart...
         self.log.debug('Attempting to refresh ssh connection after syncing ENIs...')
         self.refresh_ssh()
@@ -3257,8 +4119,11 @@ class EuInstance(Instance, TaggedResource, Machine):
                     subnet = self.ec2ops.get_subnet(eni.subnet_id)
                     cidr_mask = subnet.cidr_block.split('/')[1]
                     ip_cidr = "{0}/{1}".format(eni.private_ip_address, cidr_mask)
-                    self.sys('ifconfig {0} up'.format(dev_name), code=0)
-                    self.sys('ifconfig {0} {1}'.format(dev_name, ip_cidr), code=0)
+                    try:
+                        self.sys('ifconfig {0} up'.format(dev_name), code=0)
+                        self.sys('ifconfig {0} {1}'.format(dev_name, ip_cidr), code=0)
+                    finally:
+                        self.invalidate_network_inventory()
                 except Exception as E:
                     self.show_network_device_info()
                     error = 'Error syncing IP info for ENI:{0}, ' \
@@ -3286,6 +4151,8 @@ class EuInstance(Instance, TaggedResource, Machine):
                                              .format(guest_ip, eni.id, ip_cidr, attempts, elapsed))
                         break
                     except Exception as E:
+                        # The guest may still be applying the change, re-read its devices
+                        self.invalidate_network_inventory()
                         self.show_network_device_info()
                         error = 'Attempt:{0}, Elapsed:{1}/{2}, Error waiting for IP info to ' \
                                 'sync for ENI:{3}, ERROR:"{4}"\n'.format(attempts, elapsed,
@@ -37,14 +37,16 @@ Place holder for snapshot test specific convenience methods+objects to extend bo
 '''
 from boto.ec2.snapshot import Snapshot
 from nephoria.euca.taggedresource import TaggedResource
+from nephoria.testcase_utils.phase_timer import PhaseTimedResource
 from prettytable import PrettyTable
 import time
 
 
 
-class EuSnapshot(Snapshot, TaggedResource):
+class EuSnapshot(Snapshot, TaggedResource, PhaseTimedResource):
     eutest_volume_md5 = None
     eutest_volume_md5len = None
+    eutest_volume_chunk_manifest = None
     eutest_volume_zone = None
     eutest_failmsg = None
     eutest_laststatus = None
@@ -65,6 +67,7 @@ class EuSnapshot(Snapshot, TaggedResource):
         newsnap.eutest_volume_md5 = None
         newsnap.tester = tester
         newsnap.eutest_volume_md5len = None
+        newsnap.eutest_volume_chunk_manifest = None
         newsnap.eutest_volume_zone = None
         newsnap.eutest_volumes = []
         newsnap.eutest_failmsg = None
@@ -86,6 +89,9 @@ class EuSnapshot(Snapshot, TaggedResource):
     def set_last_status(self,status=None):
         self.eutest_laststatus = self.status
         self.eutest_laststatustime = time.time()
+        self.record_phase(self.status, timestamp=self.eutest_laststatustime)
+        if str(self.progress or '0').replace('%', '') not in ['', '0']:
+            self.record_phase('progress_started', timestamp=self.eutest_laststatustime)
         self.eutest_ageatstatus = "{0:.2f}".format(time.time() - self.eutest_cmdstart)
         
     def printself(self, printmethod=None, printme=True):
@@ -40,13 +40,14 @@ from boto.ec2.volume import Volume
 from boto.exception import EC2ResponseError
 import time
 from nephoria.euca.taggedresource import TaggedResource
+from nephoria.testcase_utils.phase_timer import PhaseTimedResource
 from cloud_utils.log_utils import eulogger
 from datetime import datetime, timedelta
 from prettytable import PrettyTable
 
 
 
-class EuVolume(Volume, TaggedResource):
+class EuVolume(Volume, TaggedResource, PhaseTimedResource):
     # Define test tag key names...
     tag_md5_key = 'md5'
     tag_md5len_key = 'md5len'
@@ -59,6 +60,7 @@ class EuVolume(Volume, TaggedResource):
     tag_source_volume_timestatmp = 'source_volume_timestamp'
     tag_instance_id_key = 'instance_id'
     tag_guestdev_key = 'guestdev'
+    tag_chunk_manifest_key = 'chunk_manifest'
 
     '''
     Note: Different hypervisors will honor the requested cloud dev differently, so the requested device can not 
@@ -93,6 +95,7 @@ class EuVolume(Volume, TaggedResource):
             newvol.md5 = newvol.tags[newvol.tag_md5_key]
         if newvol.tags.has_key(newvol.tag_md5len_key):
             newvol.md5len = newvol.tags[newvol.tag_md5len_key]
+        newvol.chunk_manifest = newvol.tags.get(newvol.tag_chunk_manifest_key)
         newvol.set_attached_status()
 
         return newvol
@@ -200,6 +203,7 @@ class EuVolume(Volume, TaggedResource):
     def set_last_status(self,status=None):
         self.eutest_laststatus = status or self.status
         self.eutest_laststatustime = time.time()
+        self.record_phase(self.eutest_laststatus, timestamp=self.eutest_laststatustime)
         self.set_attached_status()
         self.eutest_ageatstatus = "{0:.2f}".format(time.time() - self.eutest_cmdstart)
 
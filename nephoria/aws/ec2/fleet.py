@@ -0,0 +1,267 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009-2014, Eucalyptus Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use of this software in source and binary forms, with or
+# without modification, are permitted provided that the following conditions
+# are met:
+#
+#   Redistributions of source code must retain the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other
+#   materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Fleet wide fan out of guest commands and checks.
+
+Runs a shell command, or a callable taking the instance, across a list of EuInstance and/or
+WinInstance objects with bounded concurrency, per host timeouts and retries. Total time is
+bounded by the slowest host rather than the sum of all hosts.
+Each host's outcome is returned as a dict:
+    'id', 'host', 'instance', 'status' ('ok', 'failed', 'error' or 'timeout'), 'exit_code', 'output',
+    'result' (return value of a callable), 'error', 'attempts', 'duration' (seconds)
+
+Sample usage:
+    fleet = FleetExecutor(instances, max_workers=50, timeout=60, retries=1, log=self.log)
+    results = fleet.run('uptime', code=0)
+    fleet.show_results(results)
+    # Callables are run with the instance as their only argument...
+    results = fleet.run(lambda instance: instance.get_network_device_info())
+    fleet.raise_on_failures(results)
+'''
+
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from prettytable import PrettyTable
+from cloud_utils.log_utils import get_traceback
+from cloud_utils.log_utils.eulogger import Eulogger
+
+
+class FleetExecutionException(Exception):
+    pass
+
+
+class FleetExecutor(object):
+    OK = 'ok'
+    FAILED = 'failed'
+    ERROR = 'error'
+    TIMEOUT = 'timeout'
+
+    def __init__(self, instances, max_workers=20, timeout=120, retries=0, retry_delay=2,
+                 progress_interval=10, log=None):
+        """
+        :param instances: list of EuInstance/WinInstance objects
+        :param max_workers: max number of hosts worked on concurrently
+        :param timeout: per host timeout in seconds for each attempt, None for no timeout.
+                        Shell commands are run with this timeout. A host still running once
+                        every attempt's timeout has passed is reported as 'timeout', but is
+                        waited on before run() returns since its thread can not be stopped.
+        :param retries: number of times a host's command is retried after it fails
+        :param retry_delay: seconds to wait between a host's attempts
+        :param progress_interval: seconds between progress log messages, 0 to disable
+        """
+        self.instances = list(instances or [])
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.progress_interval = progress_interval
+        self.log = log or Eulogger('FleetExecutor')
+
+    def _info(self, msg):
+        self.log.info(msg)
+
+    def _debug(self, msg):
+        self.log.debug(msg)
+
+    @staticmethod
+    def get_host(instance):
+        return getattr(instance, 'ip_address', None) or getattr(instance, 'private_ip_address',
+                                                                None)
+
+    def _run_command(self, instance, command, code, timeout):
+        # Returns (status, exit_code, output)
+        if getattr(instance, 'ssh', None) is not None and hasattr(instance, 'cmd'):
+            out = instance.cmd(command, timeout=timeout, listformat=True, verbose=False)
+            exit_code = out.get('status')
+            status = self.OK
+            if code is not None and exit_code != code:
+                status = self.FAILED
+            return status, exit_code, out.get('output')
+        # ie WinInstance, sys() raises if the command does not exit with 'code'
+        output = instance.sys(command, code=code, timeout=timeout, verbose=False)
+        return self.OK, code, output
+
+    def _run_host(self, instance, operation, code, timeout, retries, started):
+        ret = {'id': getattr(instance, 'id', str(instance)), 'host': self.get_host(instance),
+               'instance': instance, 'status': None, 'exit_code': None, 'output': None,
+               'result': None, 'error': None, 'attempts': 0, 'duration': None}
+        start = time.time()
+        started[instance] = start
+        for attempt in xrange(0, retries + 1):
+            ret['attempts'] = attempt + 1
+            ret['error'] = None
+            try:
+                if callable(operation):
+                    ret['result'] = operation(instance)
+                    ret['status'] = self.OK
+                else:
+                    ret['status'], ret['exit_code'], ret['output'] = \
+                        self._run_command(instance, operation, code, timeout)
+                    if ret['status'] == self.FAILED:
+                        ret['error'] = 'exit code:{0} != {1}'.format(ret['exit_code'], code)
+            except Exception as E:
+                self._debug('{0}\n{1}: attempt:{2}/{3} error:"{4}"'
+                            .format(get_traceback(), ret['id'], attempt + 1, retries + 1, E))
+                ret['status'] = self.ERROR
+                ret['error'] = "{0}: {1}".format(E.__class__.__name__, E)
+            if ret['status'] == self.OK:
+                break
+            if attempt < retries:
+                time.sleep(self.retry_delay)
+        ret['duration'] = time.time() - start
+        return ret
+
+    def run(self, operation, code=None, timeout=None, retries=None, on_result=None):
+        """
+        Runs 'operation' on each instance.
+        :param operation: shell command string, or a callable which is passed the instance
+        :param code: expected exit code for shell commands, None accepts any exit code
+        :param timeout: per host timeout in seconds for each attempt, defaults to self.timeout
+        :param retries: defaults to self.retries
+        :param on_result: optional callable, passed each host's result dict as it completes
+        :returns list of result dicts in the order of self.instances
+        """
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else retries
+        if not self.instances:
+            return []
+        results = {}
+        started = {}
+        name = operation if not callable(operation) else getattr(operation, '__name__',
+                                                                  str(operation))
+        start = time.time()
+        last_progress = start
+        # Hosts exceeding every attempt's timeout are marked as timed out. Their worker thread
+        # can not be interrupted, so it is still waited on rather than left running (ie still
+        # changing the host) after run() returns.
+        host_timeout = (timeout + self.retry_delay) * (retries + 1) if timeout else None
+        timed_out = {}
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(self.instances)))
+        try:
+            futures = {}
+            for instance in self.instances:
+                future = executor.submit(self._run_host, instance, operation, code, timeout,
+                                         retries, started)
+                futures[future] = instance
+            pending = set(futures.keys())
+            while pending:
+                done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+                now = time.time()
+                for future in done:
+                    instance = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as E:
+                        result = {'id': getattr(instance, 'id', str(instance)),
+                                  'host': self.get_host(instance), 'instance': instance,
+                                  'status': self.ERROR, 'exit_code': None, 'output': None,
+                                  'result': None, 'error': str(E), 'attempts': 1,
+                                  'duration': now - started.get(instance, start)}
+                    if instance in timed_out:
+                        result['error'] = 'Timed out after {0:.1f} seconds, finished after ' \
+                                          '{1:.1f} seconds with status:{2}, err:{3}'\
+                            .format(timed_out[instance], result['duration'] or 0,
+                                    result['status'], result['error'])
+                        result['status'] = self.TIMEOUT
+                    results[instance] = result
+                    if on_result:
+                        on_result(result)
+                if host_timeout:
+                    for future in pending:
+                        instance = futures[future]
+                        host_start = started.get(instance)
+                        if host_start and instance not in timed_out and \
+                                now - host_start > host_timeout:
+                            timed_out[instance] = now - host_start
+                            self._info('Fleet "{0}": {1} timed out after {2:.1f}s, waiting for '
+                                       'it to finish...'.format(name, getattr(instance, 'id',
+                                                                              instance),
+                                                                now - host_start))
+                if self.progress_interval and now - last_progress >= self.progress_interval:
+                    last_progress = now
+                    self._info('Fleet "{0}": {1}/{2} hosts done, failed:{3}, running:{4}, '
+                               'timed out:{5}, elapsed:{6:.1f}s'
+                               .format(name, len(results), len(self.instances),
+                                       len([r for r in results.values()
+                                            if r['status'] != self.OK]),
+                                       len([f for f in pending if f.running()]),
+                                       len(timed_out), now - start))
+        finally:
+            executor.shutdown(wait=False)
+        ordered = [results[instance] for instance in self.instances]
+        self._info('Fleet "{0}": {1} hosts done in {2:.1f}s, failed:{3}'
+                   .format(name, len(ordered), time.time() - start,
+                           len(self.get_failures(ordered))))
+        return ordered
+
+    def get_failures(self, results):
+        return [r for r in results if r['status'] != self.OK]
+
+    def raise_on_failures(self, results):
+        failures = self.get_failures(results)
+        if failures:
+            raise FleetExecutionException(
+                '{0}/{1} hosts failed:\n{2}'.format(
+                    len(failures), len(results),
+                    "\n".join(['{0} ({1}): {2}: {3}'.format(r['id'], r['host'], r['status'],
+                                                            r['error']) for r in failures])))
+
+    def show_results(self, results, output_lines=2, printmethod=None, printme=True):
+        """
+        :param output_lines: number of trailing output lines shown per host
+        """
+        pt = PrettyTable(['ID', 'HOST', 'STATUS', 'EXIT', 'TRIES', 'SECONDS', 'OUTPUT/ERROR'])
+        pt.align = 'l'
+        durations = []
+        for r in results:
+            if r['duration'] is not None:
+                durations.append(r['duration'])
+            if r['error']:
+                detail = r['error']
+            elif r['output'] is not None:
+                output = r['output']
+                if not isinstance(output, list):
+                    output = str(output).splitlines()
+                detail = "\n".join([str(x) for x in output[-output_lines:]]) \
+                    if output_lines else ""
+            else:
+                detail = str(r['result'])
+            pt.add_row([r['id'], r['host'], r['status'], r['exit_code'], r['attempts'],
+                        "{0:.2f}".format(r['duration'] or 0), detail])
+        buf = "{0}\nhosts:{1} failed:{2}".format(pt, len(results),
+                                                 len(self.get_failures(results)))
+        if durations:
+            buf += " slowest:{0:.2f}s sum:{1:.2f}s".format(max(durations), sum(durations))
+        if not printme:
+            return buf
+        printmethod = printmethod or self.log.info
+        printmethod("\n" + buf + "\n")
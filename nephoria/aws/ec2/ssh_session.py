@@ -0,0 +1,330 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009-2014, Eucalyptus Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use of this software in source and binary forms, with or
+# without modification, are permitted provided that the following conditions
+# are met:
+#
+#   Redistributions of source code must retain the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other
+#   materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Managed ssh sessions for guest command execution.
+
+Each guest command runs as a new channel over the instance's ssh transport. The
+SshSessionManager keeps that authenticated transport alive with keepalives, lets concurrent
+commands share it (bounded by max_channels), and when the transport drops during a command it
+reconnects, with exponential backoff, before the next command. The interrupted command is not
+run again unless the caller asked for it (retry_on_disconnect), since it may not be safe to
+repeat or may be what dropped the connection, ie a network restart. A connection which was
+already closed when a command started is not reconnected, so commands against a closed or
+terminated guest fail fast.
+Latency is recorded per command name (the first word of the command) as well as overall.
+stream() runs a command on its own channel and returns an OutputStream yielding its output
+lines as they arrive, for long running or verbose commands.
+
+Sample usage:
+    manager = SshSessionManager(connect=instance._new_ssh_connection, log=instance.log)
+    manager.run('sys', 'uptime', code=0)
+    for line in manager.stream('tail -n 100000 /var/log/messages', match='Call Trace'):
+        ...
+    manager.show_stats()
+'''
+
+import os
+import random
+import select
+import threading
+import time
+from cloud_utils.log_utils.eulogger import Eulogger
+from nephoria.testcase_utils.loadgen import LatencyHistogram, latency_table
+from nephoria.testcase_utils.output_stream import OutputStream
+
+
+class SshSessionManager(object):
+
+    def __init__(self, connect, keepalive=30, max_channels=8, reconnect_attempts=5, backoff=1,
+                 max_backoff=30, retry_on_disconnect=False, log=None, name=None):
+        """
+        :param connect: callable returning a new, connected SshConnection
+        :param keepalive: interval in seconds to send transport keepalives, 0 disables them
+        :param max_channels: max number of commands run concurrently over the transport
+        :param reconnect_attempts: number of connection attempts made when reconnecting
+        :param backoff: initial delay in seconds between reconnect attempts, doubled after each
+        :param max_backoff: max delay in seconds between reconnect attempts
+        :param retry_on_disconnect: boolean, default for run(). Re-run a command once if it
+                                    failed because the transport was lost. Only for commands
+                                    which are safe to repeat.
+        """
+        self._connect = connect
+        self.keepalive = keepalive
+        self.max_channels = max_channels
+        self.reconnect_attempts = reconnect_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_on_disconnect = retry_on_disconnect
+        self.log = log or Eulogger(self.__class__.__name__)
+        self.name = name
+        self._ssh = None
+        self._reconnect_next = False
+        self._conn_lock = threading.RLock()
+        self._channels = threading.BoundedSemaphore(max_channels)
+        self._stats_lock = threading.Lock()
+        self.stats = {'commands': 0, 'errors': 0, 'connects': 0, 'reconnects': 0,
+                      'disconnects': 0, 'retries': 0}
+        self.latency = LatencyHistogram()
+        self.command_latency = {}
+
+    def __repr__(self):
+        return '{0}:{1}'.format(self.__class__.__name__, self.name)
+
+    def _debug(self, msg):
+        self.log.debug('{0}: {1}'.format(self.name, msg))
+
+    @property
+    def ssh(self):
+        return self._ssh
+
+    @staticmethod
+    def get_transport(ssh):
+        connection = getattr(ssh, 'connection', None)
+        if connection is None:
+            return None
+        return connection.get_transport()
+
+    def is_active(self, ssh=None):
+        """
+        Returns True if the ssh connection's transport is up and authenticated
+        """
+        ssh = ssh or self._ssh
+        if ssh is None:
+            return False
+        transport = self.get_transport(ssh)
+        return bool(transport and transport.is_active() and transport.is_authenticated())
+
+    def attach(self, ssh):
+        """
+        Manages an existing SshConnection, ie one created outside of this manager.
+        """
+        with self._conn_lock:
+            if ssh is self._ssh:
+                return
+            self._ssh = ssh
+            self._reconnect_next = False
+            if ssh is not None:
+                self.stats['connects'] += 1
+                transport = self.get_transport(ssh)
+                if transport and self.keepalive:
+                    transport.set_keepalive(self.keepalive)
+
+    def get_connection(self):
+        """
+        Returns the managed SshConnection. If a previous command lost the transport, a new
+        connection is made first. A connection which was closed otherwise is returned as is.
+        """
+        with self._conn_lock:
+            if self._ssh is None or self._reconnect_next:
+                self._reconnect_next = False
+                if not self.is_active():
+                    self.reconnect()
+            return self._ssh
+
+    def reconnect(self):
+        """
+        Establishes a new connection, retrying with exponential backoff.
+        """
+        with self._conn_lock:
+            if self._ssh is not None:
+                self.stats['reconnects'] += 1
+            delay = self.backoff
+            err = None
+            for attempt in xrange(1, self.reconnect_attempts + 1):
+                try:
+                    self._debug('Connecting ssh, attempt:{0}/{1}'
+                                .format(attempt, self.reconnect_attempts))
+                    ssh = self._connect()
+                    if ssh is None:
+                        raise RuntimeError('ssh connect method did not return a connection')
+                    self.attach(ssh)
+                    return ssh
+                except Exception as E:
+                    err = E
+                    self._debug('ssh connect attempt:{0}/{1} failed, err:"{2}"'
+                                .format(attempt, self.reconnect_attempts, E))
+                    if attempt < self.reconnect_attempts:
+                        time.sleep(delay + random.random() * delay / 2.0)
+                        delay = min(self.max_backoff, delay * 2)
+            raise RuntimeError('{0}: Failed to connect ssh after {1} attempts, err:"{2}"'
+                               .format(self.name, self.reconnect_attempts, err))
+
+    def close(self):
+        with self._conn_lock:
+            if self._ssh is not None:
+                self._ssh.close()
+            self._ssh = None
+
+    def _record(self, cmd, elapsed, error=False):
+        cmd = str(cmd or "").strip()
+        name = os.path.basename(cmd.split()[0]) if cmd else '(empty)'
+        with self._stats_lock:
+            self.stats['commands'] += 1
+            if error:
+                self.stats['errors'] += 1
+            hist = self.command_latency.get(name)
+            if hist is None:
+                hist = LatencyHistogram()
+                self.command_latency[name] = hist
+        hist.record(elapsed)
+        self.latency.record(elapsed)
+
+    def run(self, method, cmd, retry_on_disconnect=None, **kwargs):
+        """
+        Runs 'cmd' using the SshConnection method named 'method' (ie 'sys' or 'cmd') over the
+        managed transport and records its latency.
+        If the command fails because the transport was lost, the connection is re-established
+        before the next command.
+        :param retry_on_disconnect: boolean, if the transport was lost re-establish it and run
+                                    the command once more. Only for commands which are safe to
+                                    repeat. Defaults to self.retry_on_disconnect.
+        :returns the result of the SshConnection method
+        """
+        if retry_on_disconnect is None:
+            retry_on_disconnect = self.retry_on_disconnect
+        with self._channels:
+            attempt = 0
+            while True:
+                attempt += 1
+                ssh = self.get_connection()
+                was_active = self.is_active(ssh)
+                start = time.time()
+                try:
+                    ret = getattr(ssh, method)(cmd, **kwargs)
+                except Exception as E:
+                    if was_active and not self.is_active(ssh):
+                        self._dropped(ssh)
+                        retry = retry_on_disconnect and attempt == 1
+                        with self._stats_lock:
+                            self.stats['disconnects'] += 1
+                            if retry:
+                                self.stats['retries'] += 1
+                        if retry:
+                            self._debug('Transport lost during cmd:"{0}", err:"{1}". '
+                                        'Reconnecting and retrying...'.format(cmd, E))
+                            continue
+                    self._record(cmd, time.time() - start, error=True)
+                    raise
+                self._record(cmd, time.time() - start)
+                if was_active and not self.is_active(ssh):
+                    # ie the command restarted the guest's network
+                    self._dropped(ssh)
+                    with self._stats_lock:
+                        self.stats['disconnects'] += 1
+                return ret
+
+    def _dropped(self, ssh):
+        # The transport was lost while in use, reconnect before the next command
+        with self._conn_lock:
+            if ssh is self._ssh:
+                self._reconnect_next = True
+
+    def stream(self, cmd, timeout=120, get_pty=False, include_stderr=True, stdin=None,
+               chunk_size=32768, **kwargs):
+        """
+        Returns an OutputStream which runs 'cmd' on a new channel over the managed transport
+        and yields its output lines as they are received. The command is started, and takes
+        one of the max_channels slots, when the stream is first read. The slot is released
+        when the stream ends or is closed, so a stream which is never read holds nothing.
+        :param timeout: seconds to wait for the command to finish
+        :param get_pty: boolean, request a pty for the command
+        :param include_stderr: boolean, include stderr in the output, otherwise it is discarded
+        :param stdin: optional string written to the command's stdin once started
+        :param chunk_size: max bytes read from the channel at once
+        :param kwargs: passed to OutputStream, ie code, match, stop_on_match, tail_lines
+        :returns OutputStream
+        """
+        # Channel and start time, set once the command has been started
+        state = {}
+
+        def start():
+            self._channels.acquire()
+            try:
+                ssh = self.get_connection()
+                transport = self.get_transport(ssh)
+                if transport is None:
+                    raise RuntimeError('{0}: ssh connection has no transport'.format(self.name))
+                chan = transport.open_session()
+                if get_pty:
+                    chan.get_pty()
+                chan.set_combine_stderr(include_stderr)
+                chan.exec_command(cmd)
+                if stdin:
+                    chan.sendall(stdin)
+            except Exception:
+                self._channels.release()
+                raise
+            state['chan'] = chan
+            state['start'] = time.time()
+            return chan
+
+        def read(wait):
+            chan = state.get('chan') or start()
+            select.select([chan], [], [], wait)
+            data = ''
+            if chan.recv_ready():
+                data = chan.recv(chunk_size)
+            while chan.recv_stderr_ready():
+                chan.recv_stderr(chunk_size)
+            if not data and not chan.recv_ready() and \
+                    (chan.exit_status_ready() or chan.closed):
+                return '', True, chan.recv_exit_status()
+            return data, False, None
+
+        def close():
+            chan = state.pop('chan', None)
+            if chan is None:
+                return
+            try:
+                chan.close()
+            finally:
+                self._channels.release()
+                self._record(cmd, time.time() - state['start'],
+                             error=bool(output.timed_out or
+                                        (output.status is not None and output.code is not None
+                                         and output.status != output.code)))
+
+        kwargs.setdefault('log', self.log)
+        output = OutputStream(read=read, close=close, cmd=cmd, timeout=timeout, **kwargs)
+        return output
+
+    def show_stats(self, printmethod=None, printme=True):
+        rows = sorted(self.command_latency.items(), key=lambda x: x[1].count, reverse=True)
+        rows.append(('(all)', self.latency))
+        pt = latency_table(rows)
+        buf = ('{0} commands:{1} errors:{2} connects:{3} reconnects:{4} disconnects:{5} '
+               'retries:{6}\n{7}'.format(self, self.stats['commands'], self.stats['errors'],
+                                         self.stats['connects'], self.stats['reconnects'],
+                                         self.stats['disconnects'], self.stats['retries'], pt))
+        if not printme:
+            return buf
+        printmethod = printmethod or self.log.info
+        printmethod("\n" + buf + "\n")
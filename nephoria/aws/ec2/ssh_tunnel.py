@@ -0,0 +1,235 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009-2014, Eucalyptus Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use of this software in source and binary forms, with or
+# without modification, are permitted provided that the following conditions
+# are met:
+#
+#   Redistributions of source code must retain the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other
+#   materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Shared ssh tunnels to guests' private addresses through jump hosts.
+
+Reaching a private guest address through a proxied SshConnection normally costs two full ssh
+handshakes, one with the jump host (ie the CC/NC/CLC) and one with the guest, every time a
+connection is made. An SshTunnelCache keeps one authenticated transport per jump host and
+opens a direct-tcpip channel through it for each target, so only the target's handshake is
+paid. The resulting target clients are cached as well, so repeated checks against the same
+guest reuse the session while it stays up. One cache can be shared by every test in a suite.
+
+Sample usage:
+    tunnels = SshTunnelCache(log=self.log)
+    ssh = tunnels.get_ssh_connection(jump_host=cc.hostname, jump_ssh=cc.ssh,
+                                     host=instance.private_ip_address,
+                                     keypath=instance.keypath)
+    ssh.sys('uname -a', code=0)
+    tunnels.show_stats()
+'''
+
+import threading
+import paramiko
+from functools import partial
+from prettytable import PrettyTable
+from cloud_utils.log_utils.eulogger import Eulogger
+from cloud_utils.net_utils.sshconnection import SshConnection
+
+
+class TunneledSshConnection(SshConnection):
+    """
+    SshConnection using an already connected paramiko client from an SshTunnelCache rather than
+    connecting itself. Other arguments are passed through so the connection's attributes match
+    one created normally.
+    """
+
+    def __init__(self, tunnel_client, *args, **kwargs):
+        """
+        :param tunnel_client: connected paramiko SSHClient
+        :param reconnect: optional callable returning a new connected client, used when the
+                          connection is refreshed and tunnel_client's session was lost
+        """
+        self._reconnect = kwargs.pop('reconnect', None)
+        self._tunnel_client = tunnel_client
+        SshConnection.__init__(self, *args, **kwargs)
+
+    def get_ssh_connection(self, *args, **kwargs):
+        client = self._tunnel_client
+        if self._reconnect and not SshTunnelCache.is_active(client.get_transport()):
+            client = self._reconnect()
+            self._tunnel_client = client
+        return client
+
+
+class SshTunnelCache(object):
+
+    def __init__(self, timeout=60, keepalive=30, log=None):
+        """
+        :param timeout: connect timeout in seconds for jump hosts and targets
+        :param keepalive: interval in seconds to send keepalives on jump host transports,
+                          0 disables them
+        """
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.log = log or Eulogger('SshTunnelCache')
+        self._jumps = {}
+        self._clients = {}
+        self._lock = threading.RLock()
+        self.stats = {'jump_connects': 0, 'jump_reuses': 0, 'channels': 0,
+                      'target_connects': 0, 'target_reuses': 0}
+
+    def _debug(self, msg):
+        self.log.debug(msg)
+
+    @staticmethod
+    def is_active(transport):
+        return bool(transport and transport.is_active() and transport.is_authenticated())
+
+    def get_jump_transport(self, host, username='root', password=None, keypath=None,
+                           jump_ssh=None, port=22):
+        """
+        Returns the cached authenticated transport to a jump host, connecting if needed.
+        :param jump_ssh: optional existing SshConnection to the jump host whose transport is
+                         used rather than opening a new one, ie a Machine's ssh connection
+        """
+        key = (host, port, username)
+        with self._lock:
+            transport = self._jumps.get(key)
+            if self.is_active(transport):
+                self.stats['jump_reuses'] += 1
+                return transport
+            transport = None
+            connection = getattr(jump_ssh, 'connection', None)
+            if connection is not None and self.is_active(connection.get_transport()):
+                transport = connection.get_transport()
+                self._debug('Using existing ssh transport to jump host:{0}'.format(host))
+            else:
+                self._debug('Connecting to jump host:{0}@{1}:{2}'.format(username, host, port))
+                client = paramiko.SSHClient()
+                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                client.connect(host, port=port, username=username, password=password,
+                               key_filename=keypath, timeout=self.timeout,
+                               allow_agent=False, look_for_keys=False)
+                transport = client.get_transport()
+            if self.keepalive:
+                transport.set_keepalive(self.keepalive)
+            self._jumps[key] = transport
+            self.stats['jump_connects'] += 1
+            return transport
+
+    def open_channel(self, jump_transport, host, port=22):
+        """
+        Opens a direct-tcpip channel to host:port through the jump host's transport
+        """
+        channel = jump_transport.open_channel('direct-tcpip', (host, port), ('127.0.0.1', 0))
+        with self._lock:
+            self.stats['channels'] += 1
+        return channel
+
+    def get_client(self, jump_host, host, username='root', password=None, keypath=None,
+                   port=22, jump_username='root', jump_password=None, jump_keypath=None,
+                   jump_ssh=None):
+        """
+        Returns a connected paramiko SSHClient to host:port tunneled through the jump host.
+        Clients are cached per jump host and target, and reconnected if their session was lost.
+        """
+        key = (jump_host, host, port, username)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None and self.is_active(client.get_transport()):
+                self.stats['target_reuses'] += 1
+                return client
+            jump = self.get_jump_transport(jump_host, username=jump_username,
+                                           password=jump_password, keypath=jump_keypath,
+                                           jump_ssh=jump_ssh)
+            self._debug('Connecting to {0}@{1}:{2} through jump host:{3}'
+                        .format(username, host, port, jump_host))
+            channel = self.open_channel(jump, host, port)
+            client = paramiko.SSHClient()
+            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            try:
+                client.connect(host, port=port, username=username, password=password,
+                               key_filename=keypath, timeout=self.timeout, sock=channel,
+                               allow_agent=False, look_for_keys=False)
+            except Exception:
+                channel.close()
+                raise
+            self._clients[key] = client
+            self.stats['target_connects'] += 1
+            return client
+
+    def get_ssh_connection(self, jump_host, host, username='root', password=None, keypath=None,
+                           port=22, jump_username='root', jump_password=None, jump_keypath=None,
+                           jump_ssh=None, **kwargs):
+        """
+        Returns an SshConnection to host:port using a tunneled client from this cache.
+        Extra kwargs are passed to the SshConnection.
+        """
+        if jump_ssh is not None:
+            jump_username = getattr(jump_ssh, 'username', None) or jump_username
+            jump_password = getattr(jump_ssh, 'password', None) or jump_password
+            jump_keypath = getattr(jump_ssh, 'keypath', None) or jump_keypath
+        # Also used to reconnect when the returned connection is refreshed after its session
+        # was lost
+        get_client = partial(self.get_client, jump_host, host, username=username,
+                             password=password, keypath=keypath, port=port,
+                             jump_username=jump_username, jump_password=jump_password,
+                             jump_keypath=jump_keypath, jump_ssh=jump_ssh)
+        return TunneledSshConnection(get_client(), host=host, username=username,
+                                     password=password, keypath=keypath, proxy=jump_host,
+                                     proxy_username=jump_username,
+                                     proxy_password=jump_password,
+                                     proxy_keypath=jump_keypath, reconnect=get_client, **kwargs)
+
+    def close(self, jump_host=None):
+        """
+        Closes the cached target clients and jump host transports, or only those using
+        'jump_host' if provided. Transports borrowed from an existing connection are left open.
+        """
+        with self._lock:
+            for key in self._clients.keys():
+                if jump_host is None or key[0] == jump_host:
+                    client = self._clients.pop(key)
+                    try:
+                        client.close()
+                    except Exception as E:
+                        self._debug('Error closing tunneled client:{0}, err:{1}'.format(key, E))
+            for key in self._jumps.keys():
+                if jump_host is None or key[0] == jump_host:
+                    self._jumps.pop(key)
+
+    def show_stats(self, printmethod=None, printme=True):
+        pt = PrettyTable(['JUMP HOST', 'TARGET', 'USER', 'ACTIVE'])
+        pt.align = 'l'
+        with self._lock:
+            for key, client in sorted(self._clients.items()):
+                pt.add_row([key[0], '{0}:{1}'.format(key[1], key[2]), key[3],
+                            self.is_active(client.get_transport())])
+            buf = ('SSH TUNNELS, jump connects:{jump_connects} jump reuses:{jump_reuses} '
+                   'channels:{channels} target connects:{target_connects} '
+                   'target reuses:{target_reuses}\n'.format(**self.stats))
+        buf += str(pt)
+        if not printme:
+            return buf
+        printmethod = printmethod or self.log.info
+        printmethod("\n" + buf + "\n")
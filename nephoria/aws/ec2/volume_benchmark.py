@@ -0,0 +1,372 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009-2014, Eucalyptus Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use of this software in source and binary forms, with or
+# without modification, are permitted provided that the following conditions
+# are met:
+#
+#   Redistributions of source code must retain the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other
+#   materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Guest side block storage benchmark for attached EuVolumes.
+Runs sequential and random read/write patterns against a volume's guest device at the given
+block sizes and queue depths and reports MB/s, IOPS and latency percentiles.
+
+fio is used when it is installed on the guest. Otherwise a shell fallback runs 'queue depth'
+parallel loops of single block dd reads/writes, timing each operation with date. The fallback
+latencies include the cost of spawning dd, so they are only comparable with other fallback runs.
+
+The benchmark is confined to a region of the device starting at 'offset' (by default past the
+head of the volume used for md5 tracking), so attached volume md5 checks remain valid after
+write patterns have run. The sampled chunks of a volume's chunk manifest (see
+nephoria.aws.ec2.chunk_manifest) are spread across the whole device, so a manifest with chunks
+inside the region is cleared once write patterns have run there.
+
+Sample usage:
+    results = instance.benchmark_volume(euvolume, patterns=['randread', 'randwrite'],
+                                        iodepths=[1, 32], runtime=30)
+    show_volume_benchmark_results(results, log=self.log)
+
+    # Run against every attached volume of many instances at once
+    results = benchmark_instances(instances, patterns=['write'], runtime=60)
+'''
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from prettytable import PrettyTable
+from cloud_utils.log_utils.eulogger import Eulogger
+from nephoria.aws.ec2.chunk_manifest import ChunkManifest
+from nephoria.testcase_utils.loadgen import LatencyHistogram
+
+
+MB = 1048576
+GB = 1073741824
+SEQUENTIAL_PATTERNS = ['read', 'write']
+RANDOM_PATTERNS = ['randread', 'randwrite']
+PATTERNS = SEQUENTIAL_PATTERNS + RANDOM_PATTERNS
+ENGINES = ['fio', 'shell']
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def build_fio_cmd(dev, pattern, block_size, iodepth, runtime, offset, size):
+    return ('fio --name=nephoria_bench --filename={0} --rw={1} --bs={2} --iodepth={3} '
+            '--ioengine=libaio --direct=1 --runtime={4} --time_based --offset={5} --size={6} '
+            '--group_reporting --output-format=json'
+            .format(dev, pattern, block_size, iodepth, runtime, offset, size))
+
+
+def parse_fio_output(lines, pattern):
+    """
+    Parses fio's json output into a benchmark result dict. Handles both the 'clat_ns'
+    (fio >= 3.0) and the older 'clat' (usec) latency formats.
+    """
+    text = "\n".join(lines)
+    start = text.find('{')
+    if start < 0:
+        raise ValueError('No json found in fio output:"{0}"'.format(text[:500]))
+    job = json.loads(text[start:])['jobs'][0]
+    stats = job['read'] if 'read' in pattern else job['write']
+    if 'io_bytes' in stats:
+        io_bytes = stats['io_bytes']
+    else:
+        io_bytes = stats['io_kbytes'] * 1024
+    elapsed = stats['runtime'] / 1000.0
+    if 'clat_ns' in stats:
+        clat, divisor = stats['clat_ns'], 1000000.0
+    else:
+        clat, divisor = stats['clat'], 1000.0
+    latency = {'mean': clat.get('mean', 0) / divisor}
+    fio_percentiles = clat.get('percentile', {})
+    for p in PERCENTILES:
+        value = fio_percentiles.get('{0:f}'.format(p))
+        latency['p{0}'.format(p)] = value / divisor if value is not None else None
+    return {'bytes': io_bytes,
+            'ops': stats.get('total_ios', int(round(stats['iops'] * elapsed))),
+            'elapsed': elapsed,
+            'latency_ms': latency}
+
+
+def build_shell_cmd(dev, pattern, block_size, iodepth, runtime, offset, size, direct=True):
+    """
+    Builds a shell loop which runs 'iodepth' concurrent workers doing single block dd
+    operations for 'runtime' seconds and prints 'lat <usec>' for every operation.
+    """
+    first = offset / block_size
+    blocks = max(1, size / block_size)
+    span = max(1, blocks / iodepth)
+    if 'read' in pattern:
+        io = 'dd if={0} of=/dev/null bs={1} count=1 skip=$b'.format(dev, block_size)
+        if direct:
+            io += ' iflag=direct'
+    else:
+        io = 'dd if=/dev/zero of={0} bs={1} count=1 seek=$b'.format(dev, block_size)
+        if direct:
+            io += ' oflag=direct conv=notrunc'
+        else:
+            io += ' conv=notrunc,fsync'
+    if pattern in RANDOM_PATTERNS:
+        gen = ('awk "BEGIN{{srand($w*100003+$i); for(n=0;n<64;n++) '
+               'print {0}+int(rand()*{1})}}"'.format(first, blocks))
+    else:
+        # Each worker reads/writes sequentially through its own slice of the region
+        gen = ('awk "BEGIN{{for(n=0;n<64;n++) print {0}+$w*{1}+(($i*64+n)%{1})}}"'
+               .format(first, span))
+    return ('run() {{ w=$1; i=0; while [ $(date +%s) -lt $end ]; do for b in $({0}); do '
+            's=$(date +%s%N); {1} 2>/dev/null || echo err; e=$(date +%s%N); '
+            'echo "lat $(( (e - s) / 1000 ))"; done; i=$((i+1)); done; }}; '
+            'end=$(( $(date +%s) + {2} )); echo "start $(date +%s%N)"; '
+            'for w in $(seq 0 {3}); do run $w & done; wait; echo "end $(date +%s%N)"'
+            .format(gen, io, runtime, iodepth - 1))
+
+
+def parse_shell_output(lines, block_size):
+    hist = LatencyHistogram()
+    start = end = None
+    errors = 0
+    for line in lines:
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == 'lat' and len(fields) == 2:
+            hist.record(int(fields[1]) / 1000000.0)
+        elif fields[0] == 'err':
+            errors += 1
+        elif fields[0] == 'start':
+            start = int(fields[1])
+        elif fields[0] == 'end':
+            end = int(fields[1])
+    if start is None or end is None:
+        raise ValueError('Incomplete benchmark output, start:{0}, end:{1}'.format(start, end))
+    ops = hist.count - errors
+    latency = {'mean': hist.mean * 1000 if hist.count else None}
+    for p in PERCENTILES:
+        value = hist.percentile(p)
+        latency['p{0}'.format(p)] = value * 1000 if value is not None else None
+    return {'bytes': ops * block_size,
+            'ops': ops,
+            'errors': errors,
+            'elapsed': (end - start) / 1000000000.0,
+            'latency_ms': latency}
+
+
+class VolumeBenchmark(object):
+
+    def __init__(self, instance, euvolume, patterns=None, block_sizes=None, iodepths=1,
+                 runtime=30, offset=None, size=GB, engine=None, log=None):
+        """
+        :param instance: EuInstance the volume is attached to
+        :param euvolume: attached EuVolume with a populated guestdev
+        :param patterns: list of patterns to run from: 'read', 'write', 'randread', 'randwrite'
+        :param block_sizes: int or list of block sizes in bytes. Defaults to 1MB for sequential
+                            patterns and 4KB for random patterns.
+        :param iodepths: int or list of queue depths (concurrent outstanding operations)
+        :param runtime: seconds to run each pattern/block size/queue depth combination
+        :param offset: byte offset of the benchmark region on the device. Defaults to the first
+                       MB boundary past the volume's md5 length.
+        :param size: max size in bytes of the benchmark region
+        :param engine: 'fio' or 'shell', defaults to fio when installed on the guest
+        :param log: optional logger, defaults to the instance's
+        """
+        patterns = patterns or PATTERNS
+        for pattern in patterns:
+            if pattern not in PATTERNS:
+                raise ValueError('Unknown benchmark pattern:"{0}", valid patterns:"{1}"'
+                                 .format(pattern, ", ".join(PATTERNS)))
+        if engine is not None and engine not in ENGINES:
+            raise ValueError('Unknown benchmark engine:"{0}", valid engines:"{1}"'
+                             .format(engine, ", ".join(ENGINES)))
+        if block_sizes is not None and not isinstance(block_sizes, (list, tuple)):
+            block_sizes = [block_sizes]
+        if not isinstance(iodepths, (list, tuple)):
+            iodepths = [iodepths]
+        self.instance = instance
+        self.euvolume = euvolume
+        self.patterns = patterns
+        self.block_sizes = block_sizes
+        self.iodepths = iodepths
+        self.runtime = int(runtime)
+        self.offset = offset
+        self.size = size
+        self.engine = engine
+        self.log = log or instance.log
+
+    def _get_region(self, dev):
+        dev_size = self.instance.get_blockdev_size_in_bytes(dev)
+        offset = self.offset
+        if offset is None:
+            md5len = int(getattr(self.euvolume, 'md5len', None) or 0)
+            offset = ((md5len / MB) + 1) * MB
+        size = min(self.size, dev_size - offset)
+        if size < MB:
+            raise ValueError('Volume:{0} dev:{1} too small to benchmark, size:{2}, offset:{3}'
+                             .format(self.euvolume.id, dev, dev_size, offset))
+        return offset, size
+
+    def _get_engine(self):
+        if self.engine:
+            return self.engine
+        if self.instance.sys('command -v fio', verbose=False):
+            return 'fio'
+        return 'shell'
+
+    def run(self):
+        """
+        Runs every pattern, block size and queue depth combination in turn.
+        :returns list of result dicts
+        """
+        dev = getattr(self.euvolume, 'guestdev', None)
+        if not dev:
+            raise ValueError('Volume:{0} has no guest device on instance:{1}'
+                             .format(self.euvolume.id, self.instance.id))
+        dev = dev.strip()
+        offset, size = self._get_region(dev)
+        engine = self._get_engine()
+        direct = bool(self.instance.sys('dd --help 2>&1 | grep direct', verbose=False))
+        results = []
+        wrote = False
+        try:
+            for pattern in self.patterns:
+                block_sizes = self.block_sizes
+                if not block_sizes:
+                    block_sizes = [MB] if pattern in SEQUENTIAL_PATTERNS else [4096]
+                for block_size in block_sizes:
+                    for iodepth in self.iodepths:
+                        wrote = wrote or 'write' in pattern
+                        results.append(self.run_one(dev, engine, pattern, int(block_size),
+                                                    int(iodepth), offset, size, direct))
+        finally:
+            if wrote:
+                self._clear_overwritten_chunk_manifest(offset, size)
+        return results
+
+    def _clear_overwritten_chunk_manifest(self, offset, size):
+        manifest = getattr(self.euvolume, 'chunk_manifest', None)
+        if not manifest:
+            return
+        manifest = ChunkManifest.from_tag(manifest)
+        for index in manifest.indices:
+            start = index * manifest.chunk_size
+            if start < offset + size and start + manifest.chunk_size > offset:
+                self.log.debug('Write benchmark region offset:{0} size:{1} overlaps sampled '
+                               'chunk:{2} of vol:{3}'.format(offset, size, index,
+                                                             self.euvolume.id))
+                self.instance.clear_volume_chunk_manifest(self.euvolume)
+                return
+
+    def run_one(self, dev, engine, pattern, block_size, iodepth, offset, size, direct=True):
+        self.log.debug('Benchmarking vol:{0} dev:{1} on {2}, engine:{3}, pattern:{4}, bs:{5}, '
+                       'iodepth:{6}, runtime:{7}'
+                       .format(self.euvolume.id, dev, self.instance.id, engine, pattern,
+                               block_size, iodepth, self.runtime))
+        timeout = self.runtime + 120
+        if engine == 'fio':
+            cmd = build_fio_cmd(dev, pattern, block_size, iodepth, self.runtime, offset, size)
+            out = self.instance.sys(cmd, code=0, verbose=False, timeout=timeout)
+            result = parse_fio_output(out, pattern)
+        else:
+            cmd = build_shell_cmd(dev, pattern, block_size, iodepth, self.runtime, offset,
+                                  size, direct=direct)
+            out = self.instance.sys(cmd, code=0, verbose=False, timeout=timeout)
+            result = parse_shell_output(out, block_size)
+        elapsed = result['elapsed'] or 1
+        result.update({'instance': self.instance.id,
+                       'volume': self.euvolume.id,
+                       'dev': dev,
+                       'engine': engine,
+                       'pattern': pattern,
+                       'block_size': block_size,
+                       'iodepth': iodepth,
+                       'mbps': result['bytes'] / float(MB) / elapsed,
+                       'iops': result['ops'] / elapsed})
+        result.setdefault('errors', 0)
+        return result
+
+
+def benchmark_instances(instances, max_workers=None, **kwargs):
+    """
+    Benchmarks every attached volume on each of the provided instances at the same time, used
+    to find the point where the storage controller, rather than the guest, saturates.
+    Volumes on the same instance are benchmarked one after another.
+    :param instances: list of EuInstances with attached volumes
+    :param max_workers: max instances run at once, defaults to all of them
+    :param kwargs: VolumeBenchmark() keyword args
+    :returns list of result dicts for all instances
+    """
+    def run_instance(instance):
+        results = []
+        for euvolume in instance.attached_vols:
+            results.extend(VolumeBenchmark(instance, euvolume, **kwargs).run())
+        return results
+
+    results = []
+    with ThreadPoolExecutor(max_workers=max_workers or len(instances) or 1) as executor:
+        futures = [executor.submit(run_instance, instance) for instance in instances]
+        for future in futures:
+            results.extend(future.result())
+    return results
+
+
+def aggregate_results(results):
+    """
+    Sums MB/s and IOPS across instances/volumes for each pattern, block size and queue depth.
+    :returns list of dicts with keys: pattern, block_size, iodepth, volumes, mbps, iops
+    """
+    totals = {}
+    for result in results:
+        key = (result['pattern'], result['block_size'], result['iodepth'])
+        total = totals.setdefault(key, {'pattern': key[0], 'block_size': key[1],
+                                        'iodepth': key[2], 'volumes': 0, 'mbps': 0.0,
+                                        'iops': 0.0})
+        total['volumes'] += 1
+        total['mbps'] += result['mbps']
+        total['iops'] += result['iops']
+    return [totals[key] for key in sorted(totals.keys())]
+
+
+def show_volume_benchmark_results(results, printmethod=None, printme=True, log=None):
+    def fmt(value):
+        if value is None:
+            return '-'
+        return '{0:.2f}'.format(value)
+
+    pt = PrettyTable(['INSTANCE', 'VOLUME', 'DEV', 'ENGINE', 'PATTERN', 'BS', 'QD', 'MB/S',
+                      'IOPS', 'P50 MS', 'P99 MS', 'P99.9 MS', 'ERRS'])
+    pt.align = 'l'
+    for result in results:
+        latency = result['latency_ms']
+        pt.add_row([result['instance'], result['volume'], result['dev'], result['engine'],
+                    result['pattern'], result['block_size'], result['iodepth'],
+                    fmt(result['mbps']), fmt(result['iops']), fmt(latency.get('p50')),
+                    fmt(latency.get('p99')), fmt(latency.get('p99.9')), result['errors']])
+    if len(set([r['instance'] for r in results])) > 1:
+        total_pt = PrettyTable(['PATTERN', 'BS', 'QD', 'VOLUMES', 'TOTAL MB/S', 'TOTAL IOPS'])
+        total_pt.align = 'l'
+        for total in aggregate_results(results):
+            total_pt.add_row([total['pattern'], total['block_size'], total['iodepth'],
+                              total['volumes'], fmt(total['mbps']), fmt(total['iops'])])
+        pt = "{0}\n{1}".format(pt, total_pt)
+    if not printme:
+        return pt
+    printmethod = printmethod or (log or Eulogger('VolumeBenchmark')).info
+    printmethod("\n" + str(pt) + "\n")
@@ -39,6 +39,8 @@ Add common instance test routines to this class
 '''
 
 import socket
+import base64
+import json
 import os
 import re
 import time
@@ -56,9 +58,10 @@ from boto.ec2.networkinterface import NetworkInterface
 from nephoria.testcase_utils import wait_for_result
 from cloud_utils.log_utils import get_traceback, red
 from cloud_utils.net_utils import test_port_status
+from nephoria.testcase_utils.port_prober import PortProber, PortProbeException
 from boto.ec2.instance import InstanceState
 from datetime import datetime
-from cloud_utils.net_utils import winrm_connection
+from nephoria.aws.ec2.winrm_session import WinrmSession
 from requests.exceptions import ConnectionError
 
 termline = get_line()
@@ -472,6 +475,8 @@ class WinInstance(Instance, TaggedResource):
         newins.disk_partitions = []
         newins.logicaldisks = []
         newins.cygwin_dev_map  = {}
+        newins.disk_inventory = None
+        newins.use_disk_inventory = True
         #newins.set_block_device_prefix()
         if newins.root_device_type == 'ebs':
             try:
@@ -753,14 +758,14 @@ class WinInstance(Instance, TaggedResource):
                          self.winrm.password == self.password):
             if self.winrm:
                 self.winrm.close_shell()
-            self.winrm = winrm_connection.Winrm_Connection(
+            self.winrm = WinrmSession(
                 hostname = self.ip_address,
                 username = self.username,
                 password = self.password,
                 port = self.winrm_port,
                 protocol = self.winrm_protocol,
-                debug_method = self.debug,
-                verbose=True
+                log = self.log,
+                name = self.id
                 )
 
 
@@ -928,25 +933,50 @@ class WinInstance(Instance, TaggedResource):
         cmd - mandatory - string, the command to be executed
         verbose - optional - boolean flag to enable debug
         timeout - optional - command timeout in seconds
+        connection_retries - unused, the winrm session retries a command only when the
+                             connection was lost before the command was started, a started
+                             command is never run twice
         '''
         if (self.winrm is None):
             raise Exception("WinInstance winrm connection is None")
-        connection_retries = connection_retries or 1
-        ret = None
-        CE = None
-        for x in xrange(0, connection_retries):
-            try:
-                ret = self.winrm.sys(command=cmd, include_stderr=include_stderr, timeout=timeout,
-                                     verbose=verbose, code=code)
-                CE = None
-                break
-            except ConnectionError as CE:
-                self.log.error('{0}\nConnection error attempt:{1}/{2}. cmd:{3}'
-                               .format(get_traceback(), x, connection_retries, cmd))
-                time.sleep(x + 1)
-        if CE:
-            raise CE
-        return ret
+        return self.winrm.sys(command=cmd, include_stderr=include_stderr, timeout=timeout,
+                              verbose=verbose, code=code)
+
+    def stream(self, cmd, include_stderr=False, timeout=None, **kwargs):
+        '''
+        Runs a command on the guest returning an OutputStream which yields the output lines as
+        they are received, rather than a list of all of them once the command has finished
+        (see WinrmSession.stream)
+        :param cmd: string, the command to be executed
+        :param include_stderr: boolean, include stderr in the output
+        :param timeout: seconds to wait for the command to finish
+        :param kwargs: passed to OutputStream, ie code, match, stop_on_match, tail_lines
+        :returns OutputStream
+        '''
+        if (self.winrm is None):
+            raise Exception("WinInstance winrm connection is None")
+        return self.winrm.stream(cmd, include_stderr=include_stderr, timeout=timeout, **kwargs)
+
+    def sys_batch(self, cmds, verbose=True, code=None, timeout=None):
+        '''
+        Runs a list of commands on the guest in a single winrm round trip where possible
+        (see WinrmSession.sys_batch)
+        :param cmds: list of command strings, run in order
+        :param code: expected exit status of every command
+        :param timeout: command timeout in seconds
+        :returns list of dicts with 'command', 'status' and 'output' (list of lines)
+        '''
+        if (self.winrm is None):
+            raise Exception("WinInstance winrm connection is None")
+        return self.winrm.sys_batch(cmds, timeout=timeout, verbose=verbose, code=code)
+
+    def show_winrm_stats(self, printmethod=None, printme=True):
+        '''
+        Shows the per command latency and shell reuse stats of this instance's winrm session
+        '''
+        if (self.winrm is None):
+            raise Exception("WinInstance winrm connection is None")
+        return self.winrm.show_stats(printmethod=printmethod or self.debug, printme=printme)
 
 
 
@@ -965,7 +995,7 @@ class WinInstance(Instance, TaggedResource):
         ip = ip or self.ip_address
         return test_port_status(ip, int(port), timeout=timeout, tcp=tcp, verbose=verbose)
 
-    def poll_for_port_status_with_boot_delay(self, interval=15, ports=[], socktimeout=5,timeout=180, waitforboot=300):
+    def poll_for_port_status_with_boot_delay(self, interval=1, ports=[], socktimeout=5,timeout=180, waitforboot=300):
         '''
         Make sure some time has passed before we test on the guest side before running guest test...
 
@@ -978,7 +1008,8 @@ class WinInstance(Instance, TaggedResource):
                                           ip=self.ip_address,
                                           interval=interval,
                                           socktimeout=socktimeout,
-                                          timeout=timeout)
+                                          timeout=timeout,
+                                          start_time=time.time() - launch_seconds)
 
     def wait_for_time_since_launch(self,waitforboot=420):
         '''
@@ -996,36 +1027,30 @@ class WinInstance(Instance, TaggedResource):
             elapsed=int(time.time()-start)
         self.debug("test_wait_for_instance_boot: done waiting, instance up for "+str(waitforboot)+" seconds")
 
-    def poll_for_ports_status(self, ports=[], ip=None, interval=10, socktimeout=5, timeout=180):
+    def poll_for_ports_status(self, ports=[], ip=None, interval=1, socktimeout=5, timeout=180,
+                              start_time=None):
+        '''
+        Probes the ports concurrently until any one of them accepts tcp connections.
+        :param ports: list of ports, defaults to the rdp and winrm ports
+        :param interval: seconds between connect attempts to a port
+        :param socktimeout: seconds to wait on a single connect attempt
+        :param start_time: time.time() the reported time to open is measured from, ie launch time
+        :returns list of probe result dicts, see PortProber
+        '''
         ip = ip or self.ip_address
         ports = ports or [self.rdp_port, self.winrm_port]
-        start = time.time()
-        elapsed = 0
-        attempt = 0
-        while elapsed < timeout:
-            attempt +=1
-            self.debug('test_poll_for_ports_status, ports: ' + ",".join(str(x) for x in ports) + ", attempt:"  + str(attempt))
-            for port in ports:
-                if elapsed < timeout:
-                    try:
-                        self.debug('Trying ip:port:' + str(self.ip_address) + ':' + str(port) + ", elapsed:" + str(elapsed))
-                        self.test_port_status(ip=ip, port=int(port), timeout=5)
-                        return
-                    except socket.error, se:
-                        self.debug('test_ports_status failed socket error:'+str(se[0]))
-                        #handle specific errors here, for now just for debug...
-                        ecode=se[0]
-                        if ecode == socket.errno.ETIMEDOUT or ecode == "timed out":
-                            self.debug("test_poll_for_ports_status: Connect "+str(ip)+":" +str(port)+ " timed out retrying. Time remaining("+str(timeout-elapsed)+")")
-                    except Exception, e:
-                        tb = get_traceback()
-                        self.debug(tb)
-                        self.debug('test_poll_for_ports_status:'+str(ip)+':'+str(port)+' FAILED after attempts:'+str(attempt)+', elapsed:'+str(elapsed)+', err:'+str(e) )
-            elapsed = int(time.time() -start)
-            if elapsed < timeout:
-                time.sleep(interval)
-
-        raise Exception('test_poll_for_ports_status:'+str(ip)+':'+str(port)+' FAILED after attempts:'+str(attempt)+', elapsed:'+str(elapsed)+' seconds')
+        self.debug('test_poll_for_ports_status, ip:{0}, ports:{1}'
+                   .format(ip, ",".join(str(x) for x in ports)))
+        prober = PortProber([(ip, port) for port in ports], connect_timeout=socktimeout,
+                            retry_interval=interval, log=self.log)
+        results = prober.probe(timeout=timeout, require='any', start_time=start_time)
+        prober.show_results(results, printmethod=self.debug)
+        try:
+            prober.raise_on_unreachable(results, require='any')
+        except PortProbeException as PE:
+            raise Exception('test_poll_for_ports_status:{0} FAILED after {1} seconds. {2}'
+                            .format(ip, timeout, PE))
+        return results
 
     def init_attached_volumes(self):
         self.debug('init_attahced_volumes... attached_vols: ' + str(self.attached_vols))
@@ -1202,11 +1227,22 @@ class WinInstance(Instance, TaggedResource):
         E = None
         for x in xrange(0, max_retries):
             try:
-                self.diskdrives =  self.get_updated_diskdrive_info()
-                self.disk_partitions = self.get_updated_partition_info()
-                self.logicaldisks = self.get_updated_logicaldisk_info()
-                self.associate_diskdrives_to_partitions()
-                self.associate_partitions_to_logicaldrives()
+                if self.use_disk_inventory:
+                    try:
+                        self.get_disk_inventory(refresh=forceupdate or x > 0)
+                    except ValueError as VE:
+                        # Older guests without ConvertTo-Json, use wmic from here on
+                        self.log.warning('Disk inventory query failed, falling back to wmic. '
+                                         'Error:{0}'.format(VE))
+                        self.use_disk_inventory = False
+                if self.use_disk_inventory:
+                    self.update_disk_info_from_inventory()
+                else:
+                    self.diskdrives =  self.get_updated_diskdrive_info()
+                    self.disk_partitions = self.get_updated_partition_info()
+                    self.logicaldisks = self.get_updated_logicaldisk_info()
+                    self.associate_diskdrives_to_partitions()
+                    self.associate_partitions_to_logicaldrives()
                 E = None
                 break
             except Exception as E:
@@ -1216,6 +1252,134 @@ class WinInstance(Instance, TaggedResource):
         if E:
             raise E
 
+    def get_disk_inventory(self, refresh=False, verbose=False):
+        '''
+        Fetches the diskdrive, partition, logicaldisk and logicaldisk to partition association info
+        from the guest with a single powershell query returning json, rather than a wmic command
+        per type plus one per partition. The result is cached until a disk rescan, or until
+        it is older than self.disk_update_interval.
+        :param refresh: boolean, force the guest to be queried again
+        :returns dict with 'diskdrives', 'partitions', 'logicaldisks' lists of dicts (lowercase keys
+                 as the wmic parsed output), 'associations' list of
+                 (partition deviceid, logicaldisk deviceid) tuples, and 'last_updated'.
+        '''
+        inventory = self.disk_inventory
+        if not refresh and inventory and \
+                (time.time() - inventory['last_updated']) <= self.disk_update_interval:
+            return inventory
+        self.debug('Fetching disk inventory...')
+        script = (
+            "$d = @(Get-WmiObject Win32_DiskDrive | Select-Object DeviceID,Index,Size,Caption,"
+            "Model,SerialNumber,Partitions,InterfaceType,MediaType,SCSIBus,SCSIPort,"
+            "SCSITargetId,SCSILogicalUnit,Status);"
+            "$p = @(Get-WmiObject Win32_DiskPartition | Select-Object Name,DeviceID,DiskIndex,"
+            "Index,Size,BootPartition,Bootable,PrimaryPartition,StartingOffset,Type);"
+            "$l = @(Get-WmiObject Win32_LogicalDisk | Select-Object DeviceID,Size,FreeSpace,"
+            "FileSystem,Description,VolumeName,DriveType);"
+            "$a = @(Get-WmiObject Win32_LogicalDiskToPartition | Select-Object Antecedent,"
+            "Dependent);"
+            "@{diskdrives=$d; partitions=$p; logicaldisks=$l; associations=$a} | "
+            "ConvertTo-Json -Compress -Depth 3")
+        cmd = "powershell -NoProfile -NonInteractive -EncodedCommand {0}"\
+            .format(base64.b64encode(script.encode('utf-16-le')))
+        # stderr is included so a failed query is reported in the ValueError raised by the parser
+        output = "".join(self.sys(cmd, verbose=verbose, include_stderr=True) or [])
+        inventory = self.parse_disk_inventory(output)
+        self.disk_inventory = inventory
+        self.debug('get_disk_inventory, Done')
+        return inventory
+
+    def parse_disk_inventory(self, output):
+        '''
+        Parses the json output of the disk inventory query. Values are converted to match the
+        wmic parsed output; booleans to 'TRUE'/'FALSE', None to ''.
+        :param output: string, json output of the query
+        :returns inventory dict, see get_disk_inventory()
+        '''
+        start = output.find('{')
+        if start < 0:
+            raise ValueError('No json found in disk inventory output:"{0}"'.format(output))
+        data, _ = json.JSONDecoder().raw_decode(output[start:])
+
+        def convert(value):
+            if isinstance(value, bool):
+                return str(value).upper()
+            if value is None:
+                return ''
+            if isinstance(value, unicode):
+                return value.encode('utf-8', 'replace').strip()
+            return value
+
+        def get_list(key):
+            items = data.get(key) or []
+            # A single object may not be wrapped in a list on some powershell versions
+            if isinstance(items, dict):
+                items = [items]
+            return [dict((str(k).lower(), convert(v)) for k, v in item.iteritems())
+                    for item in items]
+
+        associations = []
+        for assoc in get_list('associations'):
+            part = re.search('DeviceID="([^"]*)"', assoc.get('antecedent', ''))
+            logical = re.search('DeviceID="([^"]*)"', assoc.get('dependent', ''))
+            if part and logical:
+                associations.append((part.group(1), logical.group(1)))
+        return {'diskdrives': get_list('diskdrives'),
+                'partitions': get_list('partitions'),
+                'logicaldisks': get_list('logicaldisks'),
+                'associations': associations,
+                'last_updated': time.time()}
+
+    def update_disk_info_from_inventory(self, inventory=None):
+        '''
+        Populates self.diskdrives, self.disk_partitions and self.logicaldisks along with their
+        associations from the disk inventory in a single pass.
+        :param inventory: inventory dict, defaults to the cached self.disk_inventory
+        '''
+        inventory = inventory or self.get_disk_inventory()
+        created = []
+        for wmic_dicts, disk_class in [(inventory['diskdrives'], WinInstanceDiskDrive),
+                                       (inventory['partitions'], WinInstanceDiskPartition),
+                                       (inventory['logicaldisks'], WinInstanceLogicalDisk)]:
+            disks = []
+            for wmic_dict in wmic_dicts:
+                try:
+                    disks.append(disk_class(self, wmic_dict))
+                except Exception, e:
+                    tb = get_traceback()
+                    self.debug('Error attempting to create {0} from following dict:'
+                               .format(disk_class.__name__))
+                    self.print_dict(dict=wmic_dict)
+                    raise Exception(str(tb) + "\n Error attempting to create {0}:{1}"
+                                    .format(disk_class.__name__, e))
+            created.append(disks)
+        self.diskdrives, self.disk_partitions, self.logicaldisks = created
+        self.associate_diskdrives_to_partitions()
+        partitions = dict((part.deviceid, part) for part in self.disk_partitions)
+        logicaldisks = dict((disk.deviceid, disk) for disk in self.logicaldisks)
+        for part_id, logical_id in inventory['associations']:
+            part = partitions.get(part_id)
+            disk = logicaldisks.get(logical_id)
+            if part and disk:
+                part.logicaldisks.append(disk)
+                disk.partition = part
+
+    def get_cygwin_dev_map_from_inventory(self, inventory):
+        '''
+        Cygwin names physical drives by index, /dev/sda is \\.\PhysicalDrive0 through /dev/sddx,
+        so the diskdrive mapping can be derived from the disk inventory without running cygpath.
+        '''
+        cygwin_dev_map = {}
+        for disk in inventory['diskdrives']:
+            index = int(disk.get('index'))
+            if index < 26:
+                letters = chr(ord('a') + index)
+            else:
+                letters = chr(ord('a') + index / 26 - 1) + chr(ord('a') + index % 26)
+            cygwin_dev_map['/dev/sd' + letters] = '\\\\.\\PHYSICALDRIVE{0}'.format(index)
+        cygwin_dev_map['last_updated'] = inventory['last_updated']
+        return cygwin_dev_map
+
 
     def get_updated_diskdrive_info(self):
         '''
@@ -1625,7 +1789,8 @@ class WinInstance(Instance, TaggedResource):
                         while (elapsed < timeout):
                             diskdrive_ids = []
                             try:
-                                disk_drives = self.get_updated_diskdrive_info()
+                                self.update_disk_info(forceupdate=True, max_retries=1)
+                                disk_drives = self.diskdrives
                                 for disk in disk_drives:
                                     if dev == disk.deviceid:
                                         found = True
@@ -1813,6 +1978,11 @@ class WinInstance(Instance, TaggedResource):
     def update_cygwin_windows_device_map(self, prefix='/dev/*', force_update=False, max_retries=3):
         cygwin_dev_map = {}
         if not force_update:
+            inventory = self.disk_inventory
+            if inventory and inventory['diskdrives']:
+                if self.cygwin_dev_map.get('last_updated') != inventory['last_updated']:
+                    self.cygwin_dev_map = self.get_cygwin_dev_map_from_inventory(inventory)
+                return self.cygwin_dev_map
             if self.cygwin_dev_map:
                 if time.time() - self.cygwin_dev_map['last_updated'] <= 30:
                     cygwin_dev_map = self.cygwin_dev_map
@@ -1858,8 +2028,9 @@ class WinInstance(Instance, TaggedResource):
         param timeout: integer. Seconds to wait on command before failing
         '''
         scriptname = 'nephoria_diskpart_script'
-        self.sys('(echo rescan && echo list disk ) > ' + str(scriptname), code=0)
-        self.sys('diskpart /s ' + str(scriptname), code=0, timeout=timeout)
+        self.disk_inventory = None
+        self.sys_batch(['(echo rescan && echo list disk ) > ' + str(scriptname),
+                        'diskpart /s ' + str(scriptname)], code=0, timeout=timeout)
 
 
     def get_diskdrive_for_volume(self, volume):
@@ -0,0 +1,471 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009-2014, Eucalyptus Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use of this software in source and binary forms, with or
+# without modification, are permitted provided that the following conditions
+# are met:
+#
+#   Redistributions of source code must retain the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other
+#   materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+'''
+Persistent WinRM sessions for Windows guest command execution.
+
+Opening a remote shell costs several WinRM SOAP/HTTP round trips on top of the command itself.
+A WinrmSession keeps one remote cmd shell open per guest and runs each command in it, reusing
+the protocol's HTTP keep-alive connection, so a command costs only its own run/receive/cleanup
+requests. The shell is reopened when it has been idle longer than the guest's shell idle
+timeout, after max_shell_commands commands, or when a command fails because the shell or
+connection was lost (the command is then retried once).
+sys_batch() runs several commands in a single round trip through one powershell invocation.
+stream() runs a command in a shell of its own and returns an OutputStream yielding its output
+lines as each receive returns them, for long running or verbose commands.
+Latency is recorded per command name (the first word of the command) as well as overall.
+
+Sample usage:
+    session = WinrmSession(hostname=ip, username='Administrator', password=pw, log=log)
+    session.sys('whoami', code=0)
+    session.sys_batch(['hostname', 'ver'], code=0)
+    session.show_stats()
+'''
+
+import base64
+import json
+import ntpath
+import threading
+import time
+from winrm.protocol import Protocol
+from winrm import exceptions as winrm_exceptions
+from cloud_utils.log_utils.eulogger import Eulogger
+from cloud_utils.net_utils.sshconnection import CommandExitCodeException, \
+    CommandTimeoutException
+from nephoria.testcase_utils.loadgen import LatencyHistogram, latency_table
+from nephoria.testcase_utils.output_stream import OutputStream
+
+# Not present in older pywinrm versions, where a receive with no output simply returns
+WinRMOperationTimeoutError = getattr(winrm_exceptions, 'WinRMOperationTimeoutError', None)
+
+
+class WinrmSession(object):
+    # Max length of a cmd.exe command line is 8191 chars
+    MAX_COMMAND_LENGTH = 8000
+
+    def __init__(self, hostname, username, password, port=5985, protocol='http',
+                 transport='plaintext', idle_timeout=600, max_shell_commands=500,
+                 default_timeout=600, log=None, name=None):
+        """
+        :param hostname: guest address
+        :param username: guest username
+        :param password: guest password
+        :param port: winrm port
+        :param protocol: 'http' or 'https'
+        :param transport: pywinrm transport, ie 'plaintext', 'ssl' or 'ntlm'
+        :param idle_timeout: seconds a shell may be idle before it is reopened rather than
+                             reused. Should be less than the guest's shell idle timeout.
+        :param max_shell_commands: number of commands run in a shell before it is reopened
+        :param default_timeout: command timeout in seconds used when none is given
+        """
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.port = port
+        self.protocol = protocol
+        self.transport = transport
+        self.idle_timeout = idle_timeout
+        self.max_shell_commands = max_shell_commands
+        self.default_timeout = default_timeout
+        self.log = log or Eulogger(self.__class__.__name__)
+        self.name = name or hostname
+        # None until the guest's powershell has been checked for ConvertTo-Json
+        self.batch_supported = None
+        self._winproto = None
+        self.shell_id = None
+        self._shell_commands = 0
+        self._last_used = None
+        self._lock = threading.RLock()
+        self._stats_lock = threading.Lock()
+        self.stats = {'commands': 0, 'errors': 0, 'timeouts': 0, 'shells': 0, 'retries': 0,
+                      'batches': 0}
+        self.latency = LatencyHistogram()
+        self.command_latency = {}
+
+    def __repr__(self):
+        return '{0}:{1}'.format(self.__class__.__name__, self.name)
+
+    def _debug(self, msg):
+        self.log.debug('{0}: {1}'.format(self.name, msg))
+
+    @property
+    def url(self):
+        return '{0}://{1}:{2}/wsman'.format(self.protocol, self.hostname, self.port)
+
+    @property
+    def winproto(self):
+        """
+        The pywinrm Protocol, kept for the life of the session so its http connection is reused
+        """
+        if self._winproto is None:
+            kwargs = {}
+            if self.protocol == 'https':
+                kwargs['server_cert_validation'] = 'ignore'
+            self._winproto = Protocol(endpoint=self.url, transport=self.transport,
+                                      username=self.username, password=self.password,
+                                      **kwargs)
+        return self._winproto
+
+    def get_shell(self):
+        """
+        Returns the id of the open remote shell, opening a new one if there is none or the
+        current one should not be reused.
+        """
+        with self._lock:
+            if self.shell_id is not None:
+                idle = time.time() - (self._last_used or 0)
+                if idle > self.idle_timeout or self._shell_commands >= self.max_shell_commands:
+                    self._debug('Reopening shell, idle:{0:.0f}s, commands:{1}'
+                                .format(idle, self._shell_commands))
+                    self.close_shell()
+            if self.shell_id is None:
+                self.shell_id = self.winproto.open_shell()
+                self._shell_commands = 0
+                self._last_used = time.time()
+                with self._stats_lock:
+                    self.stats['shells'] += 1
+            return self.shell_id
+
+    def close_shell(self):
+        with self._lock:
+            shell_id = self.shell_id
+            self.shell_id = None
+            if shell_id is not None and self._winproto is not None:
+                try:
+                    self._winproto.close_shell(shell_id)
+                except Exception as E:
+                    self._debug('Error closing shell:{0}, err:"{1}"'.format(shell_id, E))
+
+    def reset(self):
+        """
+        Closes the shell and drops the protocol, so the next command opens a new connection
+        """
+        with self._lock:
+            self.close_shell()
+            self._winproto = None
+
+    def _record(self, cmd, elapsed, error=False, timeout=False):
+        cmd = str(cmd or "").strip()
+        name = ntpath.basename(cmd.split()[0]) if cmd else '(empty)'
+        with self._stats_lock:
+            self.stats['commands'] += 1
+            if error:
+                self.stats['errors'] += 1
+            if timeout:
+                self.stats['timeouts'] += 1
+            hist = self.command_latency.get(name)
+            if hist is None:
+                hist = LatencyHistogram()
+                self.command_latency[name] = hist
+        hist.record(elapsed)
+        self.latency.record(elapsed)
+
+    def _get_output(self, shell_id, command_id, timeout):
+        stdout = []
+        stderr = []
+        deadline = time.time() + timeout
+        while True:
+            try:
+                out, err, status, done = self.winproto._raw_get_command_output(shell_id,
+                                                                              command_id)
+            except Exception as E:
+                if WinRMOperationTimeoutError and isinstance(E, WinRMOperationTimeoutError):
+                    out, err, status, done = '', '', None, False
+                else:
+                    raise
+            stdout.append(out)
+            stderr.append(err)
+            if done:
+                return "".join(stdout), "".join(stderr), status
+            if time.time() > deadline:
+                raise CommandTimeoutException('{0}: Command timed out after {1} seconds'
+                                              .format(self.name, timeout))
+
+    def run(self, command, timeout=None):
+        """
+        Runs 'command' in the session's remote cmd shell.
+        If the shell or connection was lost before the command was started it is run once more
+        in a new shell. A command which has started is never run again, errors reading its
+        output and timeouts are raised.
+        :returns tuple (stdout, stderr, exit status)
+        """
+        timeout = timeout or self.default_timeout
+        with self._lock:
+            attempt = 0
+            while True:
+                attempt += 1
+                start = time.time()
+                command_id = None
+                try:
+                    shell_id = self.get_shell()
+                    command_id = self.winproto.run_command(shell_id, command)
+                    stdout, stderr, status = self._get_output(shell_id, command_id, timeout)
+                except CommandTimeoutException:
+                    self._record(command, time.time() - start, error=True, timeout=True)
+                    # The shell may still be busy with the command, start fresh next time
+                    self.close_shell()
+                    raise
+                except Exception as E:
+                    self.reset()
+                    # Only retry if the guest never received the command
+                    if attempt == 1 and command_id is None:
+                        with self._stats_lock:
+                            self.stats['retries'] += 1
+                        self._debug('Error running cmd:"{0}", err:"{1}". Retrying in a new '
+                                    'shell...'.format(command, E))
+                        continue
+                    self._record(command, time.time() - start, error=True)
+                    raise
+                try:
+                    self.winproto.cleanup_command(shell_id, command_id)
+                except Exception as E:
+                    self._debug('Error cleaning up command:"{0}", err:"{1}"'.format(command, E))
+                self._shell_commands += 1
+                self._last_used = time.time()
+                self._record(command, self._last_used - start)
+                return stdout, stderr, status
+
+    @staticmethod
+    def _split_lines(output):
+        lines = [line.rstrip('\r') for line in output.split('\n')]
+        if lines and not lines[-1]:
+            lines.pop()
+        return lines
+
+    def sys(self, command, include_stderr=False, timeout=None, verbose=None, code=None,
+            listformat=True):
+        """
+        Runs 'command' on the guest.
+        :param include_stderr: boolean, append stderr to the returned output
+        :param timeout: command timeout in seconds
+        :param verbose: boolean, log the command output
+        :param code: expected exit status, a CommandExitCodeException is raised if it differs
+        :param listformat: boolean, return a list of lines rather than a string
+        :returns output of the command
+        """
+        stdout, stderr, status = self.run(command, timeout=timeout)
+        if verbose:
+            self._debug('cmd:"{0}", status:{1}\n{2}{3}'.format(command, status, stdout, stderr))
+        if code is not None and status != code:
+            raise CommandExitCodeException('Cmd:"{0}" failed with status code:{1}\n, stdout:{2}'
+                                           '\n, stderr:{3}'.format(command, status, stdout,
+                                                                   stderr))
+        output = stdout
+        if include_stderr:
+            output += stderr
+        if listformat:
+            return self._split_lines(output)
+        return output
+
+    def stream(self, command, include_stderr=False, timeout=None, **kwargs):
+        """
+        Returns an OutputStream which runs 'command' on the guest and yields its output lines
+        as they are received. The command is started when the stream is first read, in a new
+        shell rather than the session's shared one so other commands can be run while the
+        stream is read. The shell is closed when the stream ends or is closed, so a stream
+        which is never read leaves nothing open on the guest. Short commands are better run
+        with sys(), which reuses the shared shell.
+        Note each receive waits on the guest until output arrives or the WinRM operation
+        timeout expires, so a timeout is only noticed between receives.
+        :param include_stderr: boolean, include stderr in the output, otherwise it is discarded
+        :param timeout: seconds to wait for the command to finish
+        :param kwargs: passed to OutputStream, ie code, match, stop_on_match, tail_lines
+        :returns OutputStream
+        """
+        timeout = timeout or self.default_timeout
+        winproto = self.winproto
+        # Shell and command ids and start time, set once the command has been started
+        state = {}
+
+        def start():
+            start_time = time.time()
+            shell_id = winproto.open_shell()
+            with self._stats_lock:
+                self.stats['shells'] += 1
+            try:
+                command_id = winproto.run_command(shell_id, command)
+            except Exception:
+                winproto.close_shell(shell_id)
+                self._record(command, time.time() - start_time, error=True)
+                raise
+            state.update(shell_id=shell_id, command_id=command_id, start=start_time)
+
+        def read(wait):
+            if not state:
+                start()
+            try:
+                out, err, status, done = winproto._raw_get_command_output(state['shell_id'],
+                                                                          state['command_id'])
+            except Exception as E:
+                if WinRMOperationTimeoutError and isinstance(E, WinRMOperationTimeoutError):
+                    return '', False, None
+                raise
+            if include_stderr:
+                out += err
+            return out, done, status
+
+        def close():
+            if not state:
+                return
+            try:
+                try:
+                    winproto.cleanup_command(state['shell_id'], state['command_id'])
+                finally:
+                    winproto.close_shell(state['shell_id'])
+            finally:
+                self._record(command, time.time() - state['start'],
+                             error=bool(output.timed_out or
+                                        (output.status is not None and output.code is not None
+                                         and output.status != output.code)),
+                             timeout=output.timed_out)
+                state.clear()
+
+        kwargs.setdefault('log', self.log)
+        output = OutputStream(read=read, close=close, cmd=command, timeout=timeout, **kwargs)
+        return output
+
+    @staticmethod
+    def _encode_powershell(script):
+        return "powershell -NoProfile -NonInteractive -EncodedCommand {0}"\
+            .format(base64.b64encode(script.encode('utf-16-le')))
+
+    def check_batch_support(self, timeout=None):
+        """
+        Checks whether the guest's powershell has ConvertTo-Json (powershell 3.0 and later),
+        which batched commands need to return their results. The result is cached in
+        'batch_supported'.
+        :returns boolean
+        """
+        if self.batch_supported is None:
+            script = "if (Get-Command ConvertTo-Json -ErrorAction SilentlyContinue) " \
+                     "{ 'BATCH_SUPPORTED' }"
+            try:
+                stdout, stderr, status = self.run(self._encode_powershell(script),
+                                                  timeout=timeout)
+                self.batch_supported = 'BATCH_SUPPORTED' in stdout
+            except CommandTimeoutException:
+                raise
+            except Exception as E:
+                self._debug('Error checking for batch support, err:"{0}"'.format(E))
+                self.batch_supported = False
+            if not self.batch_supported:
+                self._debug('Batched commands not supported by guest, commands will be run '
+                            'individually')
+        return self.batch_supported
+
+    @classmethod
+    def _batch_command(cls, commands):
+        lines = ["$r = @()"]
+        quoted = ",".join("'{0}'".format(c.replace("'", "''")) for c in commands)
+        lines.append("foreach ($c in @({0})) {{".format(quoted))
+        lines.append("$o = cmd /c $c 2>&1 | ForEach-Object {\"$_\"} | Out-String")
+        lines.append("$r += @{command=$c; status=$LASTEXITCODE; output=$o} }")
+        lines.append("ConvertTo-Json -InputObject $r -Compress")
+        return cls._encode_powershell("\n".join(lines))
+
+    def sys_batch(self, commands, timeout=None, verbose=None, code=None):
+        """
+        Runs a list of commands in order with a single powershell invocation per batch, rather
+        than a round trip per command. Commands are split into as many batches as needed to
+        fit the guest's max command line length. Guests whose powershell can not produce json
+        (see check_batch_support()) have the commands run one at a time instead.
+        :param commands: list of command strings
+        :param timeout: timeout in seconds for each batch
+        :param verbose: boolean, log the command output
+        :param code: expected exit status of every command, a CommandExitCodeException is
+                     raised for the first which differs
+        :returns list of dicts with 'command', 'status' and 'output' (list of lines, stdout
+                 and stderr combined), in the order given
+        """
+        results = []
+        batches = []
+        for command in commands:
+            if batches and len(self._batch_command(batches[-1] + [command])) <= \
+                    self.MAX_COMMAND_LENGTH:
+                batches[-1].append(command)
+            else:
+                batches.append([command])
+        for batch in batches:
+            results.extend(self._run_batch(batch, timeout=timeout))
+        for result in results:
+            if verbose:
+                self._debug('cmd:"{0}", status:{1}\n{2}'.format(result['command'],
+                                                                 result['status'],
+                                                                 "\n".join(result['output'])))
+            if code is not None and result['status'] != code:
+                raise CommandExitCodeException('Cmd:"{0}" failed with status code:{1}\n, '
+                                               'output:{2}'.format(result['command'],
+                                                                   result['status'],
+                                                                   "\n".join(result['output'])))
+        return results
+
+    def _run_batch(self, commands, timeout=None):
+        if self.check_batch_support(timeout=timeout):
+            stdout, stderr, status = self.run(self._batch_command(commands), timeout=timeout)
+            start = stdout.find('[')
+            try:
+                if start < 0:
+                    raise ValueError('no json in output')
+                data, _ = json.JSONDecoder().raw_decode(stdout[start:])
+            except ValueError as VE:
+                # The commands have already run, do not run them again individually
+                raise RuntimeError('{0}: Failed to parse results of batched commands:"{1}", '
+                                   'err:"{2}", status:{3}, stdout:"{4}", stderr:"{5}"'
+                                   .format(self.name, commands, VE, status, stdout, stderr))
+            else:
+                with self._stats_lock:
+                    self.stats['batches'] += 1
+                if isinstance(data, dict):
+                    data = [data]
+                return [{'command': (item.get('command') or '').encode('utf-8', 'replace'),
+                         'status': item.get('status'),
+                         'output': self._split_lines(
+                             (item.get('output') or '').encode('utf-8', 'replace'))}
+                        for item in data]
+        results = []
+        for command in commands:
+            stdout, stderr, status = self.run(command, timeout=timeout)
+            results.append({'command': command, 'status': status,
+                            'output': self._split_lines(stdout + stderr)})
+        return results
+
+    def show_stats(self, printmethod=None, printme=True):
+        rows = sorted(self.command_latency.items(), key=lambda x: x[1].count, reverse=True)
+        rows.append(('(all)', self.latency))
+        pt = latency_table(rows)
+        buf = ('{0} commands:{1} errors:{2} timeouts:{3} shells:{4} retries:{5} batches:{6}\n'
+               '{7}'.format(self, self.stats['commands'], self.stats['errors'],
+                            self.stats['timeouts'], self.stats['shells'], self.stats['retries'],
+                            self.stats['batches'], pt))
+        if not printme:
+            return buf
+        printmethod = printmethod or self.log.info
+        printmethod("\n" + buf + "\n")
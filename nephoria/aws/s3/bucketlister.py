@@ -0,0 +1,312 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009-2014, Eucalyptus Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use of this software in source and binary forms, with or
+# without modification, are permitted provided that the following conditions
+# are met:
+#
+#   Redistributions of source code must retain the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other
+#   materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Concurrent bucket listing engine.
+Splits the keyspace of one or more buckets into partitions, either by the common prefixes
+found under a delimiter or by key ranges split on a set of characters, and lists the partitions
+concurrently using max-size pages. When the delimiter yields fewer partitions than workers (ie
+flat keys sharing one long prefix) partitions are split further into key ranges, one at a time
+until there are enough partitions for the workers. A partition whose first page holds all of
+its keys is not split. Key ranges start after the longest prefix shared by every key, found
+with a few single key requests. Keys are streamed to a callback as each page arrives rather
+than being gathered into a list, so listing very large buckets uses constant memory.
+
+Sample usage:
+    def on_key(key):
+        print key.name
+
+    lister = BucketLister([bucket1, bucket2], max_workers=20, log=s3ops.log)
+    stats = lister.list(on_key)
+    print stats['keys_per_sec']
+'''
+
+import string
+import threading
+import time
+from concurrent.futures.thread import ThreadPoolExecutor
+from boto.s3.prefix import Prefix
+
+
+class BucketListerException(Exception):
+    pass
+
+
+class ListPartition(object):
+    """
+    A portion of a bucket's keyspace.
+    Keys under 'prefix' which sort after 'marker' and at or before 'end' (when set).
+    """
+    def __init__(self, bucket, prefix='', marker=None, end=None):
+        self.bucket = bucket
+        self.prefix = prefix or ''
+        self.marker = marker
+        self.end = end
+        self.keys = 0
+        self.pages = 0
+        self.elapsed = 0
+
+    def __repr__(self):
+        return 'ListPartition(bucket:"{0}", prefix:"{1}", marker:"{2}", end:"{3}")'\
+            .format(self.bucket.name, self.prefix, self.marker, self.end)
+
+
+class BucketLister(object):
+    MAX_PAGE_SIZE = 1000
+    DEFAULT_SPLIT_CHARS = string.digits + string.ascii_letters + '-._'
+    # Sorts after any ascii key character, used to find keys beyond a prefix
+    _PREFIX_END = '\x7f'
+
+    def __init__(self, buckets, prefix='', delimiter='/', depth=1, split_chars=None,
+                 max_workers=10, page_size=MAX_PAGE_SIZE,
+                 fallback_split_chars=DEFAULT_SPLIT_CHARS, log=None):
+        """
+        :param buckets: a boto bucket or list of buckets to list
+        :param prefix: only keys beginning with this prefix are listed
+        :param delimiter: delimiter used to discover common prefixes to partition on
+        :param depth: number of delimiter levels to expand when discovering partitions.
+                      A level containing only a single common prefix and no keys is always
+                      expanded further since it can not be split.
+        :param split_chars: optional string of characters. When provided the keyspace under
+                            'prefix' is split into key ranges on these characters instead of
+                            by delimiter, useful for flat key namespaces.
+                            ie string.digits + string.ascii_letters
+        :param max_workers: max number of partitions listed at once
+        :param page_size: max keys requested per list request
+        :param fallback_split_chars: characters to split delimiter partitions into key ranges
+                                     on when the delimiter yields fewer partitions than
+                                     max_workers, None to disable. Partitions are only split
+                                     until there are max_workers of them.
+        :param log: optional logger
+        """
+        if not isinstance(buckets, (list, tuple)):
+            buckets = [buckets]
+        self.buckets = buckets
+        self.prefix = prefix or ''
+        self.delimiter = delimiter
+        self.depth = depth
+        self.split_chars = split_chars
+        self.max_workers = max_workers
+        self.page_size = min(page_size, self.MAX_PAGE_SIZE)
+        self.fallback_split_chars = fallback_split_chars
+        self.log = log
+        self._lock = threading.Lock()
+
+    def _debug(self, msg):
+        if self.log:
+            self.log.debug(msg)
+
+    def _get_shared_prefix(self, bucket, prefix, stats, marker=None):
+        """
+        Returns the longest prefix shared by every key under 'prefix' sorting after 'marker',
+        or None if there are no such keys. The first key is fetched, then a binary search over
+        its length checks whether any key sorts beyond each candidate prefix, each check a
+        single key request.
+        """
+        page = bucket.get_all_keys(prefix=prefix, marker=marker, max_keys=1)
+        stats['pages'] += 1
+        first = None
+        for key in page:
+            first = key.name
+        if first is None:
+            return None
+        low = len(prefix)
+        high = len(first)
+        while low < high:
+            mid = (low + high + 1) // 2
+            candidate = first[:mid]
+            page = bucket.get_all_keys(prefix=prefix, marker=candidate + self._PREFIX_END,
+                                       max_keys=1)
+            stats['pages'] += 1
+            if len(page):
+                high = mid - 1
+            else:
+                low = mid
+        return first[:low]
+
+    def _get_range_partitions(self, bucket, prefix, split_chars, stats, marker=None):
+        # Ranges are (boundary[i], boundary[i+1]], S3 lists keys strictly after the marker so a
+        # key equal to a boundary is included in the range ending at that boundary. Keys at or
+        # before 'marker' were already listed, ranges ending there are dropped.
+        shared = self._get_shared_prefix(bucket, prefix, stats, marker=marker)
+        if shared is None:
+            return []
+        boundaries = [shared + c for c in sorted(set(split_chars))]
+        partitions = []
+        for boundary in boundaries:
+            if marker is None or boundary > marker:
+                partitions.append(ListPartition(bucket, prefix=shared, marker=marker,
+                                                end=boundary))
+                marker = boundary
+        partitions.append(ListPartition(bucket, prefix=shared, marker=marker))
+        return partitions
+
+    def _get_delimiter_partitions(self, bucket, callback, stats):
+        # Keys found at each expanded level are streamed to the callback during discovery,
+        # every common prefix at the last level becomes a partition. With fallback split chars
+        # set, a level holding more than a page of keys and no prefixes is not listed serially
+        # here, the keys after its first page become a partition split into key ranges later.
+        partitions = []
+        levels = [(self.prefix, 0)]
+        while levels:
+            prefix, level = levels.pop(0)
+            found_keys = 0
+            found_prefixes = []
+            marker = None
+            while True:
+                page = bucket.get_all_keys(prefix=prefix, delimiter=self.delimiter,
+                                           marker=marker, max_keys=self.page_size)
+                stats['pages'] += 1
+                last = None
+                for item in page:
+                    last = item.name
+                    if isinstance(item, Prefix):
+                        found_prefixes.append(item.name)
+                    else:
+                        found_keys += 1
+                        callback(item)
+                if not page.is_truncated or last is None:
+                    break
+                marker = getattr(page, 'next_marker', None) or last
+                if self.fallback_split_chars and not found_prefixes:
+                    partitions.append(ListPartition(bucket, prefix=prefix, marker=marker))
+                    break
+            stats['keys'] += found_keys
+            for found in found_prefixes:
+                if level + 1 < self.depth or (len(found_prefixes) == 1 and not found_keys):
+                    levels.append((found, level + 1))
+                else:
+                    partitions.append(ListPartition(bucket, prefix=found))
+        return partitions
+
+    def get_partitions(self, callback, stats):
+        partitions = []
+        for bucket in self.buckets:
+            if self.split_chars:
+                partitions.extend(self._get_range_partitions(bucket, self.prefix,
+                                                             self.split_chars, stats))
+            elif self.delimiter:
+                partitions.extend(self._get_delimiter_partitions(bucket, callback, stats))
+            else:
+                partitions.append(ListPartition(bucket, prefix=self.prefix))
+        if not self.split_chars and self.fallback_split_chars and \
+                len(partitions) < self.max_workers:
+            self._debug('{0} partitions for {1} workers, splitting partitions into key ranges'
+                        .format(len(partitions), self.max_workers))
+            partitions = self._split_partitions(partitions, callback, stats)
+        return partitions
+
+    def _split_partitions(self, partitions, callback, stats):
+        # Splits partitions into key ranges one at a time until there are max_workers
+        # partitions. Partitions known to hold more than a page (those with a marker, see
+        # _get_delimiter_partitions) are split first. Others have their first page listed
+        # here, a partition which fits in that page is complete and is not split.
+        pending = sorted(partitions, key=lambda p: p.marker is None)
+        split = []
+        while pending and len(split) + len(pending) < self.max_workers:
+            partition = pending.pop(0)
+            if partition.marker is None:
+                page = partition.bucket.get_all_keys(prefix=partition.prefix,
+                                                     max_keys=self.page_size)
+                stats['pages'] += 1
+                last = None
+                for key in page:
+                    last = key.name
+                    stats['keys'] += 1
+                    callback(key)
+                if not page.is_truncated or last is None:
+                    continue
+                partition.marker = last
+            split.extend(self._get_range_partitions(partition.bucket, partition.prefix,
+                                                    self.fallback_split_chars, stats,
+                                                    marker=partition.marker))
+        return split + pending
+
+    def list_partition(self, partition, callback):
+        """
+        List all the keys in a partition, streaming each key to the callback.
+        """
+        start = time.time()
+        marker = partition.marker
+        done = False
+        while not done:
+            page = partition.bucket.get_all_keys(prefix=partition.prefix, marker=marker,
+                                                 max_keys=self.page_size)
+            partition.pages += 1
+            last = None
+            for key in page:
+                if partition.end is not None and key.name > partition.end:
+                    done = True
+                    break
+                last = key.name
+                partition.keys += 1
+                callback(key)
+            if not page.is_truncated or last is None:
+                done = True
+            marker = last
+        partition.elapsed = time.time() - start
+        return partition
+
+    def list(self, callback):
+        """
+        Lists every key of the provided buckets, calling callback(key) for each.
+        Note: the callback is invoked concurrently from multiple listing threads.
+        :returns dict of listing stats; keys, pages, partitions, elapsed, keys_per_sec
+        """
+        stats = {'keys': 0, 'pages': 0, 'partitions': 0, 'errors': 0}
+        start = time.time()
+        partitions = self.get_partitions(callback, stats)
+        stats['partitions'] = len(partitions)
+        self._debug('Listing {0} partitions across {1} buckets with {2} workers'
+                    .format(len(partitions), len(self.buckets), self.max_workers))
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.list_partition, partition, callback)
+                       for partition in partitions]
+            for future in futures:
+                try:
+                    partition = future.result()
+                    stats['keys'] += partition.keys
+                    stats['pages'] += partition.pages
+                except Exception as E:
+                    errors.append(E)
+                    self._debug('Error listing partition:"{0}"'.format(E))
+        stats['errors'] = len(errors)
+        stats['elapsed'] = time.time() - start
+        if stats['elapsed']:
+            stats['keys_per_sec'] = stats['keys'] / stats['elapsed']
+        else:
+            stats['keys_per_sec'] = 0
+        self._debug('Listed {0} keys in {1:.2f} seconds, {2:.2f} keys/sec'
+                    .format(stats['keys'], stats['elapsed'], stats['keys_per_sec']))
+        if errors:
+            raise BucketListerException('{0}/{1} partitions failed to list, first error:"{2}"'
+                                        .format(len(errors), len(partitions), errors[0]))
+        return stats
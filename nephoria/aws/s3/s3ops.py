@@ -42,6 +42,7 @@ from boto.exception import S3ResponseError
 from boto.s3.deletemarker import DeleteMarker
 import boto.s3
 from nephoria.baseops.botobaseops import BotoBaseOps
+from nephoria.aws.s3.bucketlister import BucketLister
 
 
 class S3opsException(Exception):
@@ -71,6 +72,11 @@ class S3ops(BotoBaseOps):
         self.connection.calling_format = OrdinaryCallingFormat()
         super(S3ops, self).setup()
 
+    def boto2_connect(self, verbose=False, conn_kwargs=None):
+        connection = super(S3ops, self).boto2_connect(verbose=verbose, conn_kwargs=conn_kwargs)
+        connection.calling_format = OrdinaryCallingFormat()
+        return connection
+
     def setup_resource_trackers(self):
         """
         Setup keys in the test_resources hash in order to track artifacts created
@@ -233,6 +239,38 @@ class S3ops(BotoBaseOps):
             return keys[0]
         return keys
         
+    def list_objects_concurrently(self, buckets, callback, prefix='', delimiter='/', depth=1,
+                                  split_chars=None, max_workers=10,
+                                  page_size=BucketLister.MAX_PAGE_SIZE,
+                                  fallback_split_chars=BucketLister.DEFAULT_SPLIT_CHARS):
+        """
+        List the keys of one or more buckets by splitting the keyspace into partitions (by the
+        common prefixes under 'delimiter', or key ranges on 'split_chars') and listing the
+        partitions concurrently with max size pages. Keys are streamed to 'callback' instead of
+        being returned as a list. If the delimiter yields fewer partitions than max_workers they
+        are split into key ranges on 'fallback_split_chars'.
+        See nephoria.aws.s3.bucketlister.BucketLister.
+
+        buckets      bucket name, bucket object, or list of either
+        callback     method called with each boto Key found, called from multiple threads
+        Returns: dict of listing stats including 'keys' and 'keys_per_sec'
+        """
+        if not isinstance(buckets, (list, tuple)):
+            buckets = [buckets]
+        bucket_list = []
+        for bucket in buckets:
+            if not isinstance(bucket, Bucket):
+                name = bucket
+                bucket = self.get_bucket_by_name(name)
+                if not bucket:
+                    raise S3opsException("Could not find bucket " + str(name) + " to list")
+            bucket_list.append(bucket)
+        lister = BucketLister(bucket_list, prefix=prefix, delimiter=delimiter, depth=depth,
+                              split_chars=split_chars, max_workers=max_workers,
+                              page_size=page_size, fallback_split_chars=fallback_split_chars,
+                              log=self.log)
+        return lister.list(callback)
+
     def delete_object(self, object):
         bucket = object.bucket
         name = object.name
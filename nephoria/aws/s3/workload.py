@@ -0,0 +1,504 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009-2014, Eucalyptus Systems, Inc.
+# All rights reserved.
+#
+# Redistribution and use of this software in source and binary forms, with or
+# without modification, are permitted provided that the following conditions
+# are met:
+#
+#   Redistributions of source code must retain the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer.
+#
+#   Redistributions in binary form must reproduce the above
+#   copyright notice, this list of conditions and the
+#   following disclaimer in the documentation and/or other
+#   materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+'''
+Declarative S3 workloads.
+A WorkloadProfile describes the mix of operations, object sizes, key naming, bucket count,
+concurrency, duration and (optionally) the target rate of an S3 workload, and is usually
+loaded from a YAML file. S3WorkloadRunner executes any profile against an S3ops instance so
+the same access pattern can be replayed against different gateway builds.
+
+Sample profile:
+    name: small-get-heavy
+    description: 80% small GETs, 15% PUTs, 5% LISTs
+    buckets: 5
+    seed_objects: 1000      # objects per bucket created before the timed run
+    duration: 300           # seconds
+    rate: 200               # ops/sec, open-loop. Omit for closed-loop at 'concurrency'
+    arrival: poisson
+    concurrency: 50
+    operations:
+      get: 80
+      put: 15
+      list: 5
+    object_size:
+      distribution: choice
+      choices:
+        4KB: 90
+        1MB: 10
+    keys:
+      format: "obj/{seq:010d}"
+      distribution: hotspot
+      hot_fraction: 0.2
+      hot_ratio: 0.8
+
+Sample usage:
+    profile = WorkloadProfile.from_file('small_get_heavy.yaml')
+    runner = S3WorkloadRunner(tc.admin.s3, profile)
+    results = runner.run()
+    runner.show_results(results)
+'''
+
+from __future__ import division
+
+import itertools
+import math
+import os
+import random
+import re
+import threading
+import time
+import uuid
+import yaml
+from concurrent.futures.thread import ThreadPoolExecutor
+from prettytable import PrettyTable
+from nephoria.testcase_utils.loadgen import LatencyHistogram, OpenLoopScheduler, format_ms
+
+
+def parse_size(value):
+    """
+    Returns the number of bytes represented by an int or a string such as '4KB', '1.5MB', '2G'
+    """
+    if isinstance(value, (int, long, float)):
+        return int(value)
+    match = re.match('^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*$', str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError('Unable to parse object size:"{0}"'.format(value))
+    multipliers = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    return int(float(match.group(1)) * multipliers[match.group(2).upper()])
+
+
+class WorkloadProfile(object):
+    OPERATIONS = ['get', 'put', 'list', 'delete', 'head']
+    SIZE_DISTRIBUTIONS = ['fixed', 'uniform', 'lognormal', 'choice']
+    KEY_DISTRIBUTIONS = ['uniform', 'hotspot']
+    DEFAULTS = {'name': None,
+                'description': None,
+                'buckets': 1,
+                'bucket_prefix': 'nephoria-workload',
+                'seed_objects': 100,
+                'duration': 60,
+                'rate': None,
+                'arrival': OpenLoopScheduler.CONSTANT,
+                'concurrency': 10,
+                'operations': {'get': 1},
+                'object_size': {'distribution': 'fixed', 'size': 4096},
+                'keys': {'format': 'nephoria-obj-{seq:010d}', 'distribution': 'uniform',
+                         'hot_fraction': 0.2, 'hot_ratio': 0.8},
+                'list': {'max_keys': 1000, 'prefix': ''}}
+
+    def __init__(self, **kwargs):
+        for key, value in self.DEFAULTS.iteritems():
+            if isinstance(value, dict):
+                merged = dict(value)
+                merged.update(kwargs.pop(key, None) or {})
+                value = merged
+            else:
+                value = kwargs.pop(key, value)
+            setattr(self, key, value)
+        if kwargs:
+            raise ValueError('Unknown workload profile attributes:"{0}"'
+                             .format(", ".join(kwargs.keys())))
+        self.validate()
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as f:
+            values = yaml.safe_load(f) or {}
+        if not values.get('name'):
+            values['name'] = os.path.splitext(os.path.basename(path))[0]
+        return cls(**values)
+
+    def to_dict(self):
+        return dict((key, getattr(self, key)) for key in self.DEFAULTS.iterkeys())
+
+    def validate(self):
+        for op, weight in self.operations.iteritems():
+            if op not in self.OPERATIONS:
+                raise ValueError('Unknown operation:"{0}" in profile:"{1}", valid:"{2}"'
+                                 .format(op, self.name, ", ".join(self.OPERATIONS)))
+            if weight < 0:
+                raise ValueError('Operation:"{0}" weight must not be negative'.format(op))
+        if not sum(self.operations.values()):
+            raise ValueError('Profile:"{0}" operation weights sum to 0'.format(self.name))
+        dist = self.object_size.get('distribution')
+        if dist not in self.SIZE_DISTRIBUTIONS:
+            raise ValueError('Unknown object_size distribution:"{0}", valid:"{1}"'
+                             .format(dist, ", ".join(self.SIZE_DISTRIBUTIONS)))
+        if self.keys.get('distribution') not in self.KEY_DISTRIBUTIONS:
+            raise ValueError('Unknown keys distribution:"{0}", valid:"{1}"'
+                             .format(self.keys.get('distribution'),
+                                     ", ".join(self.KEY_DISTRIBUTIONS)))
+        if self.arrival not in OpenLoopScheduler.ARRIVALS:
+            raise ValueError('Unknown arrival:"{0}", valid:"{1}"'
+                             .format(self.arrival, ", ".join(OpenLoopScheduler.ARRIVALS)))
+        if self.buckets < 1 or self.concurrency < 1:
+            raise ValueError('Profile buckets and concurrency must be at least 1')
+        # Fail early on sizes which can not be parsed
+        self.max_object_size
+
+    @property
+    def max_object_size(self):
+        dist = self.object_size['distribution']
+        if dist == 'fixed':
+            return parse_size(self.object_size['size'])
+        if dist == 'uniform':
+            return parse_size(self.object_size['max'])
+        if dist == 'lognormal':
+            return parse_size(self.object_size.get('max', '64MB'))
+        return max(parse_size(size) for size in self.object_size['choices'].iterkeys())
+
+    def choose_object_size(self, rand=random):
+        dist = self.object_size['distribution']
+        if dist == 'fixed':
+            return parse_size(self.object_size['size'])
+        if dist == 'uniform':
+            return rand.randint(parse_size(self.object_size['min']),
+                                parse_size(self.object_size['max']))
+        if dist == 'lognormal':
+            # 'median' and 'sigma' of the underlying normal distribution, capped at 'max'
+            median = parse_size(self.object_size['median'])
+            size = int(rand.lognormvariate(math.log(max(median, 1)),
+                                           self.object_size.get('sigma', 1)))
+            return max(0, min(size, self.max_object_size))
+        return weighted_choice(dict((parse_size(k), v) for k, v in
+                                    self.object_size['choices'].iteritems()), rand=rand)
+
+    def choose_operation(self, rand=random):
+        return weighted_choice(self.operations, rand=rand)
+
+
+def weighted_choice(weights, rand=random):
+    """
+    Returns a key from the dict 'weights' chosen with probability proportional to its value
+    """
+    total = sum(weights.itervalues())
+    point = rand.uniform(0, total)
+    for key, weight in sorted(weights.iteritems()):
+        point -= weight
+        if point <= 0 and weight:
+            return key
+    return max(weights.iteritems(), key=lambda kv: kv[1])[0]
+
+
+class KeySpace(object):
+    """
+    Thread safe record of the keys which currently exist in a bucket for a running workload.
+    With the 'hotspot' distribution whether a key is hot is fixed when it is added, every
+    1/hot_fraction-th key added is hot, so deletes do not move other keys in or out of the
+    hot set.
+    """
+    def __init__(self, bucket, key_format, distribution='uniform', hot_fraction=0.2,
+                 hot_ratio=0.8):
+        self.bucket = bucket
+        self.key_format = key_format
+        self.distribution = distribution
+        self.hot_fraction = hot_fraction
+        self.hot_ratio = hot_ratio
+        self._keys = []
+        self._hot_keys = []
+        self._added = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys) + len(self._hot_keys)
+
+    def new_key_name(self):
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+        return self.key_format.format(seq=seq, uuid=uuid.uuid4().hex,
+                                      rand=random.getrandbits(32))
+
+    def add(self, key_name):
+        with self._lock:
+            index = self._added
+            self._added += 1
+            hot = (self.distribution == 'hotspot' and
+                   math.ceil((index + 1) * self.hot_fraction) >
+                   math.ceil(index * self.hot_fraction))
+            if hot:
+                self._hot_keys.append(key_name)
+            else:
+                self._keys.append(key_name)
+
+    def _get(self, index):
+        # Index over the hot keys followed by the other keys
+        if index < len(self._hot_keys):
+            return self._hot_keys, index
+        return self._keys, index - len(self._hot_keys)
+
+    def choose(self, rand=random):
+        with self._lock:
+            count = len(self._keys) + len(self._hot_keys)
+            if not count:
+                return None
+            if self._hot_keys and rand.random() < self.hot_ratio:
+                count = len(self._hot_keys)
+            keys, index = self._get(rand.randint(0, count - 1))
+            return keys[index]
+
+    def pop(self, rand=random):
+        with self._lock:
+            count = len(self._keys) + len(self._hot_keys)
+            if not count:
+                return None
+            keys, index = self._get(rand.randint(0, count - 1))
+            # swap with the last key of the same set so removal is O(1)
+            keys[index], keys[-1] = keys[-1], keys[index]
+            return keys.pop()
+
+
+class S3WorkloadRunner(object):
+
+    def __init__(self, s3ops, profile, log=None, seed=None):
+        """
+        :param s3ops: nephoria S3ops instance to run the workload with
+        :param profile: WorkloadProfile, or path to a profile YAML file
+        :param log: optional logger, defaults to s3ops.log
+        :param seed: optional seed so operation/size/key choices are repeatable. Each worker
+                     draws from its own generator seeded from (seed, worker id), see
+                     worker_random().
+        """
+        if not isinstance(profile, WorkloadProfile):
+            profile = WorkloadProfile.from_file(profile)
+        self.s3ops = s3ops
+        self.profile = profile
+        self.log = log or s3ops.log
+        self.seed = seed
+        self._local = threading.local()
+        self._thread_ids = itertools.count()
+        self.keyspaces = []
+        self.errors = {}
+        self._error_lock = threading.Lock()
+        self._data = os.urandom(profile.max_object_size)
+
+    def worker_random(self, worker_id):
+        """
+        Returns a random.Random for a worker. With a seed, a worker's choices depend only on
+        the seed and its worker_id, not on how the worker threads interleave.
+        """
+        if self.seed is None:
+            return random.Random()
+        return random.Random('{0}:{1}'.format(self.seed, worker_id))
+
+    @property
+    def random(self):
+        """
+        The calling thread's random.Random. Closed loop workers are numbered by their position
+        in the pool, other threads (setup, open loop) in the order they first use it.
+        """
+        rand = getattr(self._local, 'random', None)
+        if rand is None:
+            rand = self.worker_random('thread-{0}'.format(next(self._thread_ids)))
+            self._local.random = rand
+        return rand
+
+    def _record_error(self, op, error):
+        with self._error_lock:
+            self.errors[op] = self.errors.get(op, 0) + 1
+        self.log.debug('Workload "{0}" error:"{1}"'.format(op, error))
+
+    def _keyspace(self):
+        return self.keyspaces[self.random.randint(0, len(self.keyspaces) - 1)]
+
+    def do_put(self, keyspace=None):
+        keyspace = keyspace or self._keyspace()
+        key_name = keyspace.new_key_name()
+        size = self.profile.choose_object_size(rand=self.random)
+        keyspace.bucket.new_key(key_name).set_contents_from_string(self._data[:size])
+        keyspace.add(key_name)
+
+    def do_get(self):
+        keyspace = self._keyspace()
+        key_name = keyspace.choose(rand=self.random)
+        if key_name is None:
+            raise ValueError('No keys in bucket:{0} to GET'.format(keyspace.bucket.name))
+        keyspace.bucket.get_key(key_name, validate=False).get_contents_as_string()
+
+    def do_head(self):
+        keyspace = self._keyspace()
+        key_name = keyspace.choose(rand=self.random)
+        if key_name is None:
+            raise ValueError('No keys in bucket:{0} to HEAD'.format(keyspace.bucket.name))
+        keyspace.bucket.get_key(key_name)
+
+    def do_list(self):
+        keyspace = self._keyspace()
+        keyspace.bucket.get_all_keys(prefix=self.profile.list.get('prefix') or '',
+                                     max_keys=self.profile.list.get('max_keys', 1000))
+
+    def do_delete(self):
+        keyspace = self._keyspace()
+        key_name = keyspace.pop(rand=self.random)
+        if key_name is None:
+            raise ValueError('No keys in bucket:{0} to DELETE'.format(keyspace.bucket.name))
+        keyspace.bucket.delete_key(key_name)
+
+    def run_operation(self):
+        """
+        Chooses and runs a single operation from the profile's mix.
+        Returns the operation name, errors are recorded per operation rather than raised.
+        """
+        op = self.profile.choose_operation(rand=self.random)
+        try:
+            getattr(self, 'do_' + op)()
+        except Exception as E:
+            self._record_error(op, E)
+        return op
+
+    def setup(self):
+        """
+        Creates the profile's buckets and seeds each with 'seed_objects' objects
+        """
+        profile = self.profile
+        prefix = '{0}-{1}'.format(profile.bucket_prefix, int(time.time()))
+        self.keyspaces = []
+        for index in xrange(profile.buckets):
+            bucket = self.s3ops.create_bucket('{0}-{1}'.format(prefix, index))
+            self.keyspaces.append(KeySpace(bucket, profile.keys['format'],
+                                           distribution=profile.keys['distribution'],
+                                           hot_fraction=profile.keys.get('hot_fraction', 0.2),
+                                           hot_ratio=profile.keys.get('hot_ratio', 0.8)))
+        self.log.debug('Seeding {0} objects in each of {1} buckets'
+                       .format(profile.seed_objects, profile.buckets))
+        with ThreadPoolExecutor(max_workers=profile.concurrency) as executor:
+            futures = []
+            for keyspace in self.keyspaces:
+                for x in xrange(profile.seed_objects):
+                    futures.append(executor.submit(self.do_put, keyspace))
+            for future in futures:
+                future.result()
+
+    def _run_closed_loop(self):
+        histograms = {}
+        hist_lock = threading.Lock()
+        end = time.time() + self.profile.duration
+        counts = {'completed': 0}
+
+        def worker(worker_id):
+            self._local.random = self.worker_random(worker_id)
+            while time.time() < end:
+                start = time.time()
+                op = self.run_operation()
+                elapsed = time.time() - start
+                with hist_lock:
+                    if op not in histograms:
+                        histograms[op] = LatencyHistogram()
+                    counts['completed'] += 1
+                histograms[op].record(elapsed)
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.profile.concurrency) as executor:
+            for worker_id in xrange(self.profile.concurrency):
+                executor.submit(worker, worker_id)
+        elapsed = time.time() - start
+        return {'target_rate': None,
+                'elapsed': elapsed,
+                'completed': counts['completed'],
+                'throughput': counts['completed'] / elapsed if elapsed else 0,
+                'op_histograms': histograms}
+
+    def run(self, setup=True, cleanup=True):
+        """
+        Runs the profile's workload.
+        :param setup: create and seed the buckets first
+        :param cleanup: delete the keys and buckets when done
+        :returns dict with the profile, overall throughput and per operation latency
+                 histograms and error counts
+        """
+        profile = self.profile
+        if setup:
+            self.setup()
+        self.errors = {}
+        try:
+            self.log.debug('Running workload profile:"{0}" for {1} seconds, rate:{2}, '
+                           'concurrency:{3}'.format(profile.name, profile.duration,
+                                                    profile.rate or 'closed-loop',
+                                                    profile.concurrency))
+            if profile.rate:
+                scheduler = OpenLoopScheduler(rate=profile.rate, duration=profile.duration,
+                                              arrival=profile.arrival,
+                                              max_workers=profile.concurrency, log=self.log)
+                result = scheduler.run(self.run_operation)
+            else:
+                result = self._run_closed_loop()
+        finally:
+            if cleanup:
+                self.cleanup()
+        result['profile'] = profile.name
+        result['errors'] = dict(self.errors)
+        return result
+
+    def cleanup(self):
+        for keyspace in self.keyspaces:
+            bucket = keyspace.bucket
+            try:
+                with ThreadPoolExecutor(max_workers=self.profile.concurrency) as executor:
+                    self.s3ops.list_objects_concurrently(
+                        bucket, lambda key: executor.submit(key.delete))
+                self.s3ops.delete_bucket(bucket)
+            except Exception as E:
+                self.log.warning('Failed to clean up workload bucket:"{0}", err:"{1}"'
+                                 .format(bucket.name, E))
+
+    def results_to_dict(self, results):
+        """
+        Returns a serializable (json/yaml) form of the results returned by run()
+        """
+        ops = {}
+        for op, hist in results['op_histograms'].iteritems():
+            ops[op] = hist.summary()
+            ops[op]['errors'] = results['errors'].get(op, 0)
+        return {'profile': self.profile.to_dict(),
+                'target_rate': results.get('target_rate'),
+                'elapsed': results['elapsed'],
+                'completed': results['completed'],
+                'throughput': results['throughput'],
+                'operations': ops}
+
+    def show_results(self, results, printmethod=None, printme=True):
+        elapsed = results['elapsed']
+        pt = PrettyTable(['OP', 'COUNT', 'ERRORS', 'OPS/S', 'MEAN ms', 'P50 ms', 'P90 ms',
+                          'P99 ms', 'MAX ms'])
+        pt.align = 'r'
+        for op, hist in sorted(results['op_histograms'].iteritems()):
+            pt.add_row([op.upper(), hist.count, results['errors'].get(op, 0),
+                        '{0:.2f}'.format(hist.count / elapsed if elapsed else 0),
+                        format_ms(hist.mean), format_ms(hist.percentile(50)),
+                        format_ms(hist.percentile(90)), format_ms(hist.percentile(99)),
+                        format_ms(hist.max)])
+        if printme:
+            printmethod = printmethod or self.log.info
+            printmethod('\nWORKLOAD:"{0}" TARGET RATE:{1} ACHIEVED:{2:.2f} ops/s\n{3}\n'
+                        .format(self.profile.name, results.get('target_rate') or 'closed-loop',
+                                results['throughput'], pt))
+        return pt
@@ -253,6 +253,13 @@ class BotoBaseOps(BaseOps):
                 raise
         return self._b3_connection
 
+    def reset_connections(self):
+        """
+        Drop the current boto2 and boto3 connections so new ones are created on next use.
+        Used by forked load worker processes which must not share the parent's sockets.
+        """
+        self._b2_connection = None
+        self._b3_connection = None
 
     def enable_boto2_connection_debug(self, level=DEBUG, format_string=None):
         try:
@@ -30,27 +30,250 @@
 #
 # Author: vic.iglesias@eucalyptus.com
 
+import threading
 import time
+from contextlib import contextmanager
 from prettytable import PrettyTable
 from boto.ec2.tag import TagSet
 
 
+def _chunks(items, size):
+    for index in xrange(0, len(items), size):
+        yield items[index:index + size]
+
+
+def get_tags_for_resources(connection, resource_ids, max_resources_per_call=200):
+    """
+    Returns the current tags of the given resources as {resource_id: {key: value}}, using one
+    DescribeTags request filtered by resource id per 'max_resources_per_call' resources.
+    """
+    current = dict((res_id, {}) for res_id in resource_ids)
+    for ids in _chunks(list(resource_ids), max_resources_per_call):
+        for tag in connection.get_all_tags(filters={'resource-id': ids}):
+            current.setdefault(tag.res_id, {})[tag.name] = tag.value
+    return current
+
+
+def write_tags(connection, resource_tags, verify=True, timeout=120, poll_interval=2,
+               max_resources_per_call=200, log=None):
+    """
+    Writes tags to many resources with as few requests as possible.
+    Current tags are fetched first and tags whose value is unchanged are skipped. Resources
+    which need the same set of tags written share multi-resource CreateTags requests. When
+    'verify' is set the written tags are then polled for with one DescribeTags request
+    (filtered by the resource ids still pending) per cycle.
+
+    :param connection: boto ec2 connection
+    :param resource_tags: dict of {resource_id: {tag key: tag value}}
+    :param verify: boolean, wait for the written tags to be returned by DescribeTags
+    :param timeout: seconds to wait for the tags when verifying
+    :param poll_interval: seconds between verify cycles
+    :param max_resources_per_call: max resource ids per CreateTags/DescribeTags request
+    :param log: optional logger
+    :returns dict of stats; resources, written, skipped, create_calls, describe_calls, elapsed
+    """
+    start = time.time()
+    stats = {'resources': len(resource_tags), 'written': 0, 'skipped': 0, 'create_calls': 0,
+             'describe_calls': 0}
+    current = get_tags_for_resources(connection, resource_tags.keys(),
+                                     max_resources_per_call=max_resources_per_call)
+    stats['describe_calls'] += len(list(_chunks(resource_tags.keys(), max_resources_per_call)))
+    # Group resources by the exact set of tags which need writing
+    groups = {}
+    for res_id, tags in resource_tags.iteritems():
+        changed = {}
+        for key, value in tags.iteritems():
+            value = '' if value is None else str(value)
+            if current.get(res_id, {}).get(key) == value:
+                stats['skipped'] += 1
+            else:
+                changed[key] = value
+        if changed:
+            groups.setdefault(tuple(sorted(changed.items())), []).append(res_id)
+    pending = {}
+    for tag_items, res_ids in groups.iteritems():
+        for ids in _chunks(res_ids, max_resources_per_call):
+            connection.create_tags(ids, dict(tag_items))
+            stats['create_calls'] += 1
+            stats['written'] += len(ids) * len(tag_items)
+            for res_id in ids:
+                pending[res_id] = dict(tag_items)
+    if log:
+        log.debug('Wrote {0} tags to {1} resources with {2} CreateTags requests, skipped {3} '
+                  'unchanged tags'.format(stats['written'], len(pending), stats['create_calls'],
+                                          stats['skipped']))
+    while verify and pending:
+        applied = get_tags_for_resources(connection, pending.keys(),
+                                         max_resources_per_call=max_resources_per_call)
+        stats['describe_calls'] += len(list(_chunks(pending.keys(), max_resources_per_call)))
+        for res_id, tags in pending.items():
+            if all([applied.get(res_id, {}).get(k) == v for k, v in tags.iteritems()]):
+                pending.pop(res_id)
+        if pending:
+            if time.time() - start > timeout:
+                raise Exception('Tags not applied to {0}/{1} resources within {2} seconds: '
+                                '"{3}"'.format(len(pending), len(resource_tags), timeout,
+                                               ", ".join(sorted(pending.keys())[:20])))
+            time.sleep(poll_interval)
+    stats['elapsed'] = time.time() - start
+    return stats
+
+
+class TagBatch(object):
+    """
+    Coalesces the tag writes made by TaggedResource.create_tags() within a 'with' block into
+    batched multi-resource requests, see write_tags(). The writes are sent when the block exits,
+    also when it exits with an error. The batch is only active in the thread which entered it,
+    worker threads whose writes should be batched as well must join it, see joined().
+
+    with TagBatch(log=ec2ops.log) as batch:
+        for volume in volumes:
+            volume.create_tags({'md5': volume.md5})
+    """
+    _local = threading.local()
+
+    def __init__(self, verify=True, timeout=120, poll_interval=2, max_resources_per_call=200,
+                 log=None):
+        self.verify = verify
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.max_resources_per_call = max_resources_per_call
+        self.log = log
+        self.stats = []
+        self._pending = {}
+        self._resources = {}
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _active(cls):
+        # Stack of the batches active in the calling thread
+        active = getattr(cls._local, 'active', None)
+        if active is None:
+            active = cls._local.active = []
+        return active
+
+    @classmethod
+    def current(cls):
+        """
+        Returns the most recently entered TagBatch which is still active in the calling
+        thread, or None
+        """
+        active = cls._active()
+        if active:
+            return active[-1]
+        return None
+
+    @contextmanager
+    def joined(self):
+        """
+        Makes this batch active in the calling thread, ie a worker thread started within the
+        batch's 'with' block, without sending the writes when the block exits.
+
+        def worker(volume):
+            with batch.joined():
+                volume.create_tags({'md5': volume.md5})
+        """
+        active = TagBatch._active()
+        active.append(self)
+        try:
+            yield self
+        finally:
+            active.remove(self)
+
+    def __enter__(self):
+        TagBatch._active().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        active = TagBatch._active()
+        if self in active:
+            active.remove(self)
+        if exc_type is None:
+            self.flush()
+            return
+        # Still write what was queued before the error (ie md5s already computed), without
+        # hiding the original error
+        queued = self.queued
+        try:
+            self.flush()
+        except Exception as E:
+            if self.log:
+                self.log.error('Failed to write batched tags after error:"{0}". Err:"{1}", '
+                               'unwritten tags:{2}'.format(exc_val, E, queued))
+
+    @property
+    def queued(self):
+        """
+        Dict of the tags queued and not yet sent, {resource id: {tag key: tag value}}
+        """
+        with self._lock:
+            queued = {}
+            for resource_tags in self._pending.itervalues():
+                for res_id, tags in resource_tags.iteritems():
+                    queued.setdefault(res_id, {}).update(tags)
+            return queued
+
+    def add(self, resource, tags):
+        """
+        Queue tags to be written to a TaggedResource
+        """
+        with self._lock:
+            conn_key = id(resource.connection)
+            self._connections[conn_key] = resource.connection
+            self._pending.setdefault(conn_key, {}).setdefault(resource.id, {}).update(tags)
+            self._resources[resource.id] = resource
+
+    def flush(self):
+        """
+        Write all queued tags, one write_tags() call per connection.
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+        for conn_key, resource_tags in pending.iteritems():
+            self.stats.append(write_tags(self._connections[conn_key], resource_tags,
+                                         verify=self.verify, timeout=self.timeout,
+                                         poll_interval=self.poll_interval,
+                                         max_resources_per_call=self.max_resources_per_call,
+                                         log=self.log))
+            for res_id, tags in resource_tags.iteritems():
+                resource = self._resources.get(res_id)
+                if resource is not None and getattr(resource, 'tags', None) is not None:
+                    for key, value in tags.iteritems():
+                        resource.tags[key] = '' if value is None else str(value)
+        return self.stats
+
+
 class TaggedResource():
     def __init__(self):
         pass
 
     def create_tags(self, tags, timeout=600):
+        """
+        Writes tags to this resource. Tags whose value is unchanged are not re-written, and
+        when a TagBatch is active the write is queued to be sent with the batch.
+        """
+        current = getattr(self, 'tags', None) or {}
+        changed = dict((key, value) for key, value in tags.iteritems()
+                       if current.get(key) != ('' if value is None else str(value)))
+        if not changed:
+            self.log.debug("Tags unchanged, skipping write: " + str(tags))
+            return
+        batch = TagBatch.current()
+        if batch is not None:
+            batch.add(self, changed)
+            return
         self.log.debug("Current tags: " + str(self.tags))
-        self.connection.create_tags([self.id], tags)
-        self.wait_for_tags(tags, timeout=timeout)
+        self.connection.create_tags([self.id], changed)
+        self.wait_for_tags(changed, timeout=timeout)
 
-    def wait_for_tags(self, tags, creation=True, timeout=60):
+    def wait_for_tags(self, tags, creation=True, timeout=60, poll_interval=2):
         start = time.time()
         elapsed = 0
         while elapsed < timeout:
-            self.update()
             applied_tags = self.convert_tag_list_to_dict(
-                self.connection.get_all_tags(filters={u'resource_id': self.id}))
+                self.connection.get_all_tags(filters={'resource-id': self.id}))
             self.log.debug("Current tags: " + str(applied_tags))
             found_keys = 0
             for key, value in tags.iteritems():
@@ -60,16 +283,18 @@ class TaggedResource():
                         "Found key # " + str(found_keys) + " out of " + str(len(tags)) + ":" + key)
             if creation:
                 if found_keys == len(tags):
+                    self.update()
                     return True
                 else:
                     pass
             else:
                 if found_keys == 0:
+                    self.update()
                     return True
                 else:
                     pass
             elapsed = int(time.time() - start)
-            time.sleep(5)
+            time.sleep(poll_interval)
         raise Exception("Did not apply tags within " + str(timeout) + " seconds")
 
     def convert_tag_list_to_dict(self, list):
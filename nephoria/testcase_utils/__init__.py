@@ -44,6 +44,16 @@ class WaitForResultException(Exception):
         return repr(self.value)
 
 
+def sudo_sh_cmd(cmd, sudo='sudo'):
+    """
+    Returns 'cmd' wrapped to be run by 'sudo sh -c'. The command is passed as a single quoted
+    argument with any single quotes it contains escaped, so it may use any shell quoting.
+    :param cmd: shell command string
+    :param sudo: sudo command and its options, ie "sudo -S -p ''"
+    """
+    return "{0} sh -c '{1}'".format(sudo, str(cmd).replace("'", "'\"'\"'"))
+
+
 def wait_for_result(callback,
                     result,
                     timeout=60,
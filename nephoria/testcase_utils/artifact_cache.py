@@ -0,0 +1,372 @@
+"""
+Persistent, content addressed cache for large downloaded test artifacts such as image files.
+
+Image tests download the same multi-GB image urls on every run before bundling them or writing
+them into volumes. The ArtifactCache keeps each download on the machine doing the work (a
+remote worker Machine, or the local host when no machine is given), keyed by the url plus its
+validators; a checksum when the caller provides one, otherwise the ETag, or the
+Last-Modified time and Content-Length reported by the server. When the upstream file changes
+its validators change, so a new entry is downloaded and the stale one is eventually evicted.
+
+Each entry is a directory under the cache dir:
+    <cache_dir>/<key>/data       the artifact
+    <cache_dir>/<key>/data.part  partial download, resumed with a ranged request on retry
+    <cache_dir>/<key>/meta       url, validators, size and md5 of the completed download
+    <cache_dir>/<key>/used       touched on each use, entries are evicted least recently used
+                                 first when the cache grows past max_bytes
+
+Sample usage:
+    cache = ArtifactCache(machine=worker, cache_dir='/disk1/artifact_cache', max_gb=50)
+    path = cache.fetch('http://images.example.com/centos7.raw')  # downloads
+    path = cache.fetch('http://images.example.com/centos7.raw')  # cache hit, no download
+    cache.link_to('http://images.example.com/centos7.raw', '/disk1/work/centos7.raw')
+    cache.show()
+"""
+import hashlib
+import httplib
+import pipes
+import subprocess
+import threading
+import time
+import urlparse
+from prettytable import PrettyTable
+from cloud_utils.log_utils.eulogger import Eulogger
+
+
+GB = 1073741824
+
+DEFAULT_CACHE_DIR = '/var/tmp/nephoria_artifact_cache'
+
+
+class ArtifactCacheException(Exception):
+    pass
+
+
+def get_url_validators(url, maxredirect=5, timeout=60):
+    """
+    Issues a HEAD request for 'url', following redirects, and returns the headers used to
+    validate cached copies of it.
+    :param url: http or https url
+    :returns dict with keys 'url' (final url after redirects), 'etag', 'last_modified',
+             'length' (int or None) and 'accept_ranges'
+    """
+    for x in xrange(0, maxredirect + 1):
+        parsed = urlparse.urlparse(url)
+        if parsed.scheme == 'https':
+            conn = httplib.HTTPSConnection(parsed.netloc, timeout=timeout)
+        else:
+            conn = httplib.HTTPConnection(parsed.netloc, timeout=timeout)
+        try:
+            path = parsed.path or '/'
+            if parsed.query:
+                path += '?' + parsed.query
+            conn.request('HEAD', path)
+            res = conn.getresponse()
+            if res.status in [301, 302, 303, 307, 308] and res.getheader('location'):
+                url = urlparse.urljoin(url, res.getheader('location'))
+                continue
+            if res.status != 200:
+                raise ArtifactCacheException('HEAD request for url:"{0}" returned:{1} {2}'
+                                             .format(url, res.status, res.reason))
+            length = res.getheader('content-length')
+            return {'url': url,
+                    'etag': res.getheader('etag'),
+                    'last_modified': res.getheader('last-modified'),
+                    'length': int(length) if length is not None else None,
+                    'accept_ranges': res.getheader('accept-ranges')}
+        finally:
+            conn.close()
+    raise ArtifactCacheException('Too many redirects for url:"{0}"'.format(url))
+
+
+def artifact_key(url, validators=None, checksum=None):
+    """
+    Returns the cache key for 'url'. A checksum is preferred when given, followed by the
+    ETag, followed by the Last-Modified time and length. With none of these the key is derived
+    from the url alone and a cached copy is used until it is evicted.
+    """
+    validators = validators or {}
+    if checksum:
+        version = 'checksum:{0}'.format(checksum)
+    elif validators.get('etag'):
+        version = 'etag:{0}'.format(validators.get('etag'))
+    elif validators.get('last_modified') or validators.get('length') is not None:
+        version = 'modified:{0}:{1}'.format(validators.get('last_modified'),
+                                            validators.get('length'))
+    else:
+        version = 'unvalidated'
+    return hashlib.sha1('{0}\n{1}'.format(url, version)).hexdigest()
+
+
+class ArtifactCache(object):
+
+    def __init__(self, machine=None, cache_dir=None, max_gb=50, verify='size', retries=5,
+                 time_per_gig=300, log=None):
+        """
+        :param machine: Machine the artifacts are downloaded to and cached on. If None the
+                        cache is kept on the local host.
+        :param cache_dir: directory to keep the cache in, defaults to DEFAULT_CACHE_DIR
+        :param max_gb: size in GB the cache is trimmed to before each download
+        :param verify: how cached entries are checked before use, 'size' compares the stored
+                       size, 'md5' re-calculates the md5 of the entry.
+        :param retries: number of times an interrupted download is resumed
+        :param time_per_gig: timeout in seconds allowed per GB downloaded
+        """
+        if verify not in ['size', 'md5']:
+            raise ValueError('Unknown verify type:"{0}", must be "size" or "md5"'
+                             .format(verify))
+        self.machine = machine
+        self.cache_dir = (cache_dir or DEFAULT_CACHE_DIR).rstrip('/')
+        self.max_bytes = int(float(max_gb) * GB)
+        self.verify = verify
+        self.retries = retries
+        self.time_per_gig = time_per_gig
+        self.log = log or Eulogger('ArtifactCache')
+        self.stats = {'hits': 0, 'misses': 0, 'evicted': 0, 'bytes_downloaded': 0}
+        self._lock = threading.Lock()
+        # Per key locks, so only fetches of the same artifact wait on each other's download
+        self._key_locks = {}
+        self._downloading = set()
+
+    def __repr__(self):
+        return '{0}:{1}:{2}'.format(self.__class__.__name__,
+                                    getattr(self.machine, 'hostname', 'localhost'),
+                                    self.cache_dir)
+
+    def _run(self, cmd, timeout=120, code=0):
+        """
+        Runs 'cmd' on the cache machine, returns the output as a list of lines.
+        """
+        if self.machine:
+            return self.machine.sys(cmd, code=code, timeout=timeout, verbose=False)
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        out = proc.communicate()[0]
+        if code is not None and proc.returncode != code:
+            raise ArtifactCacheException('Command:"{0}" exited with:{1}, expected:{2}. '
+                                         'Output:"{3}"'.format(cmd, proc.returncode, code, out))
+        return out.splitlines()
+
+    def _entry_dir(self, key):
+        return '{0}/{1}'.format(self.cache_dir, key)
+
+    def _read_meta(self, key):
+        meta = {}
+        out = self._run('cat {0}/meta 2>/dev/null'.format(self._entry_dir(key)), code=None)
+        for line in out:
+            if '=' in line:
+                name, value = line.split('=', 1)
+                meta[name.strip()] = value.strip()
+        return meta
+
+    def _file_size(self, path):
+        out = self._run('stat -c %s {0} 2>/dev/null || echo -1'.format(path))
+        return int(out[-1].strip())
+
+    def _md5(self, path, size=None):
+        timeout = max(120, int((size or 0) / float(GB) * 60))
+        out = self._run('md5sum {0}'.format(path), timeout=timeout)
+        return out[-1].split()[0]
+
+    def lookup(self, url, validators=None, checksum=None, verify=None):
+        """
+        Returns the path of a valid cached copy of 'url' or None.
+        """
+        key = artifact_key(url, validators=validators, checksum=checksum)
+        entry = self._entry_dir(key)
+        meta = self._read_meta(key)
+        if not meta.get('size'):
+            return None
+        data = entry + '/data'
+        size = int(meta.get('size'))
+        if self._file_size(data) != size:
+            self.log.warning('Cached entry for url:"{0}" size does not match its meta data, '
+                             'removing it'.format(url))
+            self.remove(key)
+            return None
+        if (verify or self.verify) == 'md5' and self._md5(data, size) != meta.get('md5'):
+            self.log.warning('Cached entry for url:"{0}" md5 does not match its meta data, '
+                             'removing it'.format(url))
+            self.remove(key)
+            return None
+        self._run('touch {0}/used'.format(entry))
+        return data
+
+    def fetch(self, url, checksum=None, user=None, password=None, verify=None):
+        """
+        Returns the path of a cached copy of 'url' on the cache machine, downloading it only
+        when no valid cached copy exists.
+        :param url: url to download
+        :param checksum: optional expected md5 of the artifact. When given it is used as the
+                         cache key and the download is checked against it.
+        :param user: optional http user name
+        :param password: optional http password
+        :param verify: override the cache's verify type for this lookup
+        :returns path to the cached file
+        """
+        try:
+            validators = get_url_validators(url)
+        except Exception as E:
+            self.log.warning('Could not get validators for url:"{0}", err:"{1}"'.format(url, E))
+            validators = {}
+        key = artifact_key(url, validators=validators, checksum=checksum)
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            path = self.lookup(url, validators=validators, checksum=checksum, verify=verify)
+            with self._lock:
+                self.stats['hits' if path else 'misses'] += 1
+            if path:
+                self.log.debug('Artifact cache hit for url:"{0}" at:"{1}"'.format(url, path))
+                return path
+            with self._lock:
+                self._downloading.add(key)
+            try:
+                return self._download(url, validators, checksum=checksum, user=user,
+                                      password=password)
+            finally:
+                with self._lock:
+                    self._downloading.discard(key)
+
+    def _download(self, url, validators, checksum=None, user=None, password=None):
+        key = artifact_key(url, validators=validators, checksum=checksum)
+        entry = self._entry_dir(key)
+        part = entry + '/data.part'
+        length = validators.get('length')
+        with self._lock:
+            # Do not evict entries other threads are downloading into
+            keep = list(self._downloading.union([key]))
+        self.evict(needed_bytes=length or 0, keep=keep)
+        self._run('mkdir -p {0}'.format(entry))
+        if validators.get('accept_ranges') != 'bytes':
+            # The server may ignore ranged requests, start over rather than append
+            self._run('rm -f {0}'.format(part))
+        auth = ""
+        if user:
+            auth = '-u "{0}:{1}" '.format(user, password or "")
+        timeout = max(300, int((length or GB) / float(GB) * self.time_per_gig))
+        start_size = max(0, self._file_size(part))
+        size = start_size
+        start = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            if length is not None and size >= length:
+                break
+            self.log.debug('Downloading url:"{0}" to:"{1}", attempt:{2}/{3}, offset:{4}'
+                           .format(url, part, attempt, self.retries, max(0, size)))
+            out = self._run('curl -f -L -s -S -C - {0}-o {1} {2}; echo "exit=$?"'
+                            .format(auth, part, pipes.quote(url)), timeout=timeout)
+            size = self._file_size(part)
+            if out and out[-1].strip() == 'exit=0':
+                break
+            if attempt >= self.retries:
+                raise ArtifactCacheException('Failed to download url:"{0}" after {1} attempts. '
+                                             'Output:"{2}"'.format(url, attempt, "\n".join(out)))
+            time.sleep(2)
+        if length is not None and size != length:
+            self.remove(key)
+            raise ArtifactCacheException('Downloaded size:{0} of url:"{1}" does not match '
+                                         'content-length:{2}'.format(size, url, length))
+        md5 = self._md5(part, size)
+        if checksum and md5 != checksum:
+            self.remove(key)
+            raise ArtifactCacheException('Downloaded md5:{0} of url:"{1}" does not match '
+                                         'checksum:{2}'.format(md5, url, checksum))
+        meta = ['url={0}'.format(url), 'size={0}'.format(size), 'md5={0}'.format(md5),
+                'etag={0}'.format(validators.get('etag')),
+                'last_modified={0}'.format(validators.get('last_modified')),
+                'created={0}'.format(int(time.time()))]
+        self._run("mv -f {0} {1}/data && printf '%s\\n' {2} > {1}/meta && touch {1}/used"
+                  .format(part, entry, " ".join([pipes.quote(line) for line in meta])))
+        with self._lock:
+            self.stats['bytes_downloaded'] += size - start_size
+        self.log.debug('Cached url:"{0}", {1} bytes in {2:.2f} seconds'
+                       .format(url, size, time.time() - start))
+        return entry + '/data'
+
+    def link_to(self, url, dest, checksum=None, user=None, password=None):
+        """
+        Fetches 'url' into the cache and links (or copies when a link is not possible)
+        the cached file to 'dest' on the cache machine.
+        :returns dest
+        """
+        path = self.fetch(url, checksum=checksum, user=user, password=password)
+        self._run('ln -f {0} {1} 2>/dev/null || cp -f {0} {1}'.format(path, dest),
+                  timeout=max(300, int(self._file_size(path) / float(GB) * 60)))
+        return dest
+
+    def get_entries(self):
+        """
+        Returns a list of dicts for each entry in the cache, least recently used first.
+        Keys: 'key', 'used', 'bytes', 'complete', 'url'
+        """
+        cmd = ('cd {0} 2>/dev/null || exit 0; for d in *; do [ -d "$d" ] || continue; '
+               'u=$(stat -c %Y $d/used 2>/dev/null || stat -c %Y $d); '
+               's=$(du -sb $d | cut -f1); c=0; [ -f $d/data ] && c=1; '
+               'url=$(grep ^url= $d/meta 2>/dev/null | cut -d= -f2-); '
+               'echo "$d|$u|$s|$c|$url"; done'.format(self.cache_dir))
+        entries = []
+        for line in self._run(cmd):
+            fields = line.strip().split('|', 4)
+            if len(fields) != 5 or not fields[1].isdigit():
+                continue
+            entries.append({'key': fields[0], 'used': int(fields[1]), 'bytes': int(fields[2]),
+                            'complete': fields[3] == '1', 'url': fields[4]})
+        entries.sort(key=lambda e: e['used'])
+        return entries
+
+    def evict(self, needed_bytes=0, keep=None):
+        """
+        Removes the least recently used entries until the cache plus 'needed_bytes' fits
+        within max_bytes.
+        :param keep: list of keys not to be removed
+        :returns list of removed entry dicts
+        """
+        keep = keep or []
+        entries = self.get_entries()
+        total = sum([e['bytes'] for e in entries])
+        removed = []
+        for entry in entries:
+            if total + needed_bytes <= self.max_bytes:
+                break
+            if entry['key'] in keep:
+                continue
+            self.log.debug('Evicting cached artifact:"{0}", {1} bytes'
+                           .format(entry['url'] or entry['key'], entry['bytes']))
+            self.remove(entry['key'])
+            total -= entry['bytes']
+            removed.append(entry)
+        with self._lock:
+            self.stats['evicted'] += len(removed)
+        if total + needed_bytes > self.max_bytes:
+            self.log.warning('Artifact cache:"{0}" will exceed its max size:{1} bytes, '
+                             'needed:{2}, in use:{3}'.format(self.cache_dir, self.max_bytes,
+                                                             needed_bytes, total))
+        return removed
+
+    def remove(self, key):
+        if not key or '/' in key or key.startswith('.'):
+            raise ValueError('Invalid artifact cache key:"{0}"'.format(key))
+        self._run('rm -rf {0}'.format(self._entry_dir(key)))
+
+    def clear(self):
+        for entry in self.get_entries():
+            self.remove(entry['key'])
+
+    def show(self, printmethod=None, printme=True):
+        pt = PrettyTable(['KEY', 'URL', 'GB', 'COMPLETE', 'LAST USED'])
+        pt.align = 'l'
+        total = 0
+        for entry in self.get_entries():
+            total += entry['bytes']
+            pt.add_row([entry['key'][:12], entry['url'],
+                        "{0:.2f}".format(entry['bytes'] / float(GB)), entry['complete'],
+                        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['used']))])
+        buf = ("{0} ({1:.2f}/{2:.2f} GB) hits:{3} misses:{4} evicted:{5}\n{6}"
+               .format(self, total / float(GB), self.max_bytes / float(GB), self.stats['hits'],
+                       self.stats['misses'], self.stats['evicted'], pt))
+        if not printme:
+            return buf
+        printmethod = printmethod or self.log.info
+        printmethod("\n" + buf + "\n")
@@ -0,0 +1,537 @@
+"""
+Load generation helpers used by the nephoria load/performance test cases.
+
+The OSG load test historically ran 'closed-loop': each worker only fires its next request
+after the previous request completes, so when the service under test slows down the offered
+load drops with it and queueing latency is never measured (coordinated omission).
+The OpenLoopScheduler here issues operations on a fixed schedule derived from a target rate,
+independently of how long each operation takes, and measures latency from the time each
+operation was *intended* to start.
+
+Sample usage:
+    scheduler = OpenLoopScheduler(rate=200, duration=60, arrival='poisson', max_workers=50)
+    result = scheduler.run(get_some_object)
+    print result['histogram'].percentile(99)
+
+    # Step the rate up to find the saturation 'knee' of the service...
+    steps = scheduler.ramp(get_some_object, start_rate=100, step=100, steps=10)
+    print scheduler.show_ramp_results(steps, printme=False)
+
+A single python process is limited by the GIL long before most services saturate. The
+MultiProcessLoadDriver runs a worker method in N processes, each worker records its samples to
+a StatsReporter which streams them back to the parent over a queue, where they are merged into
+a single set of histograms and counters:
+
+    def worker(worker_id, reporter):
+        s3ops.reset_connections()   # each process uses its own connections
+        for x in xrange(1000):
+            start = time.time()
+            s3ops.connection.get_bucket(name).get_key('foo').get_contents_as_string()
+            reporter.record('GET', time.time() - start)
+
+    driver = MultiProcessLoadDriver(worker, processes=8, log=log)
+    collector = driver.run()
+    print collector.show(printme=False)
+"""
+from __future__ import division
+
+import math
+import random
+import threading
+import time
+from multiprocessing import Queue
+from Queue import Empty
+from concurrent.futures.thread import ThreadPoolExecutor
+from prettytable import PrettyTable
+from cloud_utils.log_utils.eulogger import Eulogger
+from nephoria.testcase_utils.process_manager import ProcessManager
+
+
+class LatencyHistogram(object):
+    """
+    Log bucketed latency histogram. Values are recorded in seconds and stored in buckets which
+    grow geometrically by 'growth', so the relative error of any reported percentile is bounded
+    by the growth factor while memory stays constant regardless of the number of samples.
+    Histograms with the same growth/min_value can be merged, ie across workers.
+    """
+
+    def __init__(self, growth=1.05, min_value=0.0001):
+        if growth <= 1:
+            raise ValueError('LatencyHistogram growth must be > 1, got:"{0}"'.format(growth))
+        self.growth = growth
+        self.min_value = min_value
+        self._log_growth = math.log(growth)
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def _bucket_index(self, value):
+        if value <= self.min_value:
+            return 0
+        return int(math.log(value / self.min_value) / self._log_growth) + 1
+
+    def _bucket_value(self, index):
+        # Upper bound of the bucket, so percentiles are never under reported
+        if index == 0:
+            return self.min_value
+        return self.min_value * (self.growth ** index)
+
+    def record(self, value):
+        """
+        Record a single latency sample (in seconds)
+        """
+        index = self._bucket_index(value)
+        with self._lock:
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+            self.count += 1
+            self.total += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+
+    def merge(self, other):
+        """
+        Merge the samples of another LatencyHistogram into this one.
+        :param other: LatencyHistogram with the same growth and min_value
+        """
+        if other.growth != self.growth or other.min_value != self.min_value:
+            raise ValueError('Can not merge histograms with different bucket layouts')
+        with self._lock:
+            for index, count in other.buckets.iteritems():
+                self.buckets[index] = self.buckets.get(index, 0) + count
+            self.count += other.count
+            self.total += other.total
+            if other.min is not None and (self.min is None or other.min < self.min):
+                self.min = other.min
+            if other.max is not None and (self.max is None or other.max > self.max):
+                self.max = other.max
+        return self
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def percentile(self, percent):
+        """
+        Returns the latency (in seconds) at or below which 'percent' of the samples fall.
+        :param percent: float or int between 0 and 100
+        """
+        if not self.count:
+            return None
+        target = max(1, int(math.ceil(self.count * (percent / 100.0))))
+        seen = 0
+        with self._lock:
+            for index in sorted(self.buckets.keys()):
+                seen += self.buckets[index]
+                if seen >= target:
+                    return min(self._bucket_value(index), self.max)
+        return self.max
+
+    def summary(self, percentiles=(50, 90, 99, 99.9)):
+        """
+        Returns a dict summarizing this histogram's samples
+        """
+        ret = {'count': self.count, 'min': self.min, 'max': self.max, 'mean': self.mean}
+        for p in percentiles:
+            ret['p{0}'.format(p)] = self.percentile(p)
+        return ret
+
+    def to_dict(self):
+        return {'growth': self.growth, 'min_value': self.min_value,
+                'buckets': dict(self.buckets), 'count': self.count, 'total': self.total,
+                'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, values):
+        hist = cls(growth=values['growth'], min_value=values['min_value'])
+        hist.buckets = dict((int(k), v) for k, v in values['buckets'].iteritems())
+        hist.count = values['count']
+        hist.total = values['total']
+        hist.min = values['min']
+        hist.max = values['max']
+        return hist
+
+
+def format_ms(value):
+    """
+    Returns a latency in seconds formatted in milliseconds, or '-' if there is no value
+    """
+    if value is None:
+        return '-'
+    return '{0:.2f}'.format(value * 1000)
+
+
+def latency_table(histograms, name_header='COMMAND'):
+    """
+    Returns a PrettyTable with the count, mean, p50, p99 and max latency (ms) of each
+    (name, LatencyHistogram) tuple in 'histograms', one row per tuple in the order given.
+    """
+    pt = PrettyTable([name_header, 'COUNT', 'MEAN ms', 'P50 ms', 'P99 ms', 'MAX ms'])
+    pt.align = 'l'
+    for name, hist in histograms:
+        pt.add_row([name, hist.count, format_ms(hist.mean), format_ms(hist.percentile(50)),
+                    format_ms(hist.percentile(99)), format_ms(hist.max)])
+    return pt
+
+
+class OpenLoopScheduler(object):
+    """
+    Issues operations at a target rate (ops/sec) regardless of how long the previous
+    operations take. Operations are dispatched to a thread pool at their intended start times;
+    when the service falls behind, the pending operations queue up and that queueing delay
+    is included in the recorded latency since latency is measured from the intended start time
+    rather than from the time a worker actually began the request.
+    """
+    CONSTANT = 'constant'
+    POISSON = 'poisson'
+    ARRIVALS = [CONSTANT, POISSON]
+
+    def __init__(self, rate, duration=60, arrival=CONSTANT, max_workers=10, log=None,
+                 seed=None):
+        """
+        :param rate: target rate in operations per second
+        :param duration: number of seconds to issue operations for
+        :param arrival: arrival distribution, 'constant' or 'poisson'
+        :param max_workers: max number of operations which can be in flight at once
+        :param log: optional logger, ie a CliTestRunner's log
+        :param seed: optional seed for the poisson arrival generator
+        """
+        if arrival not in self.ARRIVALS:
+            raise ValueError('Unknown arrival distribution:"{0}", valid:"{1}"'
+                             .format(arrival, ", ".join(self.ARRIVALS)))
+        self.rate = rate
+        self.duration = duration
+        self.arrival = arrival
+        self.max_workers = max_workers
+        self.log = log or Eulogger('OpenLoopScheduler')
+        self._random = random.Random(seed)
+
+    def _debug(self, msg):
+        self.log.debug(msg)
+
+    def intended_offsets(self, rate, duration):
+        """
+        Generator of the intended start offsets (seconds from the start of the run) for each
+        operation at the given rate.
+        """
+        if rate <= 0:
+            raise ValueError('Rate must be greater than 0, got:"{0}"'.format(rate))
+        offset = 0.0
+        index = 0
+        while True:
+            if self.arrival == self.POISSON:
+                offset += self._random.expovariate(rate)
+            else:
+                offset = index / rate
+            if offset >= duration:
+                return
+            index += 1
+            yield offset
+
+    def run(self, operation, rate=None, duration=None):
+        """
+        Runs 'operation' on an open-loop schedule.
+        :param operation: callable taking no arguments (see functools.partial), exceptions
+                          raised by the callable are counted as errors. If the callable
+                          returns a label (ie the name of the operation type it ran), latency
+                          is also recorded per label in the result's 'op_histograms'.
+        :param rate: optional rate to use instead of self.rate
+        :param duration: optional duration to use instead of self.duration
+        :returns dict with the target rate, achieved throughput, error count, the latency
+                 histogram (measured from intended start), and the service time histogram
+                 (measured from actual start)
+        """
+        rate = rate or self.rate
+        duration = duration or self.duration
+        latency = LatencyHistogram()
+        service_time = LatencyHistogram()
+        op_histograms = {}
+        counters = {'issued': 0, 'completed': 0, 'errors': 0, 'late': 0}
+        counter_lock = threading.Lock()
+        # A dispatch is considered 'late' if a worker was not free within this many seconds
+        # of its intended start, useful to tell when max_workers rather than the service is
+        # the bottleneck.
+        late_threshold = max(0.001, 1.0 / rate)
+
+        def timed_operation(intended):
+            actual = time.time()
+            error = False
+            label = None
+            try:
+                label = operation()
+            except Exception as E:
+                error = True
+                self._debug('Open loop operation error:"{0}"'.format(E))
+            end = time.time()
+            latency.record(end - intended)
+            service_time.record(end - actual)
+            with counter_lock:
+                if label is not None:
+                    if label not in op_histograms:
+                        op_histograms[label] = LatencyHistogram()
+                    op_histograms[label].record(end - intended)
+                counters['completed'] += 1
+                if error:
+                    counters['errors'] += 1
+                if actual - intended > late_threshold:
+                    counters['late'] += 1
+
+        self._debug('Starting open loop run, rate:{0}/sec, duration:{1}s, arrival:{2}'
+                    .format(rate, duration, self.arrival))
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for offset in self.intended_offsets(rate, duration):
+                intended = start + offset
+                delay = intended - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(timed_operation, intended)
+                counters['issued'] += 1
+        elapsed = time.time() - start
+        result = {'target_rate': rate,
+                  'duration': duration,
+                  'elapsed': elapsed,
+                  'throughput': counters['completed'] / elapsed if elapsed else 0,
+                  'histogram': latency,
+                  'service_histogram': service_time,
+                  'op_histograms': op_histograms}
+        result.update(counters)
+        self._debug('Open loop run done, target:{0}/sec achieved:{1:.2f}/sec errors:{2}'
+                    .format(rate, result['throughput'], counters['errors']))
+        return result
+
+    def ramp(self, operation, start_rate, step, steps, step_duration=None,
+             knee_throughput_ratio=0.9, knee_latency_factor=3.0, stop_at_knee=False):
+        """
+        Runs the operation at increasing rates in order to find the saturation 'knee' of the
+        service under test. The knee is the first step where the achieved throughput falls
+        below 'knee_throughput_ratio' of the target rate, or the p99 latency grows more than
+        'knee_latency_factor' times the p99 of the first step.
+
+        :param start_rate: rate (ops/sec) of the first step
+        :param step: ops/sec to add per step
+        :param steps: number of steps to run
+        :param step_duration: seconds to run each step, defaults to self.duration
+        :param stop_at_knee: if True, stop ramping once a knee has been detected
+        :returns list of per step result dicts (see run()), the knee step has 'knee' set True
+        """
+        results = []
+        base_p99 = None
+        knee_found = False
+        for index in xrange(steps):
+            rate = start_rate + (step * index)
+            result = self.run(operation, rate=rate, duration=step_duration)
+            p99 = result['histogram'].percentile(99)
+            if base_p99 is None:
+                base_p99 = p99
+            result['knee'] = False
+            if not knee_found:
+                if result['throughput'] < (rate * knee_throughput_ratio) or \
+                        (base_p99 and p99 and p99 > base_p99 * knee_latency_factor):
+                    knee_found = True
+                    result['knee'] = True
+                    self._debug('Saturation knee detected at target rate:{0}/sec'.format(rate))
+            results.append(result)
+            if knee_found and stop_at_knee:
+                break
+        return results
+
+    def show_ramp_results(self, results, printmethod=None, printme=True):
+        """
+        Creates a table summarizing a list of open loop run results.
+        """
+        pt = PrettyTable(['TARGET/S', 'ACHIEVED/S', 'ISSUED', 'ERRORS', 'LATE', 'P50 ms',
+                          'P90 ms', 'P99 ms', 'MAX ms', 'SVC P99 ms', 'KNEE'])
+        pt.align = 'r'
+        for result in results:
+            hist = result['histogram']
+            pt.add_row([result['target_rate'], '{0:.2f}'.format(result['throughput']),
+                        result['issued'], result['errors'], result['late'],
+                        format_ms(hist.percentile(50)), format_ms(hist.percentile(90)),
+                        format_ms(hist.percentile(99)), format_ms(hist.max),
+                        format_ms(result['service_histogram'].percentile(99)),
+                        '<--' if result.get('knee') else ''])
+        if printme:
+            printmethod = printmethod or self.log.info
+            printmethod('\n{0}\n'.format(pt))
+        return pt
+
+
+class StatsReporter(object):
+    """
+    Records per operation latency samples and counters within a worker process and
+    periodically sends them (as deltas) to the parent process over a multiprocessing queue.
+    """
+
+    def __init__(self, queue, worker_id, interval=2):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.interval = interval
+        self._histograms = {}
+        self._counters = {}
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+
+    def record(self, op, latency, error=False):
+        """
+        Record a single operation's latency (in seconds) and whether it failed.
+        Safe to call from multiple threads within the worker process.
+        """
+        with self._lock:
+            if op not in self._histograms:
+                self._histograms[op] = LatencyHistogram()
+                self._counters[op] = {'count': 0, 'errors': 0}
+            self._counters[op]['count'] += 1
+            if error:
+                self._counters[op]['errors'] += 1
+            self._histograms[op].record(latency)
+        if time.time() - self._last_flush >= self.interval:
+            self.flush()
+
+    def flush(self, done=False):
+        with self._lock:
+            histograms = self._histograms
+            counters = self._counters
+            self._histograms = {}
+            self._counters = {}
+            self._last_flush = time.time()
+        if histograms or done:
+            self.queue.put({'worker': self.worker_id,
+                            'done': done,
+                            'histograms': dict((op, hist.to_dict()) for op, hist in
+                                               histograms.iteritems()),
+                            'counters': counters})
+
+    def close(self):
+        self.flush(done=True)
+
+
+class StatsCollector(object):
+    """
+    Merges the StatsReporter messages from many worker processes into one set of per
+    operation histograms and counters.
+    """
+
+    def __init__(self, log=None):
+        self.log = log or Eulogger('StatsCollector')
+        self.histograms = {}
+        self.counters = {}
+        self.workers_done = set()
+        self.start = time.time()
+        self.elapsed = None
+
+    def merge(self, message):
+        for op, values in message['histograms'].iteritems():
+            hist = LatencyHistogram.from_dict(values)
+            if op in self.histograms:
+                self.histograms[op].merge(hist)
+            else:
+                self.histograms[op] = hist
+        for op, values in message['counters'].iteritems():
+            counters = self.counters.setdefault(op, {'count': 0, 'errors': 0})
+            for key, value in values.iteritems():
+                counters[key] = counters.get(key, 0) + value
+        if message.get('done'):
+            self.workers_done.add(message['worker'])
+
+    @property
+    def total_count(self):
+        return sum(c['count'] for c in self.counters.itervalues())
+
+    @property
+    def total_errors(self):
+        return sum(c['errors'] for c in self.counters.itervalues())
+
+    def show(self, printmethod=None, printme=True):
+        elapsed = self.elapsed or (time.time() - self.start)
+        pt = PrettyTable(['OP', 'COUNT', 'ERRORS', 'OPS/S', 'MEAN ms', 'P50 ms', 'P90 ms',
+                          'P99 ms', 'MAX ms'])
+        pt.align = 'r'
+        for op, hist in sorted(self.histograms.iteritems()):
+            counters = self.counters.get(op, {})
+            pt.add_row([op, counters.get('count', hist.count), counters.get('errors', 0),
+                        '{0:.2f}'.format(hist.count / elapsed if elapsed else 0),
+                        format_ms(hist.mean), format_ms(hist.percentile(50)),
+                        format_ms(hist.percentile(90)), format_ms(hist.percentile(99)),
+                        format_ms(hist.max)])
+        if printme:
+            printmethod = printmethod or self.log.info
+            printmethod('\n{0}\n'.format(pt))
+        return pt
+
+
+class MultiProcessLoadDriver(object):
+    """
+    Runs a load generating worker method across N processes using the ProcessManager.
+    The worker is called as worker(worker_id, reporter), where reporter is a StatsReporter.
+    Workers are forked, so they inherit the parent's objects, but should create their own
+    connections (ie ops.reset_connections()) rather than share the parent's sockets.
+    """
+
+    def __init__(self, worker, processes=2, log=None, report_interval=2, progress_interval=10):
+        self.worker = worker
+        self.processes = processes
+        self.log = log or Eulogger('MultiProcessLoadDriver')
+        self.report_interval = report_interval
+        self.progress_interval = progress_interval
+        self.process_manager = ProcessManager()
+
+    def _debug(self, msg):
+        self.log.debug(msg)
+
+    def _worker_main(self, worker_id, stats_queue):
+        reporter = StatsReporter(stats_queue, worker_id, interval=self.report_interval)
+        try:
+            return self.worker(worker_id, reporter)
+        finally:
+            reporter.close()
+
+    def run(self):
+        """
+        Starts the worker processes and merges their stats until all have finished.
+        :returns StatsCollector with the merged histograms and counters. Exceptions raised
+                 by workers are available in the collector's 'worker_errors' list.
+        """
+        stats_queue = Queue()
+        collector = StatsCollector(log=self.log)
+        collector.worker_errors = []
+        ids = []
+        for worker_id in xrange(self.processes):
+            ids.append(self.process_manager.run_method_as_process(self._worker_main,
+                                                                  worker_id=worker_id,
+                                                                  stats_queue=stats_queue))
+        self._debug('Started {0} load worker processes'.format(len(ids)))
+        last_progress = time.time()
+        # The stats queue must be drained while the workers run or they will block on put()
+        while len(collector.workers_done) < len(ids):
+            try:
+                collector.merge(stats_queue.get(timeout=1))
+            except Empty:
+                alive = [pid for pid in ids if
+                         self.process_manager.lookup_process(pid).is_alive()]
+                if not alive:
+                    # Workers which died without reporting 'done'
+                    break
+            if time.time() - last_progress >= self.progress_interval:
+                last_progress = time.time()
+                self._debug('Load progress: {0} ops, {1} errors, {2}/{3} workers done'
+                            .format(collector.total_count, collector.total_errors,
+                                    len(collector.workers_done), len(ids)))
+        while True:
+            try:
+                collector.merge(stats_queue.get_nowait())
+            except Empty:
+                break
+        for pid in ids:
+            result = self.process_manager.wait_for_process(pid)
+            if isinstance(result, Exception):
+                collector.worker_errors.append(result)
+                self._debug('Load worker process error:"{0}"'.format(result))
+        collector.elapsed = time.time() - collector.start
+        return collector
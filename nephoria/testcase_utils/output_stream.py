@@ -0,0 +1,197 @@
+"""
+Line by line streaming of a remote command's output with bounded memory.
+
+Rather than collecting all of a command's output into a list before returning, an
+OutputStream yields each line as it arrives from the remote side so the caller can react
+before the command finishes. Only the last 'tail_lines' lines are kept (for error messages and
+the 'output' attribute), a single line longer than 'max_line_length' is truncated rather than
+buffered, and iteration can stop early, closing the command, once a line matches 'match'.
+Memory use is then constant no matter how much output the command produces.
+
+The source of the output is a 'read' callable, ie reading an ssh channel or polling a winrm
+command, called like read(wait) and returning a tuple (data, done, status):
+    data - string of output received, or '' if none arrived within 'wait' seconds
+    done - boolean, True once the command has finished and all its output was read
+    status - the command's exit status once done, else None
+
+Sample usage:
+    stream = instance.stream('cat /var/log/messages', match='Call Trace')
+    for line in stream:
+        ...
+    if stream.match:
+        raise RuntimeError('Found kernel trace:{0}'.format(stream.matched_line))
+"""
+import re
+import time
+from collections import deque
+from cloud_utils.net_utils.sshconnection import CommandExitCodeException, \
+    CommandTimeoutException
+
+
+class OutputStream(object):
+
+    def __init__(self, read, close=None, cmd=None, timeout=None, code=None, match=None,
+                 stop_on_match=True, max_line_length=65536, tail_lines=100, poll_interval=1,
+                 log=None):
+        """
+        :param read: callable returning output of the command, see module docstring
+        :param close: optional callable to release the command's resources, called once
+                      iteration ends, fails or stops early
+        :param cmd: the command string, used in logs and error messages
+        :param timeout: seconds to wait for the command to finish before raising a
+                        CommandTimeoutException, None to wait forever
+        :param code: expected exit status, a CommandExitCodeException is raised at the end
+                     of iteration if it differs. Not checked if iteration stopped on a match.
+        :param match: regex string or compiled pattern to search each line for
+        :param stop_on_match: boolean, stop iterating and close the command on the first match
+        :param max_line_length: max number of characters kept of a single line
+        :param tail_lines: number of the most recent lines kept in 'output'
+        :param poll_interval: max seconds each read waits for output
+        """
+        self._read = read
+        self._close = close
+        self.cmd = cmd
+        self.timeout = timeout
+        self.code = code
+        if isinstance(match, basestring):
+            match = re.compile(match)
+        self.pattern = match
+        self.stop_on_match = stop_on_match
+        self.max_line_length = max_line_length
+        self.poll_interval = poll_interval
+        self.log = log
+        self.tail = deque(maxlen=tail_lines)
+        self.status = None
+        self.match = None
+        self.matched_line = None
+        self.line_count = 0
+        self.byte_count = 0
+        self.truncated_lines = 0
+        self.stopped = False
+        self.timed_out = False
+        self.elapsed = None
+        self._started = False
+        self._closed = False
+        self._partial = []
+        self._partial_len = 0
+        self._discarding = False
+
+    def __repr__(self):
+        return '{0}:"{1}"'.format(self.__class__.__name__, self.cmd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def output(self):
+        """
+        List of the most recent lines seen, at most 'tail_lines' long
+        """
+        return list(self.tail)
+
+    @property
+    def done(self):
+        return self._closed
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._close:
+            try:
+                self._close()
+            except Exception as E:
+                if self.log:
+                    self.log.debug('Error closing stream for cmd:"{0}", err:"{1}"'
+                                   .format(self.cmd, E))
+
+    def _split(self, data):
+        """
+        Returns the complete lines in 'data', keeping any trailing partial line for the next
+        read. A partial line is only buffered up to max_line_length characters.
+        """
+        lines = []
+        parts = data.split('\n')
+        for index, part in enumerate(parts):
+            last = index == len(parts) - 1
+            if not self._discarding:
+                room = self.max_line_length - self._partial_len
+                if len(part) > room:
+                    part = part[:room]
+                    self._discarding = True
+                    self.truncated_lines += 1
+                if part:
+                    self._partial.append(part)
+                    self._partial_len += len(part)
+            if not last:
+                lines.append(self._pop_partial())
+        return lines
+
+    def _pop_partial(self):
+        line = "".join(self._partial).rstrip('\r')
+        self._partial = []
+        self._partial_len = 0
+        self._discarding = False
+        return line
+
+    def _add_line(self, line):
+        self.line_count += 1
+        self.tail.append(line)
+        if self.pattern is not None and self.match is None:
+            match = self.pattern.search(line)
+            if match:
+                self.match = match
+                self.matched_line = line
+
+    def __iter__(self):
+        if self._started:
+            raise RuntimeError('{0} has already been iterated'.format(self))
+        self._started = True
+        start = time.time()
+        try:
+            while True:
+                wait = self.poll_interval
+                if self.timeout is not None:
+                    remaining = start + self.timeout - time.time()
+                    if remaining <= 0:
+                        self.timed_out = True
+                        raise CommandTimeoutException(
+                            'Cmd:"{0}" timed out after {1} seconds, last output:\n{2}'
+                            .format(self.cmd, self.timeout, "\n".join(self.tail)))
+                    wait = min(wait, remaining)
+                data, done, status = self._read(wait)
+                lines = []
+                if data:
+                    self.byte_count += len(data)
+                    lines = self._split(data)
+                if done and (self._partial or self._discarding):
+                    lines.append(self._pop_partial())
+                for line in lines:
+                    self._add_line(line)
+                    yield line
+                    if self.match is not None and self.stop_on_match:
+                        self.stopped = True
+                        return
+                if done:
+                    self.status = status
+                    break
+        finally:
+            self.elapsed = time.time() - start
+            self.close()
+        if self.code is not None and self.status != self.code:
+            raise CommandExitCodeException('Cmd:"{0}" failed with status code:{1}, '
+                                           'last output:\n{2}'
+                                           .format(self.cmd, self.status, "\n".join(self.tail)))
+
+    def wait(self):
+        """
+        Consumes the remaining output, returns the exit status of the command.
+        Status is None if the stream stopped early on a match.
+        """
+        if not self._started:
+            for _ in self:
+                pass
+        return self.status
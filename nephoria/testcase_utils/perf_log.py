@@ -0,0 +1,175 @@
+"""
+Buffered, asynchronous performance event log.
+
+Writing a line to a file for every operation in a load test means an open/write/close syscall
+sequence per request plus lock contention between the threads doing the writing. PerfEventLog
+instead appends each event to an in memory queue and a background thread writes the queued
+events to the file in batches, so the cost of recording an event on the hot path is a single
+deque append.
+
+Events are written as JSON lines. The first line is a header holding the wall clock time the
+log was started, each event holds 't', a monotonic timestamp in seconds relative to the start
+of the log (immune to wall clock adjustments during long runs), the operation name 'op',
+the latency 'lat' in seconds, and any extra fields provided.
+
+Sample usage:
+    perf_log = PerfEventLog('osg_perf.jsonl')
+    perf_log.record('PUT', 0.0132, bucket='bucket-1')
+    perf_log.close()   # flushes any queued events, also done at interpreter exit
+
+    for event in PerfEventLog.read('osg_perf.jsonl'):
+        print event['op'], event['lat']
+"""
+import atexit
+import ctypes
+import ctypes.util
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+def _get_monotonic():
+    """
+    Returns a monotonic clock function. Python 2 does not provide time.monotonic(), so fall back
+    to clock_gettime(CLOCK_MONOTONIC) via ctypes where available, otherwise time.time().
+    """
+    monotonic = getattr(time, 'monotonic', None)
+    if monotonic:
+        return monotonic
+    try:
+        CLOCK_MONOTONIC = 1
+
+        class timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        librt = ctypes.CDLL(ctypes.util.find_library('rt') or 'librt.so.1', use_errno=True)
+        clock_gettime = librt.clock_gettime
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+        def monotonic():
+            ts = timespec()
+            if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(ts)) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+        monotonic()
+        return monotonic
+    except Exception:
+        return time.time
+
+monotonic = _get_monotonic()
+
+
+class PerfEventLog(object):
+
+    def __init__(self, path, flush_interval=1.0, batch_size=5000, mode='w'):
+        """
+        :param path: file path to write events to
+        :param flush_interval: max seconds an event waits in memory before being written
+        :param batch_size: max number of events written per write call
+        :param mode: 'w' to truncate an existing file, 'a' to append to it
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.events_written = 0
+        self._queue = deque()
+        self._start = monotonic()
+        self._closed = False
+        self._wakeup = threading.Event()
+        # flush() requests are numbered, the writer acknowledges each once its file is flushed
+        self._flush_cond = threading.Condition()
+        self._flush_requested = 0
+        self._flush_done = 0
+        self._file = open(path, mode)
+        self._file.write(json.dumps({'type': 'header', 'wall_start': time.time(),
+                                     'pid': os.getpid()}) + '\n')
+        self._writer = threading.Thread(target=self._writer_loop,
+                                        name='PerfEventLog:{0}'.format(path))
+        self._writer.daemon = True
+        self._writer.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, op, latency, **fields):
+        """
+        Queue a single event. This does not block on file i/o.
+        :param op: operation name, ie 'PUT'
+        :param latency: operation latency in seconds
+        :param fields: optional extra json serializable values to store with the event
+        """
+        event = {'t': round(monotonic() - self._start, 6), 'op': op, 'lat': latency}
+        if fields:
+            event.update(fields)
+        self._queue.append(event)
+
+    def _write_batch(self):
+        queue = self._queue
+        lines = []
+        while queue and len(lines) < self.batch_size:
+            lines.append(json.dumps(queue.popleft(), separators=(',', ':')))
+        if lines:
+            self._file.write('\n'.join(lines) + '\n')
+            self.events_written += len(lines)
+        return len(lines)
+
+    def _writer_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            with self._flush_cond:
+                requested = self._flush_requested
+            while self._write_batch():
+                pass
+            self._file.flush()
+            with self._flush_cond:
+                self._flush_done = requested
+                self._flush_cond.notify_all()
+
+    def flush(self):
+        """
+        Wake the writer thread to write out any queued events now. Returns once every event
+        recorded before the call has been written and the file flushed.
+        """
+        with self._flush_cond:
+            self._flush_requested += 1
+            request = self._flush_requested
+        self._wakeup.set()
+        with self._flush_cond:
+            while self._flush_done < request and self._writer.is_alive():
+                self._flush_cond.wait(0.1)
+
+    def close(self):
+        """
+        Stop the writer thread, write any remaining events and close the file.
+        Safe to call more than once.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join()
+        while self._write_batch():
+            pass
+        self._file.close()
+
+    @staticmethod
+    def read(path):
+        """
+        Generator of the events (dicts) in a perf event log file, the header is skipped.
+        """
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event.get('type') == 'header':
+                    continue
+                yield event
@@ -0,0 +1,161 @@
+"""
+Per phase timing of resource lifecycles, ie snapshot -> volume -> attach -> md5 chains.
+
+Resources mixing in PhaseTimedResource (EuVolume, EuSnapshot) record the time they first enter
+each phase of their lifecycle, either explicitly (record_phase('attach_requested')) or as the
+cloud reports status transitions. A PhaseTimingReport then turns the recorded phases of the
+resources involved in each test iteration into rows of phase durations, shows them with a
+summary of each phase across iterations, and writes them as json so runs can be compared.
+
+Sample usage:
+    report = PhaseTimingReport('chain', columns=[
+        ('snap_progress', 'snapshot', 'create_accepted', 'completed'),
+        ('attach', 'volume', 'attach_requested', 'attached')])
+    report.add_row({'snapshot': snap, 'volume': vol}, iteration=1, zone='one')
+    report.show()
+    report.write_json('/tmp/chain_phases.json')
+"""
+import json
+import time
+from prettytable import PrettyTable
+from cloud_utils.log_utils.eulogger import Eulogger
+
+
+class PhaseTimedResource(object):
+    """
+    Mixin recording the time a resource first entered each phase of its lifecycle.
+    """
+
+    @property
+    def phase_times(self):
+        times = self.__dict__.get('eutest_phase_times')
+        if times is None:
+            times = {}
+            self.__dict__['eutest_phase_times'] = times
+        return times
+
+    def record_phase(self, phase, timestamp=None, overwrite=False):
+        """
+        Record the time this resource entered 'phase'. Only the first time a phase is seen is
+        kept unless 'overwrite' is set, ie for phases which repeat such as attach/detach.
+        :param phase: string phase name, ie 'attach_requested' or a status such as 'available'
+        :param timestamp: time.time() style timestamp, defaults to now
+        """
+        if phase is None:
+            return
+        if overwrite or phase not in self.phase_times:
+            self.phase_times[phase] = timestamp or time.time()
+
+    def clear_phases(self, *phases):
+        """
+        Remove the given recorded phases, or all of them if none are given.
+        """
+        if not phases:
+            self.phase_times.clear()
+        for phase in phases:
+            self.phase_times.pop(phase, None)
+
+    def phase_duration(self, start_phase, end_phase):
+        """
+        Returns the seconds between two recorded phases, or None if either was not recorded.
+        """
+        start = self.phase_times.get(start_phase)
+        end = self.phase_times.get(end_phase)
+        if start is None or end is None:
+            return None
+        return end - start
+
+
+class PhaseTimingReport(object):
+
+    def __init__(self, name, columns, log=None):
+        """
+        :param name: name of this report, ie the test name
+        :param columns: list of (column name, source name, start phase, end phase) tuples.
+                        'source name' refers to the resources dict passed to add_row().
+        :param log: optional logger used to show the report
+        """
+        self.name = name
+        self.columns = columns
+        self.log = log or Eulogger('PhaseTimingReport')
+        self.rows = []
+
+    def add_row(self, resources, **labels):
+        """
+        Adds a row of phase durations.
+        :param resources: dict of {source name: PhaseTimedResource}
+        :param labels: extra values stored with the row, ie iteration=1, zone='one'
+        :returns the row dict
+        """
+        durations = {}
+        for column, source, start_phase, end_phase in self.columns:
+            resource = resources.get(source)
+            if resource is None or not hasattr(resource, 'phase_duration'):
+                durations[column] = None
+            else:
+                durations[column] = resource.phase_duration(start_phase, end_phase)
+        row = {'labels': labels, 'durations': durations,
+               'resources': dict((key, getattr(value, 'id', None))
+                                 for key, value in resources.iteritems())}
+        self.rows.append(row)
+        return row
+
+    def summary(self):
+        """
+        Returns {column: {'count', 'min', 'mean', 'max', 'first', 'last'}} across all rows.
+        'first' and 'last' are the durations from the first and last rows recorded, to show
+        stages regressing over the course of a run.
+        """
+        summary = {}
+        for column, _, _, _ in self.columns:
+            values = [row['durations'][column] for row in self.rows
+                      if row['durations'].get(column) is not None]
+            if values:
+                summary[column] = {'count': len(values), 'min': min(values),
+                                   'mean': sum(values) / len(values), 'max': max(values),
+                                   'first': values[0], 'last': values[-1]}
+            else:
+                summary[column] = {'count': 0, 'min': None, 'mean': None, 'max': None,
+                                   'first': None, 'last': None}
+        return summary
+
+    def to_dict(self):
+        return {'name': self.name,
+                'columns': [{'name': c[0], 'source': c[1], 'start': c[2], 'end': c[3]}
+                            for c in self.columns],
+                'rows': self.rows,
+                'summary': self.summary()}
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4, sort_keys=True)
+
+    def show(self, printmethod=None, printme=True):
+        def fmt(value):
+            if value is None:
+                return '-'
+            return '{0:.2f}'.format(value)
+
+        label_keys = []
+        for row in self.rows:
+            for key in sorted(row['labels'].keys()):
+                if key not in label_keys:
+                    label_keys.append(key)
+        column_names = [c[0] for c in self.columns]
+        pt = PrettyTable([k.upper() for k in label_keys] + [c.upper() for c in column_names])
+        pt.align = 'l'
+        for row in self.rows:
+            pt.add_row([row['labels'].get(k) for k in label_keys] +
+                       [fmt(row['durations'][c]) for c in column_names])
+        summary = self.summary()
+        summary_pt = PrettyTable(['PHASE', 'COUNT', 'MIN', 'MEAN', 'MAX', 'FIRST', 'LAST'])
+        summary_pt.align = 'l'
+        for column in column_names:
+            stats = summary[column]
+            summary_pt.add_row([column, stats['count'], fmt(stats['min']), fmt(stats['mean']),
+                                fmt(stats['max']), fmt(stats['first']), fmt(stats['last'])])
+        buf = "{0} PHASE TIMES (seconds):\n{1}\n{2}".format(self.name, pt, summary_pt)
+        if not printme:
+            return buf
+        printmethod = printmethod or self.log.info
+        printmethod("\n" + buf + "\n")
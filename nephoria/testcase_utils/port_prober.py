@@ -0,0 +1,227 @@
+"""
+Concurrent tcp reachability probing of many (host, port) targets.
+
+Rather than connecting to one port at a time with blocking sockets and sleeping between rounds,
+a PortProber starts non-blocking connects to every target at once and waits on all of them with
+poll(). A target is retried 'retry_interval' seconds after a refused or timed out connect
+until it opens or its own timeout expires. Probing returns as soon as the required targets are
+open; 'all' targets, 'any' target, or at least one port per 'host' (ie rdp or winrm on each
+Windows guest).
+Each target's outcome is returned as a dict:
+    'host', 'port', 'status' ('open', 'refused', 'timeout', 'error' or 'pending'),
+    'time_to_open' (seconds from the start of probing), 'opened' (time.time() it opened),
+    'attempts', 'error' (last error seen)
+
+Sample usage:
+    prober = PortProber([(vm.ip_address, 22) for vm in vms], log=self.log)
+    results = prober.probe(timeout=300)
+    prober.show_results(results)
+    prober.raise_on_unreachable(results)
+"""
+import errno
+import math
+import select
+import socket
+import time
+from prettytable import PrettyTable
+from cloud_utils.log_utils.eulogger import Eulogger
+
+
+class PortProbeException(Exception):
+    pass
+
+
+class PortProber(object):
+    OPEN = 'open'
+    REFUSED = 'refused'
+    TIMEOUT = 'timeout'
+    ERROR = 'error'
+    PENDING = 'pending'
+
+    def __init__(self, targets, connect_timeout=5, retry_interval=1, max_inflight=256,
+                 log=None):
+        """
+        :param targets: list of (host, port) tuples
+        :param connect_timeout: seconds to wait on a single connect attempt
+        :param retry_interval: seconds to wait before retrying a target whose connect failed
+        :param max_inflight: max number of connects in progress at once
+        """
+        self.targets = []
+        for host, port in targets or []:
+            target = (str(host), int(port))
+            if target not in self.targets:
+                self.targets.append(target)
+        self.connect_timeout = connect_timeout
+        self.retry_interval = retry_interval
+        self.max_inflight = max(1, int(max_inflight))
+        self.log = log or Eulogger('PortProber')
+
+    def _debug(self, msg):
+        self.log.debug(msg)
+
+    def _is_done(self, results, require, required):
+        open_targets = [t for t in self.targets if results[t]['status'] == self.OPEN]
+        if require == 'any':
+            return bool(open_targets)
+        if require == 'host':
+            open_hosts = set(t[0] for t in open_targets)
+            return all(t[0] in open_hosts for t in required)
+        return all(results[t]['status'] == self.OPEN for t in required)
+
+    def probe(self, timeout=180, require='all', target_timeout=None, start_time=None):
+        """
+        Probes all targets concurrently until the required targets are open or 'timeout'.
+        :param timeout: overall timeout in seconds
+        :param require: 'all' targets, 'any' target, or 'host' for any port on every host
+        :param target_timeout: seconds after which a target is no longer retried, defaults to
+                               'timeout'
+        :param start_time: time.time() which 'time_to_open' is measured from, ie an instance's
+                           launch time, defaults to now
+        :returns list of result dicts in the order of self.targets
+        """
+        if require not in ['all', 'any', 'host']:
+            raise ValueError('Unknown require value:"{0}", expected all, any or host'
+                             .format(require))
+        start = time.time()
+        start_time = start_time or start
+        deadline = start + timeout
+        target_deadline = start + (target_timeout or timeout)
+        results = {}
+        for host, port in self.targets:
+            results[(host, port)] = {'host': host, 'port': port, 'status': self.PENDING,
+                                     'time_to_open': None, 'opened': None, 'attempts': 0,
+                                     'error': None}
+        next_attempt = dict((target, start) for target in self.targets)
+        # fd: (socket, target, connect attempt deadline)
+        inflight = {}
+        poller = select.poll()
+        poll_mask = select.POLLOUT | select.POLLERR | select.POLLHUP
+
+        def failed(target, status, err):
+            results[target]['status'] = status
+            results[target]['error'] = err
+            next_attempt[target] = time.time() + self.retry_interval
+
+        def opened(target):
+            now = time.time()
+            results[target]['status'] = self.OPEN
+            results[target]['error'] = None
+            results[target]['opened'] = now
+            results[target]['time_to_open'] = now - start_time
+            next_attempt.pop(target, None)
+            self._debug('{0}:{1} open after {2:.3f} seconds, attempts:{3}'
+                        .format(target[0], target[1], now - start_time,
+                                results[target]['attempts']))
+
+        try:
+            while not self._is_done(results, require, self.targets):
+                now = time.time()
+                if now >= deadline:
+                    break
+                # Start connects for targets due a (re)try
+                for target in self.targets:
+                    if len(inflight) >= self.max_inflight:
+                        break
+                    due = next_attempt.get(target)
+                    if due is None or due > now:
+                        continue
+                    if now >= target_deadline:
+                        next_attempt.pop(target, None)
+                        continue
+                    results[target]['attempts'] += 1
+                    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                    sock.setblocking(0)
+                    try:
+                        err = sock.connect_ex(target)
+                    except socket.error as SE:
+                        err = SE.errno or errno.EHOSTUNREACH
+                    if err in [0, errno.EISCONN]:
+                        sock.close()
+                        opened(target)
+                    elif err in [errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY]:
+                        inflight[sock.fileno()] = (sock, target, now + self.connect_timeout)
+                        poller.register(sock, poll_mask)
+                        next_attempt[target] = None
+                    else:
+                        sock.close()
+                        failed(target, self.REFUSED if err == errno.ECONNREFUSED else self.ERROR,
+                               errno.errorcode.get(err, str(err)))
+                if self._is_done(results, require, self.targets):
+                    break
+                if not inflight and not next_attempt:
+                    # Every target has either opened or passed its own timeout
+                    break
+                # Wait on in progress connects, or until the next retry is due. Targets waiting
+                # on a free connect slot can not start until an in progress connect completes.
+                wake = [deadline] + [x[2] for x in inflight.values()]
+                if len(inflight) < self.max_inflight:
+                    wake.extend(t for t in next_attempt.values() if t is not None)
+                wait = max(0, min(min(wake) - time.time(), 0.5))
+                if inflight:
+                    for fd, _ in poller.poll(int(math.ceil(wait * 1000))):
+                        sock, target, _ = inflight.pop(fd)
+                        poller.unregister(fd)
+                        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                        sock.close()
+                        if err == 0:
+                            opened(target)
+                        else:
+                            failed(target,
+                                   self.REFUSED if err == errno.ECONNREFUSED else self.ERROR,
+                                   errno.errorcode.get(err, str(err)))
+                elif wait:
+                    time.sleep(wait)
+                now = time.time()
+                for fd, (sock, target, attempt_deadline) in inflight.items():
+                    if now >= attempt_deadline:
+                        inflight.pop(fd)
+                        poller.unregister(fd)
+                        sock.close()
+                        failed(target, self.TIMEOUT, 'connect timed out after {0} seconds'
+                               .format(self.connect_timeout))
+        finally:
+            for sock, _, _ in inflight.values():
+                sock.close()
+        for result in results.values():
+            if result['status'] == self.PENDING and result['attempts']:
+                result['status'] = self.TIMEOUT
+        return [results[target] for target in self.targets]
+
+    def get_unreachable(self, results):
+        return [r for r in results if r['status'] != self.OPEN]
+
+    def raise_on_unreachable(self, results, require='all'):
+        """
+        Raises PortProbeException if the targets required by 'require' (see probe()) are not open.
+        """
+        open_targets = [(r['host'], r['port']) for r in results if r['status'] == self.OPEN]
+        if require == 'any':
+            ok = bool(open_targets)
+        elif require == 'host':
+            open_hosts = set(t[0] for t in open_targets)
+            ok = all(r['host'] in open_hosts for r in results)
+        else:
+            ok = len(open_targets) == len(results)
+        if not ok:
+            bad = self.get_unreachable(results)
+            raise PortProbeException('{0}/{1} targets not reachable: {2}'.format(
+                len(bad), len(results), ", ".join('{0}:{1}({2}:{3})'.format(
+                    r['host'], r['port'], r['status'], r['error']) for r in bad)))
+
+    def show_results(self, results, printmethod=None, printme=True):
+        pt = PrettyTable(['HOST', 'PORT', 'STATUS', 'TIME TO OPEN', 'ATTEMPTS', 'ERROR'])
+        pt.align = 'l'
+        for r in results:
+            tto = r['time_to_open']
+            pt.add_row([r['host'], r['port'], r['status'],
+                        '-' if tto is None else '{0:.3f}'.format(tto), r['attempts'],
+                        r['error'] or ''])
+        opened = [r['time_to_open'] for r in results if r['time_to_open'] is not None]
+        buf = 'PORT PROBE RESULTS, open:{0}/{1}'.format(len(opened), len(results))
+        if opened:
+            buf += ', time to open min:{0:.3f} max:{1:.3f}'.format(min(opened), max(opened))
+        buf += "\n{0}".format(pt)
+        if not printme:
+            return buf
+        printmethod = printmethod or self.log.info
+        printmethod("\n" + buf + "\n")
@@ -30,7 +30,7 @@
 #
 # Author: vic.iglesias@eucalyptus.com
 
-from nephoria.cloudtests.testcase_utils.eutestcase import EutesterTestCase
+from nephoria.testcase_utils.cli_test_runner import CliTestRunner
 from multiprocessing import Process
 from multiprocessing import Queue
 import inspect
@@ -55,7 +55,7 @@ class ProcessManager():
             raise KeyError("Unable to find queue: " + str(id))
 
     def run_method_as_process(self, method, *args, **kwargs):
-        methvars = EutesterTestCase.get_meth_arg_names(method)
+        methvars = CliTestRunner.get_meth_arg_names(method)
         daemonize = False
         if 'daemonize' in kwargs:
             if 'daemonize' in methvars:
@@ -113,6 +113,6 @@ class ProcessManager():
 
     def get_all_results(self):
         result_list = []
-        for process in self.process_pool:
+        for process in self.process_pool.keys():
                 result_list.append(self.wait_for_process(process))
         return result_list
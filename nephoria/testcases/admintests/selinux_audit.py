@@ -5,6 +5,7 @@ from cloud_utils.log_utils import get_traceback, red, ForegroundColor, BackGroun
 from cloud_utils.net_utils.remote_commands import RemoteCommands
 from cloud_utils.net_utils.sshconnection import SshConnection
 from nephoria.testcontroller import TestController
+from prettytable import PrettyTable
 import copy
 import re
 import time
@@ -43,6 +44,43 @@ class SeLinuxAudit(CliTestRunner):
                    'help': 'Comma separated list of ips or hostnames to gather sos reports from',
                    'default': None }}
 
+    _DEFAULT_CLI_ARGS['incremental'] = {
+        'args': ['--incremental'],
+        'kwargs': {'dest': 'incremental',
+                   'help': 'Flag, only fetch AVC denials newer than the cursor saved on each host '
+                           'by the previous incremental audit. Denials are deduplicated on the '
+                           'host before transfer',
+                   'action': 'store_true',
+                   'default': False}}
+
+    _DEFAULT_CLI_ARGS['cursor_path'] = {
+        'args': ['--cursor-path'],
+        'kwargs': {'dest': 'cursor_path',
+                   'help': 'Path on each host of the incremental audit cursor file. Remove it to '
+                           'restart from --start-hours',
+                   'default': '/var/lib/nephoria/selinux_audit.cursor'}}
+
+    # Reads ausearch --raw output, skips events at or before the 'cur' (timestamp:serial)
+    # cursor, and prints one line per unique (scontext, tcontext, tclass, perms) denial:
+    #   AVC|<count>|<first event id>|<last event id>|<scontext>|<tcontext>|<tclass>|<perms>
+    # followed by 'CURSOR|<id of the newest event seen>'
+    _AVC_AWK = (
+        'function field(name, v) { if (match($0, name "=[^ ]+")) { '
+        'v = substr($0, RSTART + length(name) + 1, RLENGTH - length(name) - 1); '
+        'gsub(/\\047/, "", v); return v } return "" } '
+        'BEGIN { split(cur, c, ":"); cts = c[1] + 0; csn = c[2] + 0; '
+        'mts = cts; msn = csn; mid = cur } '
+        '/ denied / { if (!match($0, /audit\\([0-9.]+:[0-9]+\\)/)) next; '
+        'id = substr($0, RSTART + 6, RLENGTH - 7); split(id, a, ":"); '
+        'ts = a[1] + 0; sn = a[2] + 0; '
+        'if (ts < cts || (ts == cts && sn <= csn)) next; '
+        'if (ts > mts || (ts == mts && sn > msn)) { mts = ts; msn = sn; mid = id } '
+        'perm = ""; if (match($0, /\\{[^}]*\\}/)) { perm = substr($0, RSTART + 1, RLENGTH - 2); '
+        'gsub(/^ +| +$/, "", perm) } '
+        'k = field("scontext") "|" field("tcontext") "|" field("tclass") "|" perm; '
+        'n[k]++; if (!(k in f)) f[k] = id; l[k] = id } '
+        'END { for (k in n) print "AVC|" n[k] "|" f[k] "|" l[k] "|" k; print "CURSOR|" mid }')
+
 
     def post_init(self, *args, **kwargs):
         # Some helper code to provide a start date to ausearch as well as checks to see
@@ -77,6 +115,7 @@ class SeLinuxAudit(CliTestRunner):
                                                                                  minutes,
                                                                                  ts.tm_sec)
         self._ip_list = []
+        self.avc_cursors = {}
 
 
     def _scrub_ip_list(self, value):
@@ -133,6 +172,83 @@ class SeLinuxAudit(CliTestRunner):
     def clean_method(self):
         pass
 
+    def get_incremental_avc_cmd(self):
+        """
+        Builds the host side command for an incremental audit. The cursor file on the host is
+        only advanced once the new denials have been read and summarized.
+        """
+        if re.search('-s', self.search_args):
+            # The user provided their own start time, the cursor still filters older events
+            start = '""'
+        else:
+            start = '"{0}"'.format(self.start_time.strip())
+        cursor_path = self.args.cursor_path
+        return ('C={cursor}; mkdir -p $(dirname $C); CUR=$(cat $C 2>/dev/null); S={start}; '
+                'if [ -n "$CUR" ] && [ -z "{user_start}" ]; then '
+                'S="--start $(date -d @${{CUR%%:*}} \'+%x %T\')"; fi; '
+                'OUT=$(ausearch $S {search_args} --success no --raw 2>/dev/null | '
+                'awk -v cur="$CUR" \'{awk}\') && echo "$OUT" && '
+                'NEW=$(echo "$OUT" | sed -n "s/^CURSOR|//p") && '
+                'if [ -n "$NEW" ]; then echo $NEW > $C.tmp && mv -f $C.tmp $C; fi'
+                .format(cursor=cursor_path, start=start, search_args=self.search_args.strip(),
+                        awk=self._AVC_AWK,
+                        user_start='1' if re.search('-s', self.search_args) else ''))
+
+    def parse_incremental_avc_output(self, output):
+        """
+        Parses the output of the incremental audit command.
+        :returns tuple (list of denial dicts, cursor string or None)
+        """
+        denials = []
+        cursor = None
+        for line in output or []:
+            line = line.strip()
+            if line.startswith('CURSOR|'):
+                cursor = line.split('|', 1)[1] or None
+            elif line.startswith('AVC|'):
+                fields = line.split('|', 7)
+                if len(fields) == 8:
+                    denials.append({'count': int(fields[1]), 'first': fields[2],
+                                    'last': fields[3], 'scontext': fields[4],
+                                    'tcontext': fields[5], 'tclass': fields[6],
+                                    'perms': fields[7]})
+        return denials, cursor
+
+    def show_avc_denials(self, denials_by_host, printmethod=None, printme=True):
+        pt = PrettyTable(['HOST', 'COUNT', 'SCONTEXT', 'TCONTEXT', 'CLASS', 'PERMS', 'LAST EVENT'])
+        pt.align = 'l'
+        for host in sorted(denials_by_host.keys()):
+            for denial in sorted(denials_by_host[host], key=lambda x: x['count'], reverse=True):
+                pt.add_row([host, denial['count'], denial['scontext'], denial['tcontext'],
+                            denial['tclass'], denial['perms'], denial['last']])
+        if not printme:
+            return pt
+        printmethod = printmethod or self.log.info
+        printmethod("\n{0}\n".format(pt))
+
+    def gather_incremental_avc_denials(self):
+        """
+        Fetches only the AVC denials logged on each host since the previous incremental audit,
+        deduplicated on the host by (scontext, tcontext, tclass, perms).
+        :returns tuple (dict of host: list of denial dicts, list of hosts the command failed on)
+        """
+        rc = self.rc
+        rc.results = {}
+        cmd = self.get_incremental_avc_cmd()
+        self.log.debug('Running "{0}" on ips:{1}'.format(cmd, rc.ips))
+        rc.run_remote_commands(command=cmd)
+        denials_by_host = {}
+        errors = []
+        for host, result in rc.results.iteritems():
+            if result.get('status') != 0:
+                errors.append(host)
+                continue
+            denials, cursor = self.parse_incremental_avc_output(result.get('output'))
+            denials_by_host[host] = denials
+            if cursor:
+                self.avc_cursors[host] = cursor
+        return denials_by_host, errors
+
 
     def test0_install_audit_utils(self):
         """
@@ -159,8 +275,18 @@ class SeLinuxAudit(CliTestRunner):
         Attempts to gather ausearch information for the provided time period.
         If there is output from this command the test raises a runtime error as this may
         need selinux policy attention.
+        With --incremental only the denials newer than each host's cursor are fetched.
         """
 
+        if self.args.incremental:
+            denials_by_host, errors = self.gather_incremental_avc_denials()
+            self.show_avc_denials(denials_by_host)
+            failed = len(errors) + len([h for h, d in denials_by_host.iteritems() if d])
+            if failed:
+                raise RuntimeError('{0}/{1} hosts either failed the incremental audit or '
+                                   'returned new AVC denials. Failed hosts:{2}'
+                                   .format(failed, len(self.rc.ips), ", ".join(errors)))
+            return
         rc = self.rc
         rc.results = {}
         cmd = 'ausearch {0} {1} --success no'.format(self.start_time, self.search_args)
@@ -5,7 +5,10 @@ from cloud_utils.log_utils import get_traceback, red, ForegroundColor, BackGroun
 from cloud_utils.net_utils.remote_commands import RemoteCommands
 from cloud_utils.net_utils.sshconnection import SshConnection
 from nephoria.testcontroller import TestController
+from concurrent.futures import ThreadPoolExecutor
+from prettytable import PrettyTable
 import copy
+import hashlib
 import time
 import os
 
@@ -50,6 +53,21 @@ class SOSReports(CliTestRunner):
                    'default': "http://downloads.eucalyptus.com/software/tools/centos/6/x86_64/"
                               "eucalyptus-sos-plugins-0.1.5-0.el6.noarch.rpm"}}
 
+    _DEFAULT_CLI_ARGS['download_workers'] = {
+        'args': ['--download-workers'],
+        'kwargs': {'dest': 'download_workers',
+                   'help': 'Number of hosts to download SOS reports from concurrently',
+                   'type': int,
+                   'default': 8}}
+
+    _DEFAULT_CLI_ARGS['download_retries'] = {
+        'args': ['--download-retries'],
+        'kwargs': {'dest': 'download_retries',
+                   'help': 'Number of times to retry an interrupted download from a host, '
+                           'each retry resumes from the partial download',
+                   'type': int,
+                   'default': 3}}
+
     def post_init(self, *args, **kwargs):
         self.start_time = int(time.time())
         self.ticket_number = self.args.ticket_number or self.start_time
@@ -151,45 +169,174 @@ class SOSReports(CliTestRunner):
                                .format(failed, len(rc.ips)))
 
 
+    def _get_ssh(self, ip):
+        if self.tc and ip in self.tc.sysadmin.eucahosts.keys():
+            return self.tc.sysadmin.eucahosts.get(ip).ssh
+        return SshConnection(host=ip, password=self.args.password)
+
+    def download_sos_report(self, ip, chunk_size=1048576, retries=None, retry_interval=5):
+        """
+        Downloads the SOS report tarball from a host. The transfer is written to a '.part' file
+        which is resumed from its current size if a previous attempt was interrupted. A failed
+        attempt is retried, resuming from the '.part' file, up to 'retries' times. The local
+        copy is verified against the md5sum of the remote tarball.
+        :param ip: host ip or hostname
+        :param chunk_size: bytes read per sftp request
+        :param retries: number of retries after a failed attempt, defaults to --download-retries
+        :param retry_interval: seconds to wait between attempts
+        :returns dict with the keys: 'ip', 'path', 'size', 'transferred', 'resumed_at',
+                 'elapsed', 'rate' (bytes/sec), 'md5', 'attempts'. Stats are of the last attempt.
+        """
+        if retries is None:
+            retries = self.args.download_retries
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                ret = self._download_sos_report(ip, chunk_size=chunk_size)
+                ret['attempts'] = attempt
+                return ret
+            except Exception as E:
+                if attempt > retries:
+                    raise
+                self.log.warning('Download attempt {0}/{1} from {2} failed, retrying in {3} '
+                                 'seconds. Error:"{4}"'.format(attempt, retries + 1, ip,
+                                                               retry_interval, E))
+                time.sleep(retry_interval)
+
+    def _download_sos_report(self, ip, chunk_size=1048576):
+        ssh = self._get_ssh(ip)
+        transport = ssh.connection.get_transport()
+        if not (transport and transport.is_active()):
+            # A previous attempt may have been interrupted by the connection dropping
+            ssh.refresh_connection()
+        remote_tarball_path = ssh.sys("ls -1 {0}/*.xz | grep {1}"
+                                      .format(self.remote_dir, self.ticket_number),
+                                      code=0)[0].strip()
+        tarball_name = os.path.basename(remote_tarball_path)
+        local_name = "sosreport-{0}.{1}{2}".format(ip, self.ticket_number,
+                                                   tarball_name.split(str(self.ticket_number))[1])
+        local_tarball_path = os.path.join(self.args.local_dir, local_name)
+        part_path = local_tarball_path + '.part'
+        remote_md5 = ssh.sys('md5sum {0}'.format(remote_tarball_path), code=0)[0].split()[0]
+        ret = {'ip': ip, 'path': local_tarball_path, 'size': None, 'transferred': 0,
+               'resumed_at': 0, 'elapsed': 0, 'rate': None, 'md5': remote_md5}
+
+        def local_md5(path):
+            md5 = hashlib.md5()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), ''):
+                    md5.update(chunk)
+            return md5.hexdigest()
+
+        start = time.time()
+        sftp = ssh.connection.open_sftp()
+        try:
+            remote_size = sftp.stat(remote_tarball_path).st_size
+            ret['size'] = remote_size
+            if (os.path.exists(local_tarball_path) and
+                    os.path.getsize(local_tarball_path) == remote_size and
+                    local_md5(local_tarball_path) == remote_md5):
+                self.log.debug('SOS report from {0} already downloaded to:{1}'
+                               .format(ip, local_tarball_path))
+                return ret
+            offset = 0
+            if os.path.exists(part_path):
+                offset = os.path.getsize(part_path)
+                if offset > remote_size:
+                    offset = 0
+            ret['resumed_at'] = offset
+            self.log.debug('Downloading {0}:{1} to: {2}, offset:{3}/{4}'
+                           .format(ip, remote_tarball_path, local_tarball_path, offset,
+                                   remote_size))
+            with open(part_path, 'ab' if offset else 'wb') as local_file:
+                remote_file = sftp.open(remote_tarball_path, 'rb')
+                try:
+                    remote_file.seek(offset)
+                    remote_file.prefetch()
+                    while True:
+                        data = remote_file.read(chunk_size)
+                        if not data:
+                            break
+                        local_file.write(data)
+                        ret['transferred'] += len(data)
+                finally:
+                    remote_file.close()
+        finally:
+            sftp.close()
+        ret['elapsed'] = time.time() - start
+        if ret['elapsed']:
+            ret['rate'] = ret['transferred'] / ret['elapsed']
+        if os.path.getsize(part_path) != remote_size:
+            raise RuntimeError('Downloaded size:{0} != remote size:{1} for:{2}:{3}'
+                               .format(os.path.getsize(part_path), remote_size, ip,
+                                       remote_tarball_path))
+        md5 = local_md5(part_path)
+        if md5 != remote_md5:
+            # Remove the bad copy so the next attempt starts over
+            os.remove(part_path)
+            raise RuntimeError('Downloaded md5:{0} != remote md5:{1} for:{2}:{3}'
+                               .format(md5, remote_md5, ip, remote_tarball_path))
+        os.rename(part_path, local_tarball_path)
+        return ret
+
+    def show_download_results(self, results, printmethod=None, printme=True):
+        pt = PrettyTable(['HOST', 'STATUS', 'ATTEMPTS', 'MB', 'RESUMED AT', 'SECONDS', 'MB/s',
+                          'PATH/ERROR'])
+        pt.align = 'l'
+        mb = 1048576.0
+        for ip in self.ip_list:
+            result = results.get(ip) or {}
+            if result.get('error'):
+                pt.add_row([ip, red('FAILED'), '', '', '', '', '', result.get('error')])
+                continue
+            rate = result.get('rate')
+            pt.add_row([ip, 'OK', result.get('attempts'),
+                        "{0:.2f}".format((result.get('size') or 0) / mb),
+                        result.get('resumed_at'), "{0:.2f}".format(result.get('elapsed') or 0),
+                        "{0:.2f}".format(rate / mb) if rate else '-', result.get('path')])
+        if not printme:
+            return pt
+        printmethod = printmethod or self.log.info
+        printmethod("\n{0}\n".format(pt))
+
     def test3_download(self):
         """
         Attempts to download the SOS reports from each host in the cloud and store in a local
-        directory
+        directory. Hosts are downloaded from concurrently (see --download-workers), interrupted
+        downloads are retried per host resuming from the partial download (see
+        --download-retries) or on the next run, and each download is verified against the
+        remote md5sum.
         """
-        error_msg = ""
-        count = 0
-        err_count = 0
         host_count = len(self.ip_list)
-        for ip in self.ip_list:
-            if self.tc:
-                if ip in self.tc.sysadmin.eucahosts.keys():
-                    host = self.tc.sysadmin.eucahosts.get(ip)
-                    ssh = host.ssh
+        results = {}
+        if not host_count:
+            raise SkipTestException('No hosts to download SOS reports from')
+        start = time.time()
+        workers = max(1, min(self.args.download_workers, host_count))
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            futures = dict((executor.submit(self.download_sos_report, ip), ip)
+                           for ip in self.ip_list)
+            for future, ip in futures.iteritems():
+                try:
+                    results[ip] = future.result()
+                except Exception, e:
+                    msg = 'Error Downloading from: {0}. Error:"{1}"'.format(ip, e)
+                    self.log.error("{0}\n{1}".format(get_traceback(), msg))
+                    results[ip] = {'error': msg}
                 else:
-                    ssh = SshConnection(host=ip, password=self.args.password)
-            try:
-                remote_tarball_path = ssh.sys("ls -1 {0}/*.xz | grep {1}"
-                                               .format(self.remote_dir, self.ticket_number),
-                                               code=0)[0]
-                tarball_name = os.path.basename(remote_tarball_path)
-                local_name = "sosreport-{0}.{1}{2}".format(ip, self.ticket_number,
-                                                 tarball_name.split(str(self.ticket_number))[1])
-                local_tarball_path = os.path.join(self.args.local_dir, local_name)
-                self.log.debug("Downloading file to: " + local_tarball_path)
-                ssh.sftp_get(localfilepath=local_tarball_path,
-                                  remotefilepath=remote_tarball_path)
-            except Exception, e:
-                err_count += 1
-                msg = '\nError Downloading from: {0}. Error:"{0}"\n'.format(ip, e)
-                self.log.error("{0}\n{1}".format(get_traceback(), msg))
-                error_msg += msg
-            else:
-                count += 1
-                self.log.info(markup('Downloaded SOS report {0}/{1} to:{2}'
-                                     .format(count, host_count, local_tarball_path),
-                                     markups=[ForegroundColor.WHITE, BackGroundColor.BG_GREEN]))
-        if error_msg:
-            self.log.error(red(error_msg))
+                    self.log.info(markup('Downloaded SOS report from {0} to:{1}'
+                                         .format(ip, results[ip]['path']),
+                                         markups=[ForegroundColor.WHITE,
+                                                  BackGroundColor.BG_GREEN]))
+        finally:
+            executor.shutdown(wait=True)
+        self.show_download_results(results)
+        err_count = len([r for r in results.values() if r.get('error')])
+        self.log.info('Downloaded SOS reports from {0}/{1} hosts in {2:.2f} seconds'
+                      .format(host_count - err_count, host_count, time.time() - start))
+        if err_count:
             raise Exception('Error during download on {0}/{1} hosts'.format(err_count, host_count))
 
 
@@ -12,6 +12,7 @@ of the vm/guest.
 from cloud_utils.log_utils import get_traceback, red
 from nephoria.testcase_utils.cli_test_runner import CliTestRunner, SkipTestException
 from nephoria.testcontroller import TestController
+from nephoria.testcase_utils.artifact_cache import artifact_key, get_url_validators
 from boto.ec2.group import Group
 from boto.ec2.instance import Instance
 from boto.ec2.volume import Volume
@@ -111,6 +112,7 @@ class Block_Device_Mapping_Tests(CliTestRunner):
         self._current_test_instance = None
         self._build_image_volume = None
         self._build_image_snapshot = None
+        self._url_artifact_key = None
 
         self.test_resources = {}
         self.reservation = None
@@ -434,13 +436,34 @@ class Block_Device_Mapping_Tests(CliTestRunner):
         return image_bytes
 
 
-    def get_existing_test_snapshot_by_tag_key(self, tagkey):
+    def get_existing_test_snapshot_by_tag_key(self, tagkey, content_key=None):
         snapshots = self.user.ec2.get_snapshots(filters={'tag-key':str(tagkey)})
         for snapshot in snapshots:
             if 'md5' in snapshot.tags and 'md5len' in snapshot.tags:
+                if content_key and snapshot.tags.get('artifact_key', content_key) != \
+                        content_key:
+                    self.log.debug('Skipping snapshot:{0}, written from different image '
+                                   'content than url:{1}'.format(snapshot.id, self.url))
+                    continue
                 return snapshot
         return None
 
+    @property
+    def url_artifact_key(self):
+        """
+        Artifact cache key of the url's current content, used to tell if snapshots left by a
+        previous run were written from the same image.
+        """
+        if self._url_artifact_key is None:
+            try:
+                self._url_artifact_key = artifact_key(self.url,
+                                                      validators=get_url_validators(self.url))
+            except Exception as E:
+                self.log.warning('Could not get validators for url:"{0}", err:"{1}"'
+                                 .format(self.url, E))
+                self._url_artifact_key = ""
+        return self._url_artifact_key
+
     def get_existing_test_volume_by_tag_key(self, tagkey):
         volumes = self.user.ec2.get_volumes(filters={'tag-key':str(tagkey)})
         for volume in volumes:
@@ -485,6 +508,8 @@ class Block_Device_Mapping_Tests(CliTestRunner):
         build_image_snapshot.add_tag('md5', build_image_volume.md5)
         build_image_snapshot.add_tag('md5len', build_image_volume.md5len)
         build_image_snapshot.add_tag('src_url', str(url))
+        if url == self.url and self.url_artifact_key:
+            build_image_snapshot.add_tag('artifact_key', self.url_artifact_key)
         build_image_volume.add_tag('src_url', str(url))
         build_image_volume.add_tag('md5', build_image_volume.md5)
         build_image_volume.add_tag('md5len', build_image_volume.md5len)
@@ -563,7 +588,7 @@ class Block_Device_Mapping_Tests(CliTestRunner):
     def populate_self_from_existing_test_resources(self,build_image=True, base_test=True):
         if build_image:
             self.build_image_snapshot = self.get_existing_test_snapshot_by_tag_key(
-                tagkey=self.build_image_snapshot_tag_name)
+                tagkey=self.build_image_snapshot_tag_name, content_key=self.url_artifact_key)
             if self.build_image_snapshot:
                 self.build_image_snapshot.eutest_volume_md5 = \
                     self.build_image_snapshot.tags.get('md5')
@@ -5,7 +5,8 @@ from boto.ec2.volume import Volume
 import json
 class EBSTestTag(object):
     def __init__(self, volume, md5=None, source_zone=None, source_volume=None,
-                 source_volume_size=None, source_volume_md5=None, source_volume_timestamp=None):
+                 source_volume_size=None, source_volume_md5=None, source_volume_timestamp=None,
+                 chunk_manifest=None):
         if not isinstance(volume, Volume):
             raise ValueError('"{0}".__init__() expected type:{1}, got:"{2}/{3}"'
                              .format(self.__class__.__name__, Volume, volume, type(volume)))
@@ -16,6 +17,7 @@ class EBSTestTag(object):
         self.source_volume_size = source_volume_size
         self.source_volume_md5 = source_volume_md5
         self.source_volume_timestamp = source_volume_timestamp
+        self.chunk_manifest = chunk_manifest
 
     def __repr__(self):
         return "{0}:{1}".format(self.__class__.__name__, self.volume.id)
@@ -26,7 +28,8 @@ class EBSTestTag(object):
                 'source_volume': self.source_volume,
                 'source_volume_size': self.source_volume_size,
                 'source_volume_md5': self.source_volume_md5,
-                'source_volume_timestamp': self.source_volume_timestamp}
+                'source_volume_timestamp': self.source_volume_timestamp,
+                'chunk_manifest': self.chunk_manifest}
 
     def update_from_volume_tags(self, tags=None):
         tags = tags or self.tags
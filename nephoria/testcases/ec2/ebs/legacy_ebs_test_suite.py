@@ -37,7 +37,9 @@ import os
 
 from nephoria.aws.ec2 import euinstance
 from nephoria.aws.ec2.ec2ops import VolumeStateException
+from nephoria.aws.ec2.fleet import FleetExecutor
 from nephoria.testcase_utils.cli_test_runner import CliTestRunner
+from nephoria.testcase_utils.phase_timer import PhaseTimingReport
 from nephoria.testcontroller import TestController
 from cloud_utils.log_utils import red, get_traceback
 from nephoria.usercontext import UserContext
@@ -47,6 +49,17 @@ from boto.exception import EC2ResponseError
 from random import randint
 
 
+# (column, resource, start phase, end phase) recorded per volume in the snapshot/volume chain tests
+CHAIN_PHASE_COLUMNS = [
+    ('snap_accept', 'snapshot', 'create_requested', 'create_accepted'),
+    ('snap_progress', 'snapshot', 'create_accepted', 'completed'),
+    ('vol_accept', 'volume', 'create_requested', 'create_accepted'),
+    ('vol_create', 'volume', 'create_accepted', 'available'),
+    ('attach', 'volume', 'attach_requested', 'attached'),
+    ('guest_visible', 'volume', 'attached', 'guest_visible'),
+    ('md5', 'volume', 'md5_start', 'md5_complete')]
+
+
 class TestZone():
     def __init__(self, partition):
         self.partition = partition
@@ -81,6 +94,14 @@ class LegacyEbsTestSuite(CliTestRunner):
                    'help': 'Length in bytes to read from volume to record checksum, '
                            '0 will read in entire volume'}}
 
+    _DEFAULT_CLI_ARGS['chunk_coverage'] = {
+        'args': ['--chunk-coverage'],
+        'kwargs': {'dest': 'chunk_coverage',
+                   'default': None,
+                   'help': 'Fraction (0-1) of each new volume to write and verify as sampled '
+                           'chunks past the md5 head, requires a non-zero --md5-len. '
+                           'Default: no chunk sampling'}}
+
     _DEFAULT_CLI_ARGS['waitconnect'] = {
         'args': ['--waitconnect'],
         'kwargs': {'dest': 'waitconnect',
@@ -129,6 +150,13 @@ class LegacyEbsTestSuite(CliTestRunner):
                    'default': 3,
                    'help': 'Number of times to run consecutive tests'}}
 
+    _DEFAULT_CLI_ARGS['phase_times_dir'] = {
+        'args': ['--phase-times-dir'],
+        'kwargs': {'dest': 'phase_times_dir',
+                   'default': None,
+                   'help': 'Directory to write json per phase timing results of the '
+                           'snapshot/volume chain tests to'}}
+
     def post_init(self, *args, **kwargs):
         self.testid = "{0}:{1}:{2}".format(self.__class__.__name__, time.ctime(), randint(0, 1000))
         self._is_multicluster = None
@@ -139,6 +167,10 @@ class LegacyEbsTestSuite(CliTestRunner):
         self._user = None
         self._tc = None
         self.md5len = int(self.args.md5_len) or None
+        self.chunk_coverage = float(self.args.chunk_coverage or 0) or None
+        if self.chunk_coverage and not self.md5len:
+            raise ValueError('--chunk-coverage requires a non-zero --md5-len, a full device md5 '
+                             'would be overwritten by the sampled chunks')
         self.test_count = int(self.args.test_count) or 1
         self.snaps = []
 
@@ -444,7 +476,8 @@ class LegacyEbsTestSuite(CliTestRunner):
                         instance = zone.instances[i]
                         try:
                             instance.attach_euvolume(volume, timeout=timeout,
-                                                     md5_len=self.md5len, write_len=self.md5len, overwrite=overwrite)
+                                                     md5_len=self.md5len, write_len=self.md5len, overwrite=overwrite,
+                                                     chunk_coverage=self.chunk_coverage)
                         except VolumeStateException, vse:
                             self.log.warning(
                                 red("This is a temp work around for testing, this is to avoid "
@@ -534,42 +567,51 @@ class LegacyEbsTestSuite(CliTestRunner):
                     instances.
                     Attempts to verify detached volume state on both the cloud and the guest
                     by default will attempt to detach a single volume from each instance
+                    Instances are worked on concurrently.
         """
-        errmsg = ""
         zonelist = zonelist or self.zonelist
         if not zonelist:
             raise Exception("Zone list was empty")
+        instances = []
         for zone in zonelist:
             if not zone.instances:
                 raise Exception("No instances in zone:" + str(zone.name))
-            for instance in zone.instances:
-                vc = 0
-                badvols = instance.get_unsynced_volumes()
-                if (badvols is not None) and (badvols != []):
-                    self.log.debug("failed")
-                    errlist = []
-                    for badvol in badvols:
-                        errlist.append(str(badvol.id))
-                    raise Exception("Unsync volumes found on:" + str(instance.id) + "\n" +
-                                    " ".join(errlist))
-                for volume in instance.attached_vols:
-                    # detach number of volumes equal to volcount
-                    if volcount and vc >= volcount:
-                        break
-                    else:
-                        vc += 1
-                        try:
-                            instance.detach_euvolume(volume, timeout=timeout)
-                        except Exception, e:
-                            self.log.debug("fail. Could not detach Volume:" + str(volume.id) +
-                                           "from instance:" + str(instance.id))
-                            if eof:
-                                raise e
-                            else:
-                                errmsg += "\nCould not detach Volume:" + str(volume.id) + \
-                                          "from instance:" + str(instance.id) + ",err:" + str(e)
-        if errmsg:
-            raise Exception(errmsg)
+            instances.extend(zone.instances)
+
+        def detach_from_instance(instance):
+            errmsg = ""
+            vc = 0
+            badvols = instance.get_unsynced_volumes()
+            if (badvols is not None) and (badvols != []):
+                self.log.debug("failed")
+                errlist = []
+                for badvol in badvols:
+                    errlist.append(str(badvol.id))
+                raise Exception("Unsync volumes found on:" + str(instance.id) + "\n" +
+                                " ".join(errlist))
+            for volume in list(instance.attached_vols):
+                # detach number of volumes equal to volcount
+                if volcount and vc >= volcount:
+                    break
+                else:
+                    vc += 1
+                    try:
+                        instance.detach_euvolume(volume, timeout=timeout)
+                    except Exception, e:
+                        self.log.debug("fail. Could not detach Volume:" + str(volume.id) +
+                                       "from instance:" + str(instance.id))
+                        if eof:
+                            raise e
+                        else:
+                            errmsg += "\nCould not detach Volume:" + str(volume.id) + \
+                                      "from instance:" + str(instance.id) + ",err:" + str(e)
+            if errmsg:
+                raise Exception(errmsg)
+
+        # Each detach is bounded by 'timeout', the number of volumes detached varies per host
+        fleet = FleetExecutor(instances, timeout=None, log=self.log)
+        results = fleet.run(detach_from_instance)
+        fleet.raise_on_failures(results)
 
     def detach_all_volumes_from_stopped_instances_in_zones(self, zonelist=None, timeout=480):
         """
@@ -720,91 +762,113 @@ class LegacyEbsTestSuite(CliTestRunner):
         write_random_stuff_to_original_volume()
         previous_md5s = []
         test_volumes = [start_volume]
-        for test_num in xrange(0, count):
-            self.status('Starting test iteration:{0}/{1}'.format(test_num, count))
-            try:
-                self.user.ec2.show_volumes(test_volumes)
-            except Exception as E:
-                self.log.warning(red('{0}\nIgnoring the following error while showing volumes: '
-                                     '{1}'.format(get_traceback(), E)))
-            self.status('Writing data to original volume for test iteration:{0}'.format(test_num))
-            write_random_stuff_to_original_volume(rand_seek=True)
-            self.status('Start volume md5:{0} for iteration:{1}'.format(start_volume.md5,
-                                                                        test_num))
-            new_snap = self.user.ec2.create_snapshot_from_volume(
-                start_volume, description="ebstest", wait_on_progress=wait_on_progress)
-            self.user.ec2.create_tags(new_snap.id, {'TESTID': self.testid})
-            newvols = []
-            for zone in zonelist:
-                self.status('Beginning ZONE{0}/{1}: zone name:{2}, test iteration:{3}'
-                            .format(zonelist.index(zone) + 1 , len(zonelist), zone, test_num))
-                instance = zone.instances[0]
-                self.log.debug("Creating volume from snap:" + str(new_snap.id))
-                newvol = self.user.ec2.create_volume(zone.name, size=0, snapshot=new_snap,
-                                                     timepergig=time_per_gb)
-                self.user.ec2.create_tags(newvol.id, {'TESTID': self.testid})
-                newvols.append(newvol)
-                test_volumes.append(newvol)
-                newvol.add_tag('ebstestsuite_created_test#{0}'.format(test_num))
-                newvol.md5len = None
-                zone.volumes.append(newvol)
-                new_snap.eutest_volumes.append(newvol)
-                instance.attach_euvolume(newvol)
-                newvol.md5 = None
-                newvol.md5len = None
-                instance.md5_attached_euvolume(newvol, timepergig=300, length=None)
-                self.status('MD5 volume:{0} for test zone:{1}, iteration:{2}'
-                            .format(newvol.id, zone, test_num))
-                self.user.ec2.show_volumes([start_volume, newvol])
-                if newvol.md5 != start_volume.md5:
-                    self.log.error(red('Error md5 does not match, printing debug...'))
-                    self.status('head for new vol...')
-                    instance.sys('head -100 {0}'.format(newvol.guest_dev))
-                    self.status('head for new starting vol...')
-                    start_instance.sys('head -100 {0}'.format(start_volume.guestdev))
-                    raise ValueError('Newvol:{0} md5:{1} != origvol:{2} md5:{3}'
-                                     .format(newvol.id, newvol.md5, start_volume.id,
-                                             start_volume.md5))
-                if newvol.md5 in previous_md5s:
-                    self.log.error(red('Error md5 is a dup, printing debug...'))
-                    self.status('head for new vol...')
-                    instance.sys('head -100 {0}'.format(newvol.guest_dev))
-                    self.status('head for new starting vol...')
-                    start_instance.sys('head -100 {0}'.format(start_volume.guestdev))
-                    raise ValueError('test#{0}, current vol:{1} md5sum matches a previous '
-                                     'test:{2}, md5:{3}'
-                                     .format(newvol.md5, previous_md5s.index(newvol.md5)))
-                self.status('Zone:{0} iteration:{1} PASSED '.format(zone, test_num))
-
-            self.status('Deleting volumes from this test iteration #{0}...'.format(test_num))
-            for vol in newvols:
+        report = PhaseTimingReport('vol_snap_vol_repeat', CHAIN_PHASE_COLUMNS, log=self.log)
+        try:
+            for test_num in xrange(0, count):
+                self.status('Starting test iteration:{0}/{1}'.format(test_num, count))
                 try:
-                    self.user.ec2.detach_volume(vol)
+                    self.user.ec2.show_volumes(test_volumes)
                 except Exception as E:
-                    self.log.warning(
-                        red('{0}\nIgnoring the following error while detaching volumes: '
-                            '{1}'.format(get_traceback(), E)))
-            try:
-                self.user.ec2.delete_volumes(newvols)
-            except Exception as E:
-                self.log.warning(red('{0}\nIgnoring the following error '
-                                     'while deleting volumes: '
-                                     '{1}'.format(get_traceback(), E)))
-            self.status('Deleting Delta snapshot from this test iteration #{0}...'
-                        .format(test_num))
-            try:
-                new_snap.delete()
-            except Exception as SE:
-                self.log.error('{0}\nIgnoring error during snapshot:{1} delete, err:{2}'.
-                               format(get_traceback(), new_snap.id, SE))
+                    self.log.warning(red('{0}\nIgnoring the following error while showing volumes: '
+                                         '{1}'.format(get_traceback(), E)))
+                self.status('Writing data to original volume for test iteration:{0}'
+                            .format(test_num))
+                write_random_stuff_to_original_volume(rand_seek=True)
+                self.status('Start volume md5:{0} for iteration:{1}'.format(start_volume.md5,
+                                                                            test_num))
+                new_snap = self.user.ec2.create_snapshot_from_volume(
+                    start_volume, description="ebstest", wait_on_progress=wait_on_progress)
+                self.user.ec2.create_tags(new_snap.id, {'TESTID': self.testid})
+                newvols = []
+                for zone in zonelist:
+                    self.status('Beginning ZONE{0}/{1}: zone name:{2}, test iteration:{3}'
+                                .format(zonelist.index(zone) + 1 , len(zonelist), zone, test_num))
+                    instance = zone.instances[0]
+                    self.log.debug("Creating volume from snap:" + str(new_snap.id))
+                    newvol = self.user.ec2.create_volume(zone.name, size=0, snapshot=new_snap,
+                                                         timepergig=time_per_gb)
+                    self.user.ec2.create_tags(newvol.id, {'TESTID': self.testid})
+                    newvols.append(newvol)
+                    test_volumes.append(newvol)
+                    newvol.add_tag('ebstestsuite_created_test#{0}'.format(test_num))
+                    newvol.md5len = None
+                    zone.volumes.append(newvol)
+                    new_snap.eutest_volumes.append(newvol)
+                    instance.attach_euvolume(newvol)
+                    newvol.md5 = None
+                    newvol.md5len = None
+                    instance.md5_attached_euvolume(newvol, timepergig=300, length=None)
+                    report.add_row({'snapshot': new_snap, 'volume': newvol}, iteration=test_num,
+                                   zone=zone.name, volume=newvol.id)
+                    self.status('MD5 volume:{0} for test zone:{1}, iteration:{2}'
+                                .format(newvol.id, zone, test_num))
+                    self.user.ec2.show_volumes([start_volume, newvol])
+                    if newvol.md5 != start_volume.md5:
+                        self.log.error(red('Error md5 does not match, printing debug...'))
+                        self.status('head for new vol...')
+                        instance.sys('head -100 {0}'.format(newvol.guest_dev))
+                        self.status('head for new starting vol...')
+                        start_instance.sys('head -100 {0}'.format(start_volume.guestdev))
+                        raise ValueError('Newvol:{0} md5:{1} != origvol:{2} md5:{3}'
+                                         .format(newvol.id, newvol.md5, start_volume.id,
+                                                 start_volume.md5))
+                    if newvol.md5 in previous_md5s:
+                        self.log.error(red('Error md5 is a dup, printing debug...'))
+                        self.status('head for new vol...')
+                        instance.sys('head -100 {0}'.format(newvol.guest_dev))
+                        self.status('head for new starting vol...')
+                        start_instance.sys('head -100 {0}'.format(start_volume.guestdev))
+                        raise ValueError('test#{0}, current vol:{1} md5sum matches a previous '
+                                         'test:{2}, md5:{3}'
+                                         .format(newvol.md5, previous_md5s.index(newvol.md5)))
+                    self.status('Zone:{0} iteration:{1} PASSED '.format(zone, test_num))
+
+                self.status('Deleting volumes from this test iteration #{0}...'.format(test_num))
+                for vol in newvols:
+                    try:
+                        self.user.ec2.detach_volume(vol)
+                    except Exception as E:
+                        self.log.warning(
+                            red('{0}\nIgnoring the following error while detaching volumes: '
+                                '{1}'.format(get_traceback(), E)))
+                try:
+                    self.user.ec2.delete_volumes(newvols)
+                except Exception as E:
+                    self.log.warning(red('{0}\nIgnoring the following error '
+                                         'while deleting volumes: '
+                                         '{1}'.format(get_traceback(), E)))
+                self.status('Deleting Delta snapshot from this test iteration #{0}...'
+                            .format(test_num))
+                try:
+                    new_snap.delete()
+                except Exception as SE:
+                    self.log.error('{0}\nIgnoring error during snapshot:{1} delete, err:{2}'.
+                                   format(get_traceback(), new_snap.id, SE))
+
+                self.status('Done with test iteration:{0}, storing md5:{0} in list now'
+                            .format(test_num, start_volume.md5))
+                previous_md5s.append(start_volume.md5)
+                self.save_phase_report(report, show=False)
+        finally:
+            self.save_phase_report(report)
 
-            self.status('Done with test iteration:{0}, storing md5:{0} in list now'
-                        .format(test_num, start_volume.md5))
-            previous_md5s.append(start_volume.md5)
 
 
 
 
+    def save_phase_report(self, report, show=True):
+        """
+        Shows a PhaseTimingReport and writes it to the --phase-times-dir if provided.
+        """
+        if show:
+            report.show(printmethod=self.log.info)
+        if self.args.phase_times_dir:
+            if not os.path.isdir(self.args.phase_times_dir):
+                os.makedirs(self.args.phase_times_dir)
+            path = os.path.join(self.args.phase_times_dir,
+                                '{0}_phase_times.json'.format(report.name))
+            report.write_json(path)
+            self.log.debug('Wrote phase times to:{0}'.format(path))
 
     def create_snapshots_all_vols_in_zone(self, zonelist=None, volstate="all",
                                           wait_on_progress=None):
@@ -883,51 +947,55 @@ class LegacyEbsTestSuite(CliTestRunner):
         zonelist = zonelist or self.zonelist
         if not zonelist:
             raise Exception("attach_new_vols_from_snap_verify_md5: Zonelist is empty")
-        for zone in zonelist:
-            self.log.debug("checking zone:"+zone.name)
-
-            if not self.snaps:
-                raise Exception('attach_new_vols_from_snap_verify_md5: self.snaps is None')
-            for snap in self.snaps:
-                self.log.debug("Checking volumes associated with snap:"+snap.id)
-                if not snap.eutest_volumes:
-                    raise Exception('attach_new_vols_from_snap_verify_md5: snap "{0}"eutest_'
-                                    'volumes is None'.format(snap.id))
-                i = 0
-                for vol in snap.eutest_volumes:
-                    self.log.debug("Checking volume:"+vol.id+" status:"+vol.status)
-                    if (vol.zone == zone.name) and (vol.status == "available"):
-                        if i > len(zone.instances)-1:
-                            i = 0
-                        instance = zone.instances[i]
-                        try:
-                            instance.attach_euvolume(vol, md5_len=self.md5len, write_len=self.md5len, timeout=timeout)
-                        except VolumeStateException, vse:
-                            self.log.warning(red("This is a temp work around for testing, this "
-                                                 "is to avoid bug euca-5297:\n{0}".format(vse)))
-                            time.sleep(10)
-                            self.log.warning('Monitoring volume post VolumeStateException...')
-                            vol.eutest_attached_status = None
-                            self.user.ec2.monitor_euvolumes_to_status([vol], status='in-use',
-                                                                      attached_status='attached',
-                                                                      timeout=60)
-                        except Exception, e:
-                            self.log.error(red("Failed to attach volume:'{0}' to instance:'{1}'"
-                                           .format(vol.id, instance.id)))
-                            raise e
-                        instance.md5_attached_euvolume(vol, timepergig=timepergig)
-                        if vol.md5 != snap.eutest_volume_md5:
-                            self.log.error("snap:" + str(snap.eutest_volume_md5) +
-                                           " vs vol:" + str(vol.md5))
-                            self.log.error("Volume:" + str(vol.id) + " MD5:" + str(vol.md5) +
-                                           " != Snap:" + str(snap.id) + " MD5:" +
-                                           str(snap.eutest_volume_md5))
-                            raise Exception("Volume:" + str(vol.id) + " MD5:" + str(vol.md5) +
-                                            " != Snap:" + str(snap.id) + " MD5:" +
-                                            str(snap.eutest_volume_md5))
-                        self.log.debug("Successfully verified volume:" + str(vol.id) +
-                                       " to snapshot:" + str(snap.id))
-                        i += 1
+        # Write the md5 tags of all the volumes in batched requests
+        with self.user.ec2.tag_batch():
+            for zone in zonelist:
+                self.log.debug("checking zone:"+zone.name)
+
+                if not self.snaps:
+                    raise Exception('attach_new_vols_from_snap_verify_md5: self.snaps is None')
+                for snap in self.snaps:
+                    self.log.debug("Checking volumes associated with snap:"+snap.id)
+                    if not snap.eutest_volumes:
+                        raise Exception('attach_new_vols_from_snap_verify_md5: snap "{0}"eutest_'
+                                        'volumes is None'.format(snap.id))
+                    i = 0
+                    for vol in snap.eutest_volumes:
+                        self.log.debug("Checking volume:"+vol.id+" status:"+vol.status)
+                        if (vol.zone == zone.name) and (vol.status == "available"):
+                            if i > len(zone.instances)-1:
+                                i = 0
+                            instance = zone.instances[i]
+                            try:
+                                instance.attach_euvolume(vol, md5_len=self.md5len, write_len=self.md5len, timeout=timeout)
+                            except VolumeStateException, vse:
+                                self.log.warning(red("This is a temp work around for testing, this "
+                                                     "is to avoid bug euca-5297:\n{0}".format(vse)))
+                                time.sleep(10)
+                                self.log.warning('Monitoring volume post VolumeStateException...')
+                                vol.eutest_attached_status = None
+                                self.user.ec2.monitor_euvolumes_to_status([vol], status='in-use',
+                                                                          attached_status='attached',
+                                                                          timeout=60)
+                            except Exception, e:
+                                self.log.error(red("Failed to attach volume:'{0}' to instance:'{1}'"
+                                               .format(vol.id, instance.id)))
+                                raise e
+                            instance.md5_attached_euvolume(
+                                vol, timepergig=timepergig,
+                                chunk_manifest=snap.eutest_volume_chunk_manifest)
+                            if vol.md5 != snap.eutest_volume_md5:
+                                self.log.error("snap:" + str(snap.eutest_volume_md5) +
+                                               " vs vol:" + str(vol.md5))
+                                self.log.error("Volume:" + str(vol.id) + " MD5:" + str(vol.md5) +
+                                               " != Snap:" + str(snap.id) + " MD5:" +
+                                               str(snap.eutest_volume_md5))
+                                raise Exception("Volume:" + str(vol.id) + " MD5:" + str(vol.md5) +
+                                                " != Snap:" + str(snap.id) + " MD5:" +
+                                                str(snap.eutest_volume_md5))
+                            self.log.debug("Successfully verified volume:" + str(vol.id) +
+                                           " to snapshot:" + str(snap.id))
+                            i += 1
 
     def create_vols_from_snap_in_different_zone(self, zonelist=None, timepergig=300):
         """
@@ -1031,6 +1099,8 @@ class LegacyEbsTestSuite(CliTestRunner):
                     if origvol.md5 != newvol.md5:
                         raise Exception('New volume:{0} md5:"{1}" != "{2}" original volume:{3}'
                                         .format(newvol.id, newvol.md5, origvol.md5, origvol.id))
+                    elif getattr(origvol, 'chunk_manifest', None):
+                        instance.verify_volume_chunks(newvol, manifest=origvol.chunk_manifest)
                     else:
                         self.log.debug("Success. New volume:" + str(newvol.id) +
                                        "'s md5:" + str(newvol.md5) + " ==  original volume:" +
@@ -1096,6 +1166,8 @@ class LegacyEbsTestSuite(CliTestRunner):
                                                            "to run test")
         vols = []
         instances = []
+        report = PhaseTimingReport('concurrent_consecutive_volumes_from_snap_verify_md5',
+                                   CHAIN_PHASE_COLUMNS, log=self.log)
         try:
             for zone in zonelist:
                 self.status('STARTING ZONE:'+str(zone.name))
@@ -1144,9 +1216,13 @@ class LegacyEbsTestSuite(CliTestRunner):
                             self.log.debug("Success. New volume:" + str(newvol.id) +
                                            "'s md5:" + str(newvol.md5) + " ==  original volume:" +
                                            str(snap.volume_id) + "'s md5:" + str(origmd5))
+                        report.add_row({'snapshot': snap, 'volume': newvol}, count=count,
+                                       order=newvol.eutest_createorder, zone=zone.name,
+                                       volume=newvol.id)
                         instance.detach_euvolume(newvol)
 
         finally:
+            self.save_phase_report(report)
             self.log.debug("Attempting to cleanup/delete snapshots and volumes from this test...")
             for instance in instances:
                 for avol in instance.attached_vols:
@@ -2,6 +2,7 @@
 import random
 
 from nephoria.testcase_utils.cli_test_runner import CliTestRunner, SkipTestException
+from nephoria.testcase_utils.artifact_cache import artifact_key, get_url_validators
 from nephoria.testcontroller import TestController
 import copy
 import time
@@ -15,6 +16,14 @@ class LoadBfebsImage(CliTestRunner):
                                       'kwargs': {'help': 'URL of the image',
                                                  'default': None}
                                       }
+    _DEFAULT_CLI_ARGS['no_snapshot_cache'] = {
+        'args': ['--no-snapshot-cache'],
+        'kwargs': {'help': 'Always download the image into a new volume, rather than '
+                           'registering a snapshot left by a previous run of the same, '
+                           'unchanged, image url',
+                   'action': 'store_true',
+                   'default': False}}
+
     def post_init(self):
         self.created_image = None
 
@@ -103,13 +112,51 @@ class LoadBfebsImage(CliTestRunner):
                       'MADE PUBLIC EMI: {0}'
                       '\n---------------------------'.format(emi))
 
+    def get_image_artifact_key(self, url=None):
+        """
+        Returns the artifact cache key for the image url, derived from the url and the
+        ETag/Last-Modified headers of its current content.
+        """
+        url = url or self.args.image_url
+        try:
+            validators = get_url_validators(url)
+        except Exception as E:
+            self.log.warning('Could not get validators for url:"{0}", err:"{1}"'.format(url, E))
+            return None
+        if not (validators.get('etag') or validators.get('last_modified')):
+            return None
+        return artifact_key(url, validators=validators)
+
+    def get_cached_image_snapshot(self, key):
+        """
+        Returns a completed snapshot written from the same image content by a previous run,
+        or None.
+        """
+        if not key:
+            return None
+        for snapshot in self.user.ec2.get_snapshots(filters={'tag:artifact_key': key}) or []:
+            if snapshot.status == 'completed':
+                return snapshot
+        return None
+
     def test1_build_ebs_backed_image_in_vm(self):
         """
         Attempts to run the number of instances provided by the vm_count param
+        If a snapshot of the same image content exists from a previous run, the image is
+        registered from it instead of downloading the image again (see --no-snapshot-cache).
         """
         self.log.debug(type(self.args.image_url))
         if not self.args.image_url:
             raise Exception("No image url passed to run BFEBS tests")
+        key = self.get_image_artifact_key()
+        if not self.args.no_snapshot_cache:
+            snapshot = self.get_cached_image_snapshot(key)
+            if snapshot:
+                self.status('Found snapshot:{0} of unchanged image url:"{1}", registering it '
+                            'instead of downloading the image'
+                            .format(snapshot.id, self.args.image_url))
+                self.created_image = self.user.ec2.register_snapshot(snapshot)
+                return
 
         zone = self.args.zone
         zones = self.user.ec2.get_zone_names() or []
@@ -128,6 +175,9 @@ class LoadBfebsImage(CliTestRunner):
             volume_device = instance.attach_volume(volume_1)
             instance.sys("curl " + self.args.image_url + " > " + volume_device, timeout=800, code=0)
             snapshot = self.user.ec2.create_snapshot(volume_1.id)
+            if key:
+                self.user.ec2.create_tags([snapshot.id], {'artifact_key': key,
+                                                          'src_url': self.args.image_url})
             self.created_image = self.user.ec2.register_snapshot(snapshot)
         self.user.ec2.terminate_instances(instances)
 
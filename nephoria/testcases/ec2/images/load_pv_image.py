@@ -185,6 +185,19 @@ class Load_Pv_Image(CliTestRunner):
         'kwargs': { 'default': 300,
                     'help': 'Time allowed per image size in GB before timing out.' }}
 
+    _DEFAULT_CLI_ARGS['artifact_cache_dir'] = {
+        'args': ['--artifact-cache-dir'],
+        'kwargs': {'help': 'Directory on the worker machine to cache downloaded images in. '
+                           'Repeat runs using an unchanged image url skip the download',
+                   'default': None}}
+
+    _DEFAULT_CLI_ARGS['artifact_cache_gb'] = {
+        'args': ['--artifact-cache-gb'],
+        'kwargs': {'help': 'Max size in GB of the artifact cache, least recently used images '
+                           'are removed first',
+                   'type': float,
+                   'default': 50}}
+
     _DEFAULT_CLI_ARGS['remove_created_images'] = {
         'args': ['--remove-created-images'],
         'kwargs': { 'action': 'store_true',
@@ -110,6 +110,7 @@ from nephoria.testcase_utils.cli_test_runner import CliTestRunner, SkipTestExcep
 from nephoria.testcase_utils import wait_for_result, WaitForResultException
 from nephoria.testcontroller import TestController
 from nephoria.aws.ec2.euinstance import EuInstance
+from nephoria.aws.ec2.ssh_tunnel import SshTunnelCache
 from cloud_utils.net_utils.sshconnection import SshConnection
 from cloud_utils.net_utils.sshconnection import CommandExitCodeException, CommandTimeoutException
 from cloud_utils.log_utils import red, get_traceback
@@ -161,8 +162,22 @@ class NetTestsClassic(CliTestRunner):
                    'default': False,
                    'help': 'If set, will attempt to dump mido client debug for failures'}}
 
+    _DEFAULT_CLI_ARGS['no_tunnel_cache'] = {
+        'args': ['--no-tunnel-cache'],
+        'kwargs': {'action': 'store_true',
+                   'default': False,
+                   'help': 'If set, ssh connections to instance private ips will each proxy '
+                           'through a new cc connection instead of sharing cached tunnels'}}
+
     def post_init(self, *args, **kwargs):
         self.cc_last_checked = time.time()
+        self._tunnels = None
+
+    @property
+    def tunnels(self):
+        if not getattr(self, '_tunnels', None):
+            self._tunnels = SshTunnelCache(log=self.log)
+        return self._tunnels
 
     @property
     def subnet_id(self):
@@ -397,6 +412,10 @@ class NetTestsClassic(CliTestRunner):
 
 
     def clean_method(self):
+        tunnels = getattr(self, '_tunnels', None)
+        if tunnels:
+            tunnels.show_stats(printmethod=self.log.debug)
+            tunnels.close()
         if self.args.no_clean:
             self.status('No clean flag set, not cleaning test resources')
         else:
@@ -538,18 +557,26 @@ class NetTestsClassic(CliTestRunner):
                        'through the cc ip:' + str(proxy_machine.hostname) + ', attempts:' +str(attempts) + "/" + str(retry) +
                        ", elapsed:" + str(elapsed))
             try:
-                ssh = SshConnection(host=instance.private_ip_address,
-                                keypath=instance.keypath,
-                                proxy=proxy_machine.hostname,
-                                proxy_username=proxy_machine.ssh.username,
-                                proxy_password=proxy_machine.ssh.password,
-                                proxy_keypath=proxy_keypath)
+                if getattr(self.args, 'no_tunnel_cache', False):
+                    ssh = SshConnection(host=instance.private_ip_address,
+                                    keypath=instance.keypath,
+                                    proxy=proxy_machine.hostname,
+                                    proxy_username=proxy_machine.ssh.username,
+                                    proxy_password=proxy_machine.ssh.password,
+                                    proxy_keypath=proxy_keypath)
+                else:
+                    # Reuse one transport to the proxy machine for all instances behind it
+                    ssh = self.tunnels.get_ssh_connection(
+                        jump_host=proxy_machine.hostname, jump_ssh=proxy_machine.ssh,
+                        host=instance.private_ip_address,
+                        username=getattr(instance, 'username', None) or 'root',
+                        keypath=instance.keypath)
             except Exception, ce:
                 tb = get_traceback()
                 if attempts >= retry:
                     self.log.debug("\n{0}".format(tb))
                 self.log.debug('Failed to connect error:' + str(ce))
-            if attempts < retry:
+            if not ssh and attempts < retry:
                     time.sleep(next_retry_time)
 
         if not ssh:
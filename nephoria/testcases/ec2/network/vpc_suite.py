@@ -2639,9 +2639,11 @@ class VpcSuite(CliTestRunner):
             #vm_rx.sys('ip link set name {0} dev dummy0'.format(ethdummy), code=0)
             vm_rx.sys('ifconfig {0} {1}'.format(ethdummy, test_ip), code=0)
             vm_rx.sys('ifconfig {0} up'.format(ethdummy), code=0)
+            vm_rx.invalidate_network_inventory()
         except CommandExitCodeException as CE:
             if ethdummy:
                 vm_rx.sys('ifconfig {0} down'.format(ethdummy))
+                vm_rx.invalidate_network_inventory()
             self.log.error('Could not create test network interface on vm_rx:{0}, err:{1}'
                            .format(vm_rx.id, CE))
             raise CE
@@ -2743,6 +2745,7 @@ class VpcSuite(CliTestRunner):
 
         finally:
             vm_rx.sys('ifconfig {0} down'.format(ethdummy, test_ip))
+            vm_rx.invalidate_network_inventory()
 
     def test4b12_route_table_instance_id_with_multiple_eni_test(self,
                                                                 test_route='192.168.191.0/24',
@@ -2971,9 +2974,11 @@ class VpcSuite(CliTestRunner):
             vm_rx.sys('ip link set name {0} dev dummy0'.format(ethdummy), code=0)
             vm_rx.sys('ifconfig {0} {1}'.format(ethdummy, test_ip), code=0)
             vm_rx.sys('ifconfig {0} up'.format(ethdummy), code=0)
+            vm_rx.invalidate_network_inventory()
         except CommandExitCodeException as CE:
             if ethdummy:
                 vm_rx.sys('ifconfig {0} down'.format(ethdummy))
+                vm_rx.invalidate_network_inventory()
             self.log.error('Could not create test network interface on vm_rx:{0}, err:{1}'
                            .format(vm_rx.id, CE))
             raise CE
@@ -3080,6 +3085,7 @@ class VpcSuite(CliTestRunner):
                                    .format(attempt, elapsed, timeout))
         finally:
             vm_rx.sys('ifconfig {0} down'.format(virt_eth, test_ip))
+            vm_rx.invalidate_network_inventory()
             if vpc:
                 user.ec2.delete_vpc_and_dependency_artifacts(vpc)
         self.status('Test Completed Successfully')
@@ -4551,6 +4557,7 @@ class VpcSuite(CliTestRunner):
         def bring_vm_primary_interface_up(vm, vm_ssh):
             status('Bringing up primary interface for:{0}'.format(vm.id))
             vm_ssh.sys('ifconfig {0} up'.format(vm.primary_dev), code=0, verbose=True)
+            vm.invalidate_network_inventory()
             vm.ssh = vm_ssh
             status('Syncing ENI info for vm:{0}...'.format(vm.id))
             vm.sync_enis_static_ip_config(exclude_indexes=[1,2])
@@ -4643,6 +4650,7 @@ class VpcSuite(CliTestRunner):
                         vm.sys('ifconfig {0} down'.format(dev_name), code=0, timeout=2)
                     except CommandTimeoutException:
                         pass
+                    vm.invalidate_network_inventory()
                 status('Creating new ssh sessions to vm1 and vm2 through proxy VM3:{0}'
                             .format(proxyvm.id))
                 vm1_ssh = SshConnection(host=vm1.interfaces[1].private_ip_address,
@@ -4693,6 +4701,7 @@ class VpcSuite(CliTestRunner):
                                verbose=True)
                     except CommandTimeoutException:
                         pass
+                    vm.invalidate_network_inventory()
 
                 status('ENIS have been swapped. Attempting to establish ssh sessions'
                             'to new secondary ENI attachments through proxy vm...')
@@ -4737,6 +4746,7 @@ class VpcSuite(CliTestRunner):
                         vm.sys('ifconfig {0} down'.format(vm.primary_dev), code=0, timeout=2)
                     except CommandTimeoutException:
                         pass
+                    vm.invalidate_network_inventory()
                 status('ENIS have been swapped. Attempting to establish ssh sessions'
                             'to new ENI attachments...')
                 try:
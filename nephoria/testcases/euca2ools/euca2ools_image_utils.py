@@ -42,6 +42,7 @@ from cloud_utils.log_utils import TextStyle, ForegroundColor, BackGroundColor, m
     get_traceback
 from nephoria.aws.ec2.conversiontask import ConversionTask
 from nephoria.usercontext import UserContext
+from nephoria.testcase_utils.artifact_cache import ArtifactCache
 
 
 class Euca2oolsImageUtils(object):
@@ -53,7 +54,8 @@ class Euca2oolsImageUtils(object):
                  s3_url=None, ec2_url=None, bootstrap_url=None, ec2_cert_path=None,
                  worker_hostname=None, worker_keypath=None, worker_username='root',
                  worker_password=None, worker_machine=None, user_context=None, log_level='debug',
-                 destpath=None, time_per_gig=300, eof=True):
+                 destpath=None, time_per_gig=300, eof=True, artifact_cache_dir=None,
+                 artifact_cache_gb=50):
         
         self.access_key = access_key
         self.secret_key = secret_key
@@ -85,6 +87,10 @@ class Euca2oolsImageUtils(object):
             self.destpath = "/disk1/storage"
 
         self.time_per_gig = time_per_gig
+        # Optional persistent cache of downloaded images on the worker machine
+        self.artifact_cache_dir = artifact_cache_dir
+        self.artifact_cache_gb = artifact_cache_gb
+        self._artifact_cache = None
         
     def status_log(self, msg):
         return self.log.info(markup(msg, 
@@ -122,6 +128,19 @@ class Euca2oolsImageUtils(object):
             raise ValueError('worker_machine must be of type Machine, got:"{0}/{1}"'
                              .format(machine, type(machine)))
 
+    @property
+    def artifact_cache(self):
+        '''
+        ArtifactCache on the worker machine, or None if no artifact_cache_dir was provided
+        '''
+        if not self._artifact_cache and self.artifact_cache_dir:
+            self._artifact_cache = ArtifactCache(machine=self.worker_machine,
+                                                 cache_dir=self.artifact_cache_dir,
+                                                 max_gb=self.artifact_cache_gb,
+                                                 time_per_gig=self.time_per_gig,
+                                                 log=self.log)
+        return self._artifact_cache
+
     def create_user_context(self, access_key, secret_key, account_id=None,
                             region_domain=None, ec2_url=None, s3_url=None, bootstrap_url=None):
         if not (region_domain or s3_url or ec2_url):
@@ -261,9 +280,13 @@ class Euca2oolsImageUtils(object):
                    password=None,
                    create_path=True,
                    retryconn=True,
-                   time_per_gig=300):
+                   time_per_gig=300,
+                   checksum=None,
+                   use_cache=True):
         '''
         Attempts to wget a url to a remote (worker) machine.
+        If an artifact cache is configured the image is fetched through it, repeat downloads of
+        an unchanged url are then served from the cache and linked into destpath.
         :param image_url: url to wget/download
         :param destpath:path/dir to download to
         :param dest_file_name: filename to download image to
@@ -272,6 +295,8 @@ class Euca2oolsImageUtils(object):
         :param password: wget password
         :param retryconn: boolean to retry connection
         :param time_per_gig: int time to allow per gig of image wget'd
+        :param checksum: optional md5 of the image, used to key and verify the cached copy
+        :param use_cache: boolean, use the artifact cache if one is configured
         :returns int size of image
         '''
         machine = machine or self.worker_machine
@@ -287,9 +312,19 @@ class Euca2oolsImageUtils(object):
                                  'is:{1}'.format(destpath, create_path))
 
         size = self.getHttpRemoteImageSize(image_url)
+        # Also checked for cached images, the cache falls back to copying into destpath
         if (size > machine.get_available(destpath, unit=(self.gig/self.kb))):
             raise Exception("Not enough available space at: " +
                             str(destpath) + ", for image: " + str(image_url))
+        cache = self.artifact_cache
+        if use_cache and cache and machine == cache.machine:
+            dest_file_name = dest_file_name or str(image_url).split('/')[-1]
+            saved_location = "{0}/{1}".format(destpath.rstrip('/'), dest_file_name)
+            self.log.debug('wget_image: ' + str(image_url) + ' via artifact cache:' + str(cache) +
+                           ' to ' + str(saved_location))
+            cache.link_to(image_url, saved_location, checksum=checksum, user=user,
+                          password=password)
+            return (size, saved_location)
         timeout = size * time_per_gig
         self.log.debug('wget_image: ' + str(image_url) + ' to destpath' +
                        str(destpath) + ' on machine:' + str(machine.hostname))
@@ -7,10 +7,14 @@ import tempfile
 import os
 from concurrent.futures.thread import ThreadPoolExecutor
 from math import ceil
+import string
 
 from nephoria.testcase_utils.cli_test_runner import CliTestRunner, SkipTestException
+from nephoria.testcase_utils.loadgen import OpenLoopScheduler, MultiProcessLoadDriver
+from nephoria.testcase_utils.perf_log import PerfEventLog
 from nephoria.testcontroller import TestController
 import copy
+import random
 import time
 
 
@@ -46,6 +50,77 @@ class OSGConcurrentTests(CliTestRunner):
                            'Default value is used when not passed as an argument.'}
     }
 
+    _DEFAULT_CLI_ARGS['perf_log'] = {
+        'args': ['--perf-log'],
+        'kwargs': {'dest': 'perf_log', 'default': 'osg_perf.jsonl',
+                   'help': 'File to write per operation perf events to (json lines with '
+                           'monotonic timestamps). Events are buffered and written in batches '
+                           'by a background thread. Summaries are still written to osg_perf.log'}
+    }
+
+    _DEFAULT_CLI_ARGS['processes'] = {
+        'args': ['--processes'],
+        'kwargs': {'dest': 'processes', 'default': 1, 'type': int,
+                   'help': 'Number of processes to spread the upload and get workers across. '
+                           'Each process uses its own connections and runs --threads threads, '
+                           'stats are merged by the parent process'}
+    }
+
+    _DEFAULT_CLI_ARGS['list_threads'] = {
+        'args': ['--list-threads'],
+        'kwargs': {'dest': 'list_threads', 'default': 10, 'type': int,
+                   'help': 'Number of bucket listing partitions to list concurrently'}
+    }
+    # Object names are tempfile names, these are the characters tempfile uses after the prefix
+    _DEFAULT_CLI_ARGS['list_split_chars'] = {
+        'args': ['--list-split-chars'],
+        'kwargs': {'dest': 'list_split_chars',
+                   'default': string.ascii_lowercase + string.digits + '_',
+                   'help': 'Characters to split the bucket listing into key ranges on, '
+                           'empty to partition by delimiter instead'}
+    }
+
+    _DEFAULT_CLI_ARGS['rate'] = {
+        'args': ['--rate'],
+        'kwargs': {'dest': 'rate', 'default': None, 'type': float,
+                   'help': 'Target rate in ops/sec for the open-loop test. Operations are issued '
+                           'on schedule regardless of how long previous requests take, and '
+                           'latency is measured from the intended start time. '
+                           'The open-loop test is skipped unless this is provided.'}
+    }
+
+    _DEFAULT_CLI_ARGS['arrival'] = {
+        'args': ['--arrival'],
+        'kwargs': {'dest': 'arrival', 'default': OpenLoopScheduler.CONSTANT,
+                   'choices': OpenLoopScheduler.ARRIVALS,
+                   'help': 'Arrival distribution of open-loop operations'}
+    }
+
+    _DEFAULT_CLI_ARGS['duration'] = {
+        'args': ['--duration'],
+        'kwargs': {'dest': 'duration', 'default': 60, 'type': int,
+                   'help': 'Number of seconds to run each open-loop rate step'}
+    }
+
+    _DEFAULT_CLI_ARGS['ramp_step'] = {
+        'args': ['--ramp-step'],
+        'kwargs': {'dest': 'ramp_step', 'default': 0, 'type': float,
+                   'help': 'ops/sec added to the open-loop rate for each additional step'}
+    }
+
+    _DEFAULT_CLI_ARGS['ramp_steps'] = {
+        'args': ['--ramp-steps'],
+        'kwargs': {'dest': 'ramp_steps', 'default': 1, 'type': int,
+                   'help': 'Number of open-loop rate steps to run when searching for the '
+                           'saturation knee of the gateway'}
+    }
+
+    _DEFAULT_CLI_ARGS['open_loop_op'] = {
+        'args': ['--open-loop-op'],
+        'kwargs': {'dest': 'open_loop_op', 'default': 'get', 'choices': ['get', 'put'],
+                   'help': 'Operation to issue during the open-loop test'}
+    }
+
     bucket_list = []
     temp_files = []
     total_put_latency = 0
@@ -77,6 +152,14 @@ class OSGConcurrentTests(CliTestRunner):
             setattr(self, '__user', user)
         return user
 
+    @property
+    def perf_log(self):
+        perf_log = getattr(self, '__perf_log', None)
+        if not perf_log:
+            perf_log = PerfEventLog(self.args.perf_log)
+            setattr(self, '__perf_log', perf_log)
+        return perf_log
+
     @property
     def bucket_prefix(self):
         bucket_prefix = getattr(self, '__bucket_prefix', None)
@@ -132,8 +215,7 @@ class OSGConcurrentTests(CliTestRunner):
             self.multipart_upload(bucket, key_name, eu_file)
         else:
             upload_time = self.time_to_exec(self.single_upload, bucket, key_name, eu_file.name)
-            with open('osg_perf.log', 'a') as f:
-                f.write('PUT\t' + str(upload_time) + '\n')
+            self.perf_log.record('PUT', upload_time)
         return True
 
     def time_to_exec(self, method, *args, **kwargs):
@@ -180,20 +262,70 @@ class OSGConcurrentTests(CliTestRunner):
         else:
             upload_time = self.time_to_exec(self.single_upload, bucket, key_name, eu_file.name)
             self.total_put_latency = self.total_put_latency + upload_time
-            with open('osg_perf.log', 'a') as f:
-                f.write('PUT\t\t' + str(upload_time) + '\n')
+            self.perf_log.record('PUT', upload_time)
             return True
 
+    def timed_op(self, reporter, op, method, *args, **kwargs):
+        start = time.time()
+        error = False
+        try:
+            method(*args, **kwargs)
+        except Exception as e:
+            error = True
+            self.log.error("Failed " + op + ": " + str(e))
+        reporter.record(op, time.time() - start, error=error)
+
+    def process_upload_bucket(self, s3, bucket_name, executor, reporter):
+        bucket = s3.connection.get_bucket(bucket_name, validate=False)
+        eu_file = self.temp_files[-1]
+        for k in range(self.args.objects):
+            executor.submit(self.timed_op, reporter, 'PUT', self.single_upload, bucket,
+                            eu_file.name + '-' + str(k), eu_file.name)
+
+    def process_get_bucket(self, s3, bucket_name, executor, reporter):
+        bucket = s3.connection.get_bucket(bucket_name, validate=False)
+        for key in bucket.list():
+            executor.submit(self.timed_op, reporter, 'GET', self.get_content, key)
+
+    def run_in_processes(self, bucket_method):
+        """
+        Spreads the test buckets across --processes worker processes. Each process creates its
+        own S3 connection and runs bucket_method(s3, bucket_name, executor, reporter) for its
+        share of the buckets using a pool of --threads threads. The per process stats are
+        merged by the parent and written to the perf log.
+        """
+        def worker(worker_id, reporter):
+            s3 = self.tc.admin.s3
+            s3.reset_connections()
+            with ThreadPoolExecutor(max_workers=self.args.threads) as executor:
+                for bucket_name in self.bucket_list[worker_id::self.args.processes]:
+                    bucket_method(s3, bucket_name, executor, reporter)
+
+        driver = MultiProcessLoadDriver(worker, processes=self.args.processes, log=self.log)
+        collector = driver.run()
+        pt = collector.show(printmethod=self.log.info)
+        with open('osg_perf.log', 'a') as f:
+            f.write(str(self.args.processes) + ' processes x ' + str(self.args.threads) +
+                    ' threads\n' + str(pt) + '\n')
+        for error in collector.worker_errors:
+            self.log.error("Found exception in worker process: " + str(error))
+        return collector
+
     def test1_concurrent_upload(self):
         with open('osg_perf.log', 'w') as f:
-            f.write(str('OPS\t\t   Time   ') + '\n')
-            f.write(str('---\t\t----------') + '\n')
+            f.write('Per operation events: ' + self.perf_log.path + '\n')
         self.log.debug("Creating buckets..")
         self.create_buckets(self.args.buckets)
 
         self.log.debug("Creating object of " + str(self.args.object_size) + "KB")
         eu_file = open(self.create_file(self.args.object_size))
 
+        if self.args.processes > 1:
+            collector = self.run_in_processes(self.process_upload_bucket)
+            if 'PUT' in collector.histograms:
+                self.total_put_latency = collector.histograms['PUT'].total
+            return
+
         thread_pool = []
         with ThreadPoolExecutor(max_workers=self.args.threads) as executor:
             for bucket_name in self.bucket_list:
@@ -216,26 +348,34 @@ class OSGConcurrentTests(CliTestRunner):
             except Exception as e:
                 self.log.error("Found exception in thread-pool: " + e.message)
 
+    def list_buckets(self, callback):
+        """
+        Lists all the keys in the test buckets concurrently with max size pages, streaming each
+        key to the callback. Listing throughput is written to the perf log.
+        """
+        stats = self.tc.admin.s3.list_objects_concurrently(
+            self.bucket_list, callback, split_chars=self.args.list_split_chars or None,
+            max_workers=self.args.list_threads)
+        with open('osg_perf.log', 'a') as f:
+            f.write('LIST\t\t' + str(stats['elapsed']) + '\t' + str(stats['keys']) + ' keys, ' +
+                    str(stats['keys_per_sec']) + ' keys/sec\n')
+        return stats
+
     def get_objects(self, key):
         download_time = self.time_to_exec(self.get_content, key)
         self.total_get_latency = self.total_get_latency + download_time
-        with open('osg_perf.log', 'a') as f:
-            f.write('GET\t\t' + str(download_time) + '\n')
+        self.perf_log.record('GET', download_time)
 
     def test2_get_objects(self):
+        if self.args.processes > 1:
+            collector = self.run_in_processes(self.process_get_bucket)
+            if 'GET' in collector.histograms:
+                self.total_get_latency = collector.histograms['GET'].total
+            return
         get_thread_pool = []
         with ThreadPoolExecutor(max_workers=self.args.threads) as executor:
-            for bucket_name in self.bucket_list:
-                bucket = self.tc.admin.s3.get_bucket_by_name(bucket_name)
-                max_keys = 10
-                keys = bucket.get_all_keys(max_keys=max_keys)
-                for key in keys:
-                    get_thread_pool.append(executor.submit(self.get_objects, key))
-                while keys.next_marker:
-                    self.log.debug("found keys.next_marker: " + keys.next_marker)
-                    keys = bucket.get_all_keys(marker=keys.next_marker)
-                    for key in keys:
-                        get_thread_pool.append(executor.submit(self.get_objects, key))
+            self.list_buckets(lambda key: get_thread_pool.append(
+                executor.submit(self.get_objects, key)))
         self.log.debug("len(get_thread_pool): " + str(len(get_thread_pool)))
 
         lock_time = 2
@@ -244,29 +384,28 @@ class OSGConcurrentTests(CliTestRunner):
             self.log.warning("Uncanny lock, sleeping for " + str(lock_time) + " seconds.")
             time.sleep(lock_time)
 
+    def test2a_list_objects(self):
+        """
+        Benchmark listing the test buckets on its own, keys are counted but not fetched.
+        """
+        stats = self.list_buckets(lambda key: None)
+        self.log.info('Listed {0} keys from {1} buckets in {2:.2f} seconds, {3:.2f} keys/sec'
+                      .format(stats['keys'], len(self.bucket_list), stats['elapsed'],
+                              stats['keys_per_sec']))
+
     def delete_key(self, key):
         self.log.debug('deleting key: ' + key.name)
         delete_time = self.time_to_exec(key.delete)
         self.total_del_latency = self.total_del_latency + delete_time
-        with open('osg_perf.log', 'a') as f:
-            f.write('DEL\t\t' + str(delete_time) + '\n')
+        self.perf_log.record('DEL', delete_time)
         return True
 
     def test3_delete_objects(self):
         clean_thread_pool = []
 
         with ThreadPoolExecutor(max_workers=self.args.threads) as executor:
-            for bucket_name in self.bucket_list:
-                bucket = self.tc.admin.s3.get_bucket_by_name(bucket_name)
-                max_keys = 10
-                keys = bucket.get_all_keys(max_keys=max_keys)
-                for key in keys:
-                    clean_thread_pool.append(executor.submit(self.delete_key, key))
-                while keys.next_marker:
-                    self.log.debug("found keys.next_marker: " + keys.next_marker)
-                    keys = bucket.get_all_keys(marker=keys.next_marker)
-                    for key in keys:
-                        clean_thread_pool.append(executor.submit(self.delete_key, key))
+            self.list_buckets(lambda key: clean_thread_pool.append(
+                executor.submit(self.delete_key, key)))
 
         self.log.debug("len(clean_thread_pool): " + str(len(clean_thread_pool)))
         lock_time = 2
@@ -288,22 +427,76 @@ class OSGConcurrentTests(CliTestRunner):
             tf.close()
 
     def test4_calculate_average_latency(self):
+        self.perf_log.flush()
+        avg_put = self.total_put_latency / (self.args.objects * self.args.buckets)
+        avg_get = self.total_get_latency / (self.args.objects * self.args.buckets)
+        avg_del = self.total_del_latency / (self.args.objects * self.args.buckets)
         with open('osg_perf.log', 'a') as f:
             f.write('\n\n')
             f.write('  Average Latency  ' + '\n')
             f.write('-------------------' + '\n')
-        avg_put = self.total_put_latency / (self.args.objects * self.args.buckets)
-        with open('osg_perf.log', 'a') as f:
             f.write('Avg PUT\t\t' + str(avg_put) + '\n')
-        avg_get = self.total_get_latency / (self.args.objects * self.args.buckets)
-        with open('osg_perf.log', 'a') as f:
             f.write('Avg GET\t\t' + str(avg_get) + '\n')
-        avg_del = self.total_del_latency / (self.args.objects * self.args.buckets)
-        with open('osg_perf.log', 'a') as f:
             f.write('Avg DEL\t\t' + str(avg_del) + '\n')
 
+    def test5_open_loop_rate_ramp(self):
+        """
+        Open-loop (rate controlled) test. Issues GET or PUT operations at '--rate' ops/sec
+        using the '--arrival' distribution, stepping the rate up by '--ramp-step' for
+        '--ramp-steps' steps. Latency is measured from each operation's intended start time so
+        queueing delay at the gateway is not hidden when it falls behind.
+        """
+        if not self.args.rate:
+            raise SkipTestException('No --rate provided, skipping open-loop test')
+        s3 = self.tc.admin.s3
+        bucket_name = self.bucket_prefix + '-open-loop'
+        bucket = s3.connection.create_bucket(bucket_name)
+        eu_file = open(self.create_file(self.args.object_size))
+        key_names = []
+        try:
+            self.log.debug('Seeding {0} objects for open-loop test in bucket:{1}'
+                           .format(self.args.objects, bucket_name))
+            for k in range(self.args.objects):
+                key_name = 'open-loop-' + str(k)
+                self.single_upload(bucket, key_name, eu_file.name)
+                key_names.append(key_name)
+
+            def get_op():
+                bucket.get_key(random.choice(key_names), validate=False).get_contents_as_string()
+
+            def put_op():
+                self.single_upload(bucket, random.choice(key_names), eu_file.name)
+
+            operation = put_op if self.args.open_loop_op == 'put' else get_op
+            scheduler = OpenLoopScheduler(rate=self.args.rate,
+                                          duration=self.args.duration,
+                                          arrival=self.args.arrival,
+                                          max_workers=self.args.threads,
+                                          log=self.log)
+            results = scheduler.ramp(operation,
+                                     start_rate=self.args.rate,
+                                     step=self.args.ramp_step,
+                                     steps=self.args.ramp_steps)
+            pt = scheduler.show_ramp_results(results)
+            with open('osg_perf.log', 'a') as f:
+                f.write('\n\n')
+                f.write('  Open Loop ' + self.args.open_loop_op.upper() + ' (' +
+                        self.args.arrival + ')  ' + '\n')
+                f.write(str(pt) + '\n')
+            for result in results:
+                if result['errors']:
+                    self.log.error('{0} errors at target rate:{1}/sec'
+                                   .format(result['errors'], result['target_rate']))
+        finally:
+            for key in bucket.list():
+                key.delete()
+            s3.connection.delete_bucket(bucket_name)
+            eu_file.close()
+
     def clean_method(self):
-        pass
+        perf_log = getattr(self, '__perf_log', None)
+        if perf_log:
+            perf_log.close()
 
 if __name__ == "__main__":
     test = OSGConcurrentTests()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+Runs declarative S3 workload profiles (see nephoria.aws.s3.workload) against OSG.
+Profiles can be referenced by the name of a bundled profile in ./workload_profiles
+(ie 'small_get_heavy') or by the path to a YAML profile file. Results for each profile are
+shown as a table and can be written to a json file so runs against different gateway builds
+can be compared.
+
+Example:
+    osg_workload_test.py --clc 1.2.3.4 --profile small_get_heavy,put_heavy \
+        --results-file /tmp/osg_workload.json
+"""
+import copy
+import json
+import os
+
+from nephoria.aws.s3.workload import WorkloadProfile, S3WorkloadRunner
+from nephoria.testcase_utils.cli_test_runner import CliTestRunner, SkipTestException
+from nephoria.testcontroller import TestController
+
+
+PROFILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'workload_profiles')
+
+
+class OSGWorkloadTests(CliTestRunner):
+
+    _DEFAULT_CLI_ARGS = copy.copy(CliTestRunner._DEFAULT_CLI_ARGS)
+
+    _DEFAULT_CLI_ARGS['profile'] = {
+        'args': ['--profile'],
+        'kwargs': {'dest': 'profile', 'default': 'small_get_heavy',
+                   'help': 'Comma delimited list of workload profile names (from {0}) or paths '
+                           'to workload profile YAML files'.format(PROFILE_DIR)}
+    }
+
+    _DEFAULT_CLI_ARGS['duration'] = {
+        'args': ['--duration'],
+        'kwargs': {'dest': 'duration', 'default': None, 'type': int,
+                   'help': "Override the profile's duration in seconds"}
+    }
+
+    _DEFAULT_CLI_ARGS['rate'] = {
+        'args': ['--rate'],
+        'kwargs': {'dest': 'rate', 'default': None, 'type': float,
+                   'help': "Override the profile's target rate in ops/sec"}
+    }
+
+    _DEFAULT_CLI_ARGS['seed'] = {
+        'args': ['--seed'],
+        'kwargs': {'dest': 'seed', 'default': None, 'type': int,
+                   'help': 'Random seed used for operation, size and key choices'}
+    }
+
+    _DEFAULT_CLI_ARGS['results_file'] = {
+        'args': ['--results-file'],
+        'kwargs': {'dest': 'results_file', 'default': None,
+                   'help': 'Path to write json results for each profile run'}
+    }
+
+    @property
+    def tc(self):
+        tc = getattr(self, '__tc', None)
+        if not tc:
+            tc = TestController(self.args.clc,
+                                password=self.args.password,
+                                clouduser_name=self.args.test_user,
+                                clouduser_account=self.args.test_account,
+                                log_level=self.args.log_level)
+            setattr(self, '__tc', tc)
+        return tc
+
+    def get_profiles(self):
+        profiles = []
+        for name in str(self.args.profile).replace(',', ' ').split():
+            path = name
+            if not os.path.exists(path):
+                path = os.path.join(PROFILE_DIR, name)
+                if not path.endswith('.yaml'):
+                    path += '.yaml'
+            if not os.path.exists(path):
+                raise ValueError('Workload profile not found:"{0}", bundled profiles:"{1}"'
+                                 .format(name, ", ".join(sorted(os.listdir(PROFILE_DIR)))))
+            profile = WorkloadProfile.from_file(path)
+            if self.args.duration:
+                profile.duration = self.args.duration
+            if self.args.rate:
+                profile.rate = self.args.rate
+            profiles.append(profile)
+        return profiles
+
+    def test1_run_workload_profiles(self):
+        """
+        Runs each provided workload profile against the OSG using the admin s3 interface.
+        """
+        profiles = self.get_profiles()
+        if not profiles:
+            raise SkipTestException('No workload profiles provided')
+        all_results = []
+        failed = []
+        for profile in profiles:
+            runner = S3WorkloadRunner(self.tc.admin.s3, profile, log=self.log,
+                                      seed=self.args.seed)
+            results = runner.run()
+            runner.show_results(results)
+            all_results.append(runner.results_to_dict(results))
+            if results['errors']:
+                failed.append(profile.name)
+        if self.args.results_file:
+            with open(self.args.results_file, 'w') as f:
+                json.dump(all_results, f, indent=4, sort_keys=True)
+            self.log.debug('Wrote workload results to:{0}'.format(self.args.results_file))
+        if failed:
+            raise RuntimeError('Operation errors in workload profiles:"{0}"'
+                               .format(", ".join(failed)))
+
+    def clean_method(self):
+        pass
+
+if __name__ == "__main__":
+    test = OSGWorkloadTests()
+    test_result = test.run()
+    exit(test_result)
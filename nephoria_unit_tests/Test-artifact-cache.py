@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from BaseHTTPServer import HTTPServer
+from SimpleHTTPServer import SimpleHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from nephoria.testcase_utils.artifact_cache import ArtifactCache
+
+
+class ArtifactHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the server's in memory 'files' with an ETag and single open ended byte ranges,
+    which SimpleHTTPRequestHandler does not support. A GET of a path in 'truncate' is cut off
+    after that many bytes, once.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def _send_head(self):
+        entry = self.server.files.get(self.path)
+        if entry is None:
+            self.send_error(404)
+            return None, 0
+        data, etag = entry
+        offset = 0
+        rng = self.headers.getheader('range')
+        if rng and rng.startswith('bytes=') and rng.endswith('-'):
+            offset = int(rng[len('bytes='):-1])
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'
+                             .format(offset, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - offset))
+        self.send_header('ETag', etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        return data, offset
+
+    def do_HEAD(self):
+        self._send_head()
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.getheader('range')))
+        data, offset = self._send_head()
+        if data is None:
+            return
+        end = len(data)
+        cut = self.server.truncate.pop(self.path, None)
+        if cut is not None:
+            end = cut
+            self.close_connection = 1
+        self.wfile.write(data[offset:end])
+
+
+class ArtifactServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ArtifactCacheUnitTest(unittest.TestCase):
+    SIZE = 262144
+
+    def setUp(self):
+        self.server = ArtifactServer(('127.0.0.1', 0), ArtifactHandler)
+        self.server.files = {}
+        self.server.requests = []
+        self.server.truncate = {}
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.cache_dir = tempfile.mkdtemp(prefix='nephoria-artifact-cache')
+        self.cache = ArtifactCache(cache_dir=self.cache_dir, retries=3,
+                                   log=logging.getLogger('Test-artifact-cache'))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def add_file(self, path, etag):
+        data = os.urandom(self.SIZE)
+        self.server.files[path] = (data, etag)
+        return 'http://127.0.0.1:{0}{1}'.format(self.server.server_address[1], path), data
+
+    def get_requests(self, path):
+        return [r for r in self.server.requests if r[0] == path]
+
+    def assertCached(self, path, data):
+        with open(path, 'rb') as f:
+            self.assertEqual(hashlib.md5(f.read()).hexdigest(), hashlib.md5(data).hexdigest())
+
+    def test_cache_hit(self):
+        url, data = self.add_file('/image.raw', '"v1"')
+        path = self.cache.fetch(url)
+        self.assertCached(path, data)
+        self.assertEqual(self.cache.fetch(url), path)
+        self.assertEqual(len(self.get_requests('/image.raw')), 1)
+        self.assertEqual(self.cache.stats['hits'], 1)
+        self.assertEqual(self.cache.stats['misses'], 1)
+
+    def test_etag_change(self):
+        url, data = self.add_file('/image.raw', '"v1"')
+        first = self.cache.fetch(url)
+        url, new_data = self.add_file('/image.raw', '"v2"')
+        second = self.cache.fetch(url)
+        self.assertNotEqual(first, second)
+        self.assertCached(second, new_data)
+        self.assertEqual(len(self.get_requests('/image.raw')), 2)
+        self.assertEqual(self.cache.stats['misses'], 2)
+
+    def test_ranged_resume(self):
+        url, data = self.add_file('/image.raw', '"v1"')
+        half = self.SIZE / 2
+        self.server.truncate['/image.raw'] = half
+        path = self.cache.fetch(url)
+        self.assertCached(path, data)
+        requests = self.get_requests('/image.raw')
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(requests[1][1], 'bytes={0}-'.format(half))
+        self.assertEqual(self.cache.stats['bytes_downloaded'], self.SIZE)
+
+    def test_lru_eviction(self):
+        # Room for two entries, a third evicts the least recently used
+        self.cache.max_bytes = self.SIZE * 2 + self.SIZE / 2
+        url_a, data_a = self.add_file('/a.raw', '"a"')
+        url_b, data_b = self.add_file('/b.raw', '"b"')
+        url_c, data_c = self.add_file('/c.raw', '"c"')
+        path_a = self.cache.fetch(url_a)
+        path_b = self.cache.fetch(url_b)
+        now = time.time()
+        for path, age in [(path_a, 100), (path_b, 50)]:
+            used = os.path.join(os.path.dirname(path), 'used')
+            os.utime(used, (now - age, now - age))
+        # Using 'a' again makes 'b' the least recently used
+        self.assertEqual(self.cache.fetch(url_a), path_a)
+        path_c = self.cache.fetch(url_c)
+        self.assertCached(path_a, data_a)
+        self.assertCached(path_c, data_c)
+        self.assertFalse(os.path.exists(path_b))
+        self.assertEqual(self.cache.stats['evicted'], 1)
+        self.assertEqual(sorted(e['url'] for e in self.cache.get_entries()),
+                         sorted([url_a, url_c]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import select
+import socket
+import unittest
+from nephoria.testcase_utils import port_prober
+from nephoria.testcase_utils.port_prober import PortProber
+
+
+class CountingPoll(object):
+    calls = 0
+
+    def __init__(self):
+        self._poll = select.poll()
+
+    def register(self, fd, mask):
+        return self._poll.register(fd, mask)
+
+    def unregister(self, fd):
+        return self._poll.unregister(fd)
+
+    def poll(self, timeout):
+        CountingPoll.calls += 1
+        return self._poll.poll(timeout)
+
+
+class CountingSelect(object):
+    POLLOUT = select.POLLOUT
+    POLLERR = select.POLLERR
+    POLLHUP = select.POLLHUP
+    poll = CountingPoll
+
+
+class PortProberUnitTest(unittest.TestCase):
+    def setUp(self):
+        CountingPoll.calls = 0
+        port_prober.select = CountingSelect
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('0.0.0.0', 0))
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        port_prober.select = select
+        self.listener.close()
+
+    def get_targets(self, count):
+        # Every 127.x.x.x address reaches the listener, giving distinct targets
+        return [('127.0.{0}.{1}'.format(x / 250, x % 250 + 1), self.port)
+                for x in xrange(count)]
+
+    def test_more_targets_than_inflight_all_open(self):
+        self.listener.listen(512)
+        prober = PortProber(self.get_targets(60), connect_timeout=2, max_inflight=8)
+        results = prober.probe(timeout=10)
+        self.assertEqual(len(results), 60)
+        self.assertEqual(prober.get_unreachable(results), [])
+
+    def test_more_targets_than_inflight_pending_does_not_spin(self):
+        # Never accepted, once the small backlog is full further connects stay in progress
+        self.listener.listen(0)
+        prober = PortProber(self.get_targets(300), connect_timeout=0.5, retry_interval=0.1,
+                            max_inflight=16)
+        results = prober.probe(timeout=2)
+        self.assertEqual(len(results), 300)
+        self.assertTrue(prober.get_unreachable(results))
+        for result in results:
+            self.assertIn(result['status'], [PortProber.OPEN, PortProber.TIMEOUT,
+                                             PortProber.PENDING])
+        # Waiting on full in flight slots should block in poll, not busy loop
+        self.assertLess(CountingPoll.calls, 500)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -55,7 +55,8 @@ setup(name="nephoria",
                         'awacs',
                         'troposphere'],
       packages=find_packages(),
-      package_data={'cloudtests.cloud_admin.riak_cs.templates': ['*.template']},
+      package_data={'cloudtests.cloud_admin.riak_cs.templates': ['*.template'],
+                    'nephoria.testcases.s3': ['workload_profiles/*.yaml']},
       license='BSD (Simplified)',
       platforms='Posix; MacOS X; Windows',
       classifiers=['Development Status :: 3 - Alpha',
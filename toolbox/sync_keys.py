@@ -1,17 +1,37 @@
-from eutester.sshconnection import SshConnection
-from eutester.eulogger import Eulogger
+import argparse
 import re
 import subprocess
-keypath = '/root/.ssh/id_rsa.pub'
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from prettytable import PrettyTable
+from eutester.sshconnection import SshConnection
+from eutester.eulogger import Eulogger
 
-p = subprocess.Popen('cat {0}'.format(keypath), shell=True,
+parser = argparse.ArgumentParser(description='Add a public key to the authorized_keys of each '
+                                             'host found in a config_data file')
+parser.add_argument('--key-path', dest='key_path', default='/root/.ssh/id_rsa.pub',
+                    help='Public key to distribute, default:"/root/.ssh/id_rsa.pub"')
+parser.add_argument('--config', dest='config', default='config_data',
+                    help='File to read host ips from, default:"config_data"')
+parser.add_argument('--password', dest='password', default='foobar',
+                    help='Root password of the hosts')
+parser.add_argument('--workers', dest='workers', type=int, default=20,
+                    help='Max number of hosts updated concurrently, default:20')
+parser.add_argument('--timeout', dest='timeout', type=int, default=30,
+                    help='Per host connection and command timeout in seconds, default:30')
+args = parser.parse_args()
+
+p = subprocess.Popen('cat {0}'.format(args.key_path), shell=True,
                      stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-pub_key = p.stdout.read()
+pub_key = p.stdout.read().strip()
 result = p.wait()
 if result:
-    raise RuntimeError('Error reading in key at: "{0}", errcode:{1}'.format(keypath, result))
+    raise RuntimeError('Error reading in key at: "{0}", errcode:{1}'.format(args.key_path, result))
+if "'" in pub_key or "\n" in pub_key:
+    raise RuntimeError('Unexpected format of key at: "{0}"'.format(args.key_path))
 
-with open('config_data') as config_data:
+with open(args.config) as config_data:
     lines = config_data.readlines()
 
 ipset = set([])
@@ -20,12 +40,55 @@ ip_regex = re.compile("(^\s*\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})")
 for line in lines:
     match = ip_regex.match(line)
     if match:
-        ipset.add(match.groups()[0])
+        ipset.add(match.groups()[0].strip())
+
+# Only appends the key if the exact line is not already present, so re-running is safe
+add_key_cmd = ("mkdir -p ~/.ssh && chmod 700 ~/.ssh && touch ~/.ssh/authorized_keys && "
+               "if grep -qxF '{0}' ~/.ssh/authorized_keys; then echo KEY_PRESENT; "
+               "else echo '{0}' >> ~/.ssh/authorized_keys && echo KEY_ADDED; fi"
+               .format(pub_key))
+
+
+def sync_key(ip):
+    start = time.time()
+    ret = {'ip': ip, 'status': 'failed', 'result': '', 'error': '', 'elapsed': 0}
+    try:
+        logger = Eulogger(identifier=ip)
+        ssh = SshConnection(host=ip, password=args.password, timeout=args.timeout,
+                            debugmethod=logger.log.debug)
+        try:
+            out = ssh.sys(add_key_cmd, code=0, timeout=args.timeout, verbose=False)
+        finally:
+            ssh.close()
+        if 'KEY_ADDED' in out:
+            ret['result'] = 'added'
+        elif 'KEY_PRESENT' in out:
+            ret['result'] = 'present'
+        else:
+            raise RuntimeError('Unexpected output:"{0}"'.format("".join(out)))
+        ret['status'] = 'ok'
+    except Exception as E:
+        ret['error'] = str(E).strip().splitlines()[-1] if str(E).strip() else repr(E)
+    ret['elapsed'] = time.time() - start
+    return ret
 
-logger = Eulogger()
 
-for ip in ipset:
-    logger = Eulogger(identifier=ip)
-    ssh = SshConnection(host=ip, password='foobar', debugmethod=logger.log.debug)
-    ssh.sys("echo " + pub_key + " >> ~/.ssh/authorized_keys", code=0, verbose=True)
+start = time.time()
+results = []
+with ThreadPoolExecutor(max_workers=max(1, min(args.workers, len(ipset) or 1))) as executor:
+    futures = [executor.submit(sync_key, ip) for ip in ipset]
+    for future in as_completed(futures):
+        results.append(future.result())
 
+pt = PrettyTable(['IP', 'STATUS', 'RESULT', 'ELAPSED', 'ERROR'])
+pt.align = 'l'
+for res in sorted(results, key=lambda x: (x['status'], x['ip'])):
+    pt.add_row([res['ip'], res['status'], res['result'], '{0:.2f}'.format(res['elapsed']),
+                res['error']])
+failed = [res for res in results if res['status'] != 'ok']
+print pt
+print 'Hosts:{0}, added:{1}, already present:{2}, failed:{3}, elapsed:{4:.2f}'.format(
+    len(results), len([r for r in results if r['result'] == 'added']),
+    len([r for r in results if r['result'] == 'present']), len(failed), time.time() - start)
+if failed:
+    sys.exit(1)